@@ -0,0 +1,121 @@
+"""
+Admission control for OCR-heavy uploads.
+
+Each upload is charged its estimated page count while it is extracted. An
+upload that would take the pages in flight past OCR_MAX_INFLIGHT_PAGES, or
+its user's past OCR_MAX_USER_INFLIGHT_PAGES, waits up to OCR_ADMISSION_WAIT
+seconds for capacity and is then turned away; the caller answers 429 with
+the returned Retry-After. A job larger than a limit on its own is admitted
+when nothing else is in flight, so it is never starved outright.
+
+The accounting is per process, like the extraction executor it protects;
+with several web processes the limits apply to each.
+"""
+import asyncio
+import math
+import os
+import re
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+
+PDF_SCAN_BYTES = 32 * 1024 * 1024
+BYTES_PER_PAGE = 150 * 1024  # Fallback for PDFs whose page tree is compressed
+MAX_ESTIMATED_PAGES = 1000
+ADMISSION_POLL_INTERVAL = 0.1
+PAGE_COUNT_RE = re.compile(rb"/Type\s*/Pages\b[^>]*?/Count\s+(\d+)|/Count\s+(\d+)[^>]*?/Type\s*/Pages\b", re.S)
+PAGE_RE = re.compile(rb"/Type\s*/Page(?![a-zA-Z])")
+
+_lock = threading.Lock()
+_in_flight = Counter()  # user id -> pages
+ADMISSION_STATS = {
+    "in_flight_pages": 0,
+    "in_flight_jobs": 0,
+    "queued": 0,
+    "admitted": 0,
+    "waited": 0,
+    "rejected_global": 0,
+    "rejected_user": 0,
+}
+
+def estimate_pages(path):
+    """Page count of a PDF read from its page tree without rendering; 1 for images."""
+    with open(path, "rb") as f:
+        data = f.read(PDF_SCAN_BYTES)
+    if not data.startswith(b"%PDF"):
+        return 1
+    counts = [int(a or b) for a, b in PAGE_COUNT_RE.findall(data)]
+    pages = max(counts) if counts else len(PAGE_RE.findall(data))
+    if not pages:
+        pages = math.ceil(os.path.getsize(path) / BYTES_PER_PAGE)
+    return max(1, min(pages, MAX_ESTIMATED_PAGES))
+
+def _ocr_workers():
+    return settings.OCR_DAEMON_WORKERS if settings.OCR_DAEMON_SOCKET else settings.EXTRACTION_WORKERS
+
+def _retry_after():
+    # Time for the workers to get through what is in flight now.
+    seconds = ADMISSION_STATS["in_flight_pages"] * settings.OCR_SECONDS_PER_PAGE / max(1, _ocr_workers())
+    return max(1, math.ceil(seconds))
+
+def try_admit(user_id, pages):
+    """Charge pages to user_id if both limits allow it. Returns None, "global" or "user"."""
+    with _lock:
+        total = ADMISSION_STATS["in_flight_pages"]
+        if total and total + pages > settings.OCR_MAX_INFLIGHT_PAGES:
+            return "global"
+        own = _in_flight[user_id]
+        if own and own + pages > settings.OCR_MAX_USER_INFLIGHT_PAGES:
+            return "user"
+        _in_flight[user_id] += pages
+        ADMISSION_STATS["in_flight_pages"] += pages
+        ADMISSION_STATS["in_flight_jobs"] += 1
+        ADMISSION_STATS["admitted"] += 1
+        return None
+
+def release(user_id, pages):
+    with _lock:
+        _in_flight[user_id] -= pages
+        if _in_flight[user_id] <= 0:
+            del _in_flight[user_id]
+        ADMISSION_STATS["in_flight_pages"] -= pages
+        ADMISSION_STATS["in_flight_jobs"] -= 1
+
+async def admit(user_id, pages):
+    """
+    Admit an upload of pages, waiting briefly for capacity. Returns None once
+    admitted (call release() when its extraction ends) or the Retry-After
+    seconds when it is rejected.
+    """
+    refused = try_admit(user_id, pages)
+    if refused is None:
+        return None
+    deadline = time.monotonic() + settings.OCR_ADMISSION_WAIT
+    with _lock:
+        ADMISSION_STATS["queued"] += 1
+    try:
+        while time.monotonic() < deadline:
+            await asyncio.sleep(ADMISSION_POLL_INTERVAL)
+            refused = try_admit(user_id, pages)
+            if refused is None:
+                with _lock:
+                    ADMISSION_STATS["waited"] += 1
+                return None
+    finally:
+        with _lock:
+            ADMISSION_STATS["queued"] -= 1
+    with _lock:
+        ADMISSION_STATS[f"rejected_{refused}"] += 1
+        return _retry_after()
+
+def get_admission_stats():
+    """Snapshot of this process's admission counters and limits."""
+    with _lock:
+        return {
+            **ADMISSION_STATS,
+            "users_in_flight": len(_in_flight),
+            "max_inflight_pages": settings.OCR_MAX_INFLIGHT_PAGES,
+            "max_user_inflight_pages": settings.OCR_MAX_USER_INFLIGHT_PAGES,
+        }
@@ -1,6 +1,17 @@
+import os
+
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class ApiConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "api"
+
+    def ready(self):
+        # Registers the signal handlers for cached users and responses, the search index and profiling.
+        from . import auth_backends, profiling, response_cache, search  # noqa: F401
+
+        # Uploads are streamed here before being renamed into the invoice store.
+        if settings.FILE_UPLOAD_TEMP_DIR:
+            os.makedirs(settings.FILE_UPLOAD_TEMP_DIR, exist_ok=True)
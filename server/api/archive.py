@@ -0,0 +1,227 @@
+"""
+Archive tier for finished invoices.
+
+Invoices Closed or Paid for longer than ARCHIVE_AFTER_DAYS move from Invoice
+to ArchivedInvoice and keep their ids, so listings, aggregates and the
+search and duplicate indexes only carry live invoices. The archive is
+read-only. /api/archived-invoices/ serves it, and /api/invoices/ merges it in
+only when asked with ?include_archived=true.
+
+Files move out of the content-addressed store into one append-only bundle per
+invoice month under ARCHIVE_ROOT. Each file is compressed as its own member
+(zstd when the zstandard package is installed, zlib otherwise) and indexed by
+ArchivedFile (bundle, offset, length), so reading one never decompresses
+another. A file shared by several invoices (a split statement) is packed once.
+
+Every step of archive_batch() can be interrupted safely:
+- members are appended, read back and verified before they are indexed;
+- the rows move in one transaction;
+- hot blobs are deleted only after it commits, and only when no live invoice
+  still refers to them.
+An unindexed member is just dead bytes in its bundle, and sweep_hot_blobs()
+finishes an interrupted run.
+"""
+import datetime
+import hashlib
+import logging
+import mimetypes
+import os
+import zlib
+from operator import attrgetter
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.http import Http404, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+
+from .file_delivery import IMMUTABLE_MAX_AGE
+from .models import CLOSED_STATUSES, ArchivedFile, ArchivedInvoice, Invoice
+from .storage import content_hash, hash_file, invoice_storage
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+ZSTD_LEVEL = 19
+ZLIB_LEVEL = 9
+READ_CHUNK_SIZE = 1024 * 1024
+ARCHIVED_FIELDS = ("site_id", "vendor_id", "invoice_number", "invoice_date", "amount", "status", "page_start", "page_end", "created_at", "closed_at")
+
+def wants_archived(params):
+    return str(params.get("include_archived", "")).lower() in ("1", "true", "yes")
+
+# -------------------------------
+# Bundles
+# -------------------------------
+def default_codec():
+    return "zstd" if zstandard else "zlib"
+
+def _compressor(codec):
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+    return zlib.compressobj(ZLIB_LEVEL)
+
+def _decompressor(codec):
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("Install zstandard to read files archived with zstd")
+        return zstandard.ZstdDecompressor().decompressobj()
+    return zlib.decompressobj()
+
+def bundle_for(invoice_date):
+    return f"{invoice_date:%Y-%m}.bundle"
+
+def bundle_path(bundle):
+    return os.path.join(settings.ARCHIVE_ROOT, bundle)
+
+def iter_member(archived_file):
+    """The decompressed content of an archived file, in chunks."""
+    decompressor = _decompressor(archived_file.codec)
+    remaining = archived_file.length
+    with open(bundle_path(archived_file.bundle), "rb") as f:
+        f.seek(archived_file.offset)
+        while remaining:
+            chunk = f.read(min(READ_CHUNK_SIZE, remaining))
+            if not chunk:
+                raise ValueError(f"Bundle {archived_file.bundle} ends inside {archived_file.name}")
+            remaining -= len(chunk)
+            data = decompressor.decompress(chunk)
+            if data:
+                yield data
+    tail = decompressor.flush() if hasattr(decompressor, "flush") else b""
+    if tail:
+        yield tail
+
+def pack_file(path, name, digest, bundle):
+    """Append the file at path to bundle as one compressed member, verify it and index it."""
+    os.makedirs(settings.ARCHIVE_ROOT, exist_ok=True)
+    codec = default_codec()
+    compressor = _compressor(codec)
+    with open(bundle_path(bundle), "ab") as out, open(path, "rb") as source:
+        offset = out.seek(0, os.SEEK_END)
+        for chunk in iter(lambda: source.read(READ_CHUNK_SIZE), b""):
+            out.write(compressor.compress(chunk))
+        out.write(compressor.flush())
+        out.flush()
+        os.fsync(out.fileno())
+        length = out.tell() - offset
+    archived = ArchivedFile(
+        sha256=digest, name=name, bundle=bundle, offset=offset, length=length, size=os.path.getsize(path), codec=codec,
+    )
+    hasher = hashlib.sha256()
+    for chunk in iter_member(archived):
+        hasher.update(chunk)
+    if hasher.hexdigest() != digest:
+        raise ValueError(f"Archived copy of {name} does not match its content hash")
+    archived.save()
+    return archived
+
+# -------------------------------
+# Moving invoices
+# -------------------------------
+def archive_cutoff(days=None):
+    return timezone.now() - datetime.timedelta(days=settings.ARCHIVE_AFTER_DAYS if days is None else days)
+
+def archivable_invoices(cutoff):
+    """Invoices Closed or Paid since before cutoff; untracked closures count from creation."""
+    return Invoice.objects.filter(status__in=CLOSED_STATUSES).filter(
+        Q(closed_at__lt=cutoff) | Q(closed_at__isnull=True, created_at__lt=cutoff)
+    ).order_by("id")
+
+def _pack_invoice_file(invoice, packed):
+    name = invoice.invoice_file.name
+    digest = content_hash(name) or hash_file(invoice_storage.path(name))
+    archived = packed.get(digest) or ArchivedFile.objects.filter(sha256=digest).first()
+    if archived is None:
+        archived = pack_file(invoice_storage.path(name), name, digest, bundle_for(invoice.invoice_date))
+    packed[digest] = archived
+    return archived
+
+def archive_batch(invoices):
+    """
+    Move a list of invoices into the archive. Returns (number archived,
+    [(invoice id, error)]); an invoice whose file cannot be packed stays live.
+    """
+    packed = {}  # digest -> ArchivedFile
+    files = {}  # invoice id -> (stored name, ArchivedFile or None)
+    failures = []
+    for invoice in invoices:
+        if not invoice.invoice_file:
+            files[invoice.id] = ("", None)
+            continue
+        try:
+            files[invoice.id] = (invoice.invoice_file.name, _pack_invoice_file(invoice, packed))
+        except (OSError, ValueError) as e:
+            failures.append((invoice.id, str(e)))
+
+    with transaction.atomic():
+        # Re-read under lock: an invoice reopened or given a new file since it was selected stays live.
+        current = [
+            invoice for invoice in Invoice.objects.select_for_update().filter(pk__in=files, status__in=CLOSED_STATUSES)
+            if (invoice.invoice_file.name or "") == files[invoice.id][0]
+        ]
+        ArchivedInvoice.objects.bulk_create([
+            ArchivedInvoice(
+                id=invoice.id,
+                archived_file=files[invoice.id][1],
+                **{field: getattr(invoice, field) for field in ARCHIVED_FIELDS},
+            )
+            for invoice in current
+        ])
+        # Deleting fires the usual signals: tombstones for delta listings and vendor totals (which count the archive).
+        Invoice.objects.filter(pk__in=[invoice.id for invoice in current]).delete()
+    moved = {invoice.id for invoice in current}
+    failures.extend((invoice_id, "changed while being archived") for invoice_id in files if invoice_id not in moved)
+    sweep_hot_blobs(packed.values())
+    return len(current), failures
+
+def sweep_hot_blobs(archived_files):
+    """Delete the hot copies of archived files that no live invoice refers to any more. Returns how many."""
+    removed = 0
+    for archived in archived_files:
+        if Invoice.objects.filter(invoice_file=archived.name).exists():
+            continue
+        if invoice_storage.exists(archived.name):
+            invoice_storage.delete(archived.name)
+            removed += 1
+    return removed
+
+# -------------------------------
+# Reading the archive
+# -------------------------------
+def sort_like(items, ordering, row=lambda item: item):
+    """Sort items in place by a queryset's order_by fields ("-field" descending) of the instance row(item)."""
+    for field in reversed(ordering):
+        value = attrgetter(field.lstrip("-"))
+        items.sort(key=lambda item: value(row(item)), reverse=field.startswith("-"))
+    return items
+
+def serve_archived_file(request, archived_invoice):
+    """Stream an archived invoice's file, decompressed, with its content hash as a strong ETag."""
+    archived_file = archived_invoice.archived_file
+    if archived_file is None:
+        raise Http404("No file attached")
+    etag = f'"{archived_file.sha256}"'
+    version = request.GET.get("v")
+    if version and version == archived_file.sha256[:16]:
+        cache_control = f"private, max-age={IMMUTABLE_MAX_AGE}, immutable"
+    else:
+        cache_control = "private, no-cache"
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = StreamingHttpResponse(
+            iter_member(archived_file),
+            content_type=mimetypes.guess_type(archived_file.name)[0] or "application/octet-stream",
+        )
+        response["Content-Length"] = str(archived_file.size)
+        response["Content-Disposition"] = f'inline; filename="{os.path.basename(archived_file.name)}"'
+        # A member decompresses from its start, so byte ranges are not offered.
+        response["Accept-Ranges"] = "none"
+    response["ETag"] = etag
+    response["Cache-Control"] = cache_control
+    return response
@@ -0,0 +1,376 @@
+"""
+Async endpoints for invoice uploads and the listing reads.
+
+Under ASGI, Django receives request bodies without holding a thread, so a
+slow upload only costs a coroutine. The OCR pipeline runs on a bounded
+executor (EXTRACTION_WORKERS), database writes go through sync_to_async, and
+listings read with the async ORM.
+"""
+import asyncio
+import json
+import logging
+import os
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse, JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework.exceptions import APIException, ValidationError
+from rest_framework.parsers import BaseParser, DataAndFiles
+from rest_framework.request import Request, is_form_media_type
+from rest_framework.settings import api_settings
+
+from .admission import admit, estimate_pages, release
+from .archive import sort_like, wants_archived
+from .chunked_uploads import OffsetMismatch, append_chunk, discard_session, finalize_session, start_session
+from .duplicates import open_duplicate_flags
+from .filters import filter_invoices
+from .intake import extract_uploaded_invoice, find_stored_duplicate, save_extracted_invoice, save_statement_segments
+from .models import ArchivedInvoice, Invoice, UploadSession, site_resource
+from .ocr_daemon import OCRDaemonUnavailable
+from .serializers import ArchivedInvoiceSerializer, InvoiceSerializer, VendorSerializer
+from .scheduler import BULK, INTERACTIVE, estimate_cost, extraction_scheduler
+from .tenancy import scope_to_user, site_resources, user_site_id
+from .versioning import DeltaExpired, adeleted_since, aversioned_response, changed_rows, parse_changed_since
+from .views import InvoiceViewSet, VendorViewSet
+
+logger = logging.getLogger(__name__)
+
+class DeferredBodyParser(BaseParser):
+    """
+    Parser for the request wrapped by authenticate(). SessionAuthentication's
+    CSRF check reads the form token from POST: forms come from Django's own
+    parsing, and any other body is left unread for the view.
+    """
+    media_type = "*/*"
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        request = parser_context["request"]._request
+        if is_form_media_type(media_type):
+            return DataAndFiles(request.POST, request.FILES)
+        return DataAndFiles({}, {})
+
+def _authenticated_user(request):
+    drf_request = Request(
+        request,
+        parsers=[DeferredBodyParser()],
+        authenticators=[authenticator() for authenticator in api_settings.DEFAULT_AUTHENTICATION_CLASSES],
+    )
+    return drf_request.user
+
+async def authenticate(request):
+    """
+    Authenticate with the configured DEFAULT_AUTHENTICATION_CLASSES (bearer
+    tokens, browser sessions with their CSRF check) like the DRF views do;
+    returns an error response or None.
+    """
+    try:
+        user = await sync_to_async(_authenticated_user)(request)
+    except APIException as e:
+        return JsonResponse(e.detail if isinstance(e.detail, dict) else {"detail": e.detail}, status=e.status_code)
+    if not user.is_authenticated:
+        return JsonResponse({"detail": "Authentication credentials were not provided."}, status=401)
+    request.user = user
+    return None
+
+async def serialize_rows(serializer_class, queryset, request):
+    rows = [row async for row in queryset]
+    return serializer_class(rows, many=True, context={"request": request}).data
+
+def already_exists(invoice):
+    return JsonResponse({
+        "message": "Invoice already exists",
+        "invoice_id": invoice.id,
+        "is_new": False
+    }, status=200)
+
+def statement_saved(results):
+    """Response for a statement split into several invoices; results are (invoice, is_new) pairs."""
+    return JsonResponse({
+        "message": f"Statement split into {len(results)} invoices",
+        "is_new": any(is_new for _, is_new in results),
+        "invoices": [
+            {
+                "invoice_id": invoice.id,
+                "is_new": is_new,
+                "page_start": invoice.page_start,
+                "page_end": invoice.page_end,
+                "possible_duplicates": open_duplicate_flags(invoice) if is_new else [],
+            }
+            for invoice, is_new in results
+        ],
+    }, status=201 if any(is_new for _, is_new in results) else 200, encoder=DjangoJSONEncoder)
+
+# -------------------------------
+# Invoice File Upload Endpoint
+# -------------------------------
+@csrf_exempt
+async def upload_invoice(request):
+    if request.method != "POST":
+        return JsonResponse({"detail": f'Method "{request.method}" not allowed.'}, status=405)
+    error = await authenticate(request)
+    if error:
+        return error
+
+    # Multipart parsing writes the file to disk and hashes it; keep it off the event loop.
+    files = await sync_to_async(lambda: request.FILES, thread_sensitive=False)()
+    invoice_file = files.get('invoice_file')
+    if not invoice_file:
+        return JsonResponse({"error": "No file uploaded."}, status=400)
+    return await process_upload(request, invoice_file)
+
+async def process_upload(request, invoice_file):
+    """
+    Deduplicate, admit, extract and save an uploaded file on disk (it must
+    expose temporary_file_path() and sha256). Shared by the multipart and
+    chunked upload endpoints.
+    """
+    # Byte-identical re-uploads map to the same stored blob; skip OCR for them.
+    site_id = user_site_id(request.user)
+    existing_invoice = await sync_to_async(find_stored_duplicate)(invoice_file, site_id)
+    if existing_invoice:
+        return already_exists(existing_invoice)
+
+    # Charge the upload its page count against the OCR capacity before starting it.
+    path = invoice_file.temporary_file_path()
+    pages = await sync_to_async(estimate_pages, thread_sensitive=False)(path)
+    retry_after = await admit(request.user.pk, pages)
+    if retry_after:
+        response = JsonResponse({"error": "Too many invoices are being processed; try again shortly."}, status=429)
+        response["Retry-After"] = str(retry_after)
+        return response
+
+    try:
+        # Batch clients (backfills, folder imports) send ?priority=bulk and yield to single uploads.
+        job_class = BULK if request.GET.get("priority") == BULK else INTERACTIVE
+        job = extraction_scheduler().submit(
+            extract_uploaded_invoice, invoice_file, site_id, cost=estimate_cost(pages, os.path.getsize(path)), job_class=job_class,
+        )
+        try:
+            extracted, layout, ocr = await asyncio.wrap_future(job)
+        finally:
+            release(request.user.pk, pages)
+        if "segments" in extracted:
+            results = await sync_to_async(save_statement_segments)(invoice_file, site_id, extracted["segments"])
+            return await sync_to_async(statement_saved)(results)
+        invoice, is_new = await sync_to_async(save_extracted_invoice)(invoice_file, site_id, extracted, layout, ocr)
+    except OCRDaemonUnavailable as e:
+        logger.error(f"Invoice processing error: {e}")
+        return JsonResponse({"error": "Extraction service unavailable", "details": str(e)}, status=503)
+    except Exception as e:
+        logger.error(f"Invoice processing error: {str(e)}", exc_info=True)
+        return JsonResponse({
+            "error": "Failed to process invoice",
+            "details": str(e)
+        }, status=400)
+    if not is_new:
+        return already_exists(invoice)
+    possible_duplicates = await sync_to_async(open_duplicate_flags)(invoice)
+    return JsonResponse({
+        "message": "Invoice processed successfully",
+        "invoice_id": invoice.id,
+        "is_new": True,
+        "extracted_data": extracted,
+        "possible_duplicates": possible_duplicates
+    }, status=201, encoder=DjangoJSONEncoder)
+
+# -------------------------------
+# Chunked Upload Endpoints
+# -------------------------------
+def _json_body(request):
+    try:
+        body = json.loads(request.body or b"{}")
+    except ValueError:
+        body = None
+    if not isinstance(body, dict):
+        raise ValueError("Request body must be a JSON object")
+    return body
+
+def _session_state(session):
+    return {"upload_id": session.pk, "filename": session.filename, "size": session.size, "offset": session.received}
+
+@csrf_exempt
+async def start_chunked_upload(request):
+    """POST {"filename", "size", "sha256"?} opens a session; chunks then go to uploads/<id>/."""
+    if request.method != "POST":
+        return JsonResponse({"detail": f'Method "{request.method}" not allowed.'}, status=405)
+    error = await authenticate(request)
+    if error:
+        return error
+    try:
+        body = _json_body(request)
+        session = await sync_to_async(start_session)(
+            request.user.pk, body.get("filename"), body.get("size"), body.get("sha256"),
+        )
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    return JsonResponse({
+        **_session_state(session),
+        "max_chunk_size": settings.CHUNKED_UPLOAD_MAX_CHUNK_BYTES,
+    }, status=201)
+
+@csrf_exempt
+async def chunked_upload(request, upload_id):
+    """
+    GET reports the offset to resume from. PUT appends the body at the
+    Upload-Offset header, optionally verified against an Upload-Checksum
+    (hex SHA-256 of the chunk); a wrong offset gets 409 with the expected one.
+    DELETE cancels the upload.
+    """
+    error = await authenticate(request)
+    if error:
+        return error
+    try:
+        if request.method == "GET":
+            session = await UploadSession.objects.aget(pk=upload_id, user_id=request.user.pk)
+        elif request.method == "PUT":
+            try:
+                offset = int(request.headers.get("Upload-Offset", ""))
+                length = int(request.META.get("CONTENT_LENGTH") or 0)
+            except ValueError:
+                return JsonResponse({"error": "Upload-Offset and Content-Length are required"}, status=400)
+            session = await sync_to_async(append_chunk)(
+                upload_id, request.user.pk, offset, request, length, request.headers.get("Upload-Checksum", ""),
+            )
+        elif request.method == "DELETE":
+            session = await UploadSession.objects.aget(pk=upload_id, user_id=request.user.pk)
+            await sync_to_async(discard_session)(session)
+            return HttpResponse(status=204)
+        else:
+            return JsonResponse({"detail": f'Method "{request.method}" not allowed.'}, status=405)
+    except UploadSession.DoesNotExist:
+        return JsonResponse({"error": "Upload not found"}, status=404)
+    except OffsetMismatch as e:
+        return JsonResponse({"error": str(e), "offset": e.expected}, status=409)
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    return JsonResponse(_session_state(session))
+
+@csrf_exempt
+async def finalize_chunked_upload(request, upload_id):
+    """POST processes the assembled file like a multipart upload (honouring ?priority=bulk)."""
+    if request.method != "POST":
+        return JsonResponse({"detail": f'Method "{request.method}" not allowed.'}, status=405)
+    error = await authenticate(request)
+    if error:
+        return error
+    try:
+        session, invoice_file = await sync_to_async(finalize_session)(upload_id, request.user.pk)
+    except UploadSession.DoesNotExist:
+        return JsonResponse({"error": "Upload not found"}, status=404)
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    try:
+        response = await process_upload(request, invoice_file)
+    finally:
+        invoice_file.close()
+    # Keep the session when the server was only busy, so finalize can simply be retried.
+    if response.status_code not in (429, 503):
+        await sync_to_async(discard_session)(session)
+    return response
+
+# -------------------------------
+# Listing Endpoints
+# -------------------------------
+async def versioned_listing(request, resources, queryset, serializer_class, delta=None, filter_queryset=None, relations=()):
+    """
+    Full or ?changed_since= listing of queryset, scoped to the user's site
+    and narrowed by filter_queryset(queryset, params) when given.
+    delta(changed_since) may return a custom {"changed", "deleted"} payload
+    instead of the default. resources are unqualified ("invoice"); relations
+    are the lookup paths to the embedded ones (see VersionedListMixin).
+    """
+    error = await authenticate(request)
+    if error:
+        return error
+    queryset = scope_to_user(queryset, request.user)
+    resources = site_resources(resources, user_site_id(request.user))
+    try:
+        changed_since = parse_changed_since(request, resources)
+        if filter_queryset:
+            queryset = filter_queryset(queryset, request.GET)
+    except ValidationError as e:
+        return JsonResponse(e.detail, status=400)
+
+    async def build():
+        if changed_since is None:
+            return await serialize_rows(serializer_class, queryset, request)
+        if delta:
+            return await delta(changed_since)
+        deleted = await adeleted_since(resources[0], changed_since[0])
+        return {
+            "changed": await serialize_rows(serializer_class, changed_rows(queryset, changed_since, relations), request),
+            "deleted": deleted,
+        }
+    try:
+        return await aversioned_response(request, resources, build)
+    except DeltaExpired as e:
+        return JsonResponse({"detail": e.detail}, status=e.status_code)
+
+# Writes on the list routes stay on the synchronous DRF viewsets.
+_vendor_viewset = sync_to_async(VendorViewSet.as_view({"get": "list", "post": "create"}))
+_invoice_viewset = sync_to_async(InvoiceViewSet.as_view({"get": "list", "post": "create"}))
+
+@csrf_exempt
+async def vendor_list(request):
+    if request.method != "GET":
+        return await _vendor_viewset(request)
+    return await versioned_listing(request, ["vendor"], VendorViewSet.queryset.all(), VendorSerializer)
+
+@csrf_exempt
+async def invoice_list(request):
+    if request.method != "GET":
+        return await _invoice_viewset(request)
+    queryset = InvoiceViewSet.queryset.select_related("vendor")
+    if wants_archived(request.GET):
+        return await merged_invoice_listing(request, queryset)
+    return await versioned_listing(
+        request, ["invoice", "vendor"], queryset, InvoiceSerializer, filter_queryset=filter_invoices, relations=["vendor"],
+    )
+
+async def merged_invoice_listing(request, queryset):
+    """
+    Live and archived invoices in one listing, in the live listing's order.
+    Archiving deletes live rows, so the invoice version still changes with
+    every write the listing could show.
+    """
+    error = await authenticate(request)
+    if error:
+        return error
+    if "changed_since" in request.GET:
+        return JsonResponse({"changed_since": "Not available with include_archived; archived invoices never change."}, status=400)
+    archived = ArchivedInvoice.objects.select_related("vendor").order_by("-created_at")
+    try:
+        live = filter_invoices(scope_to_user(queryset, request.user), request.GET)
+        archived = filter_invoices(scope_to_user(archived, request.user), request.GET)
+    except ValidationError as e:
+        return JsonResponse(e.detail, status=400)
+
+    async def build():
+        live_rows = [row async for row in live]
+        archived_rows = [row async for row in archived]
+        context = {"request": request}
+        rows = list(zip(live_rows, InvoiceSerializer(live_rows, many=True, context=context).data))
+        rows += zip(archived_rows, ArchivedInvoiceSerializer(archived_rows, many=True, context=context).data)
+        return [data for _, data in sort_like(rows, live.query.order_by, row=lambda pair: pair[0])]
+    return await aversioned_response(request, site_resources(["invoice", "vendor"], user_site_id(request.user)), build)
+
+async def pending_invoices(request):
+    if request.method != "GET":
+        return JsonResponse({"detail": f'Method "{request.method}" not allowed.'}, status=405)
+    pending = Invoice.objects.filter(status="Pending for review").select_related("vendor")
+
+    async def delta(changed_since):
+        # Runs after versioned_listing() authenticated the request, so the user's site is known.
+        deleted = await adeleted_since(site_resource("invoice", user_site_id(request.user)), changed_since[0])
+        changed = scope_to_user(Invoice.objects.filter(row_version__gt=changed_since[0]), request.user)
+        # Invoices that left review since then must drop out of the client's list too.
+        left_review = [pk async for pk in changed.exclude(status="Pending for review").values_list('id', flat=True)]
+        return {
+            "changed": await serialize_rows(
+                InvoiceSerializer, changed_rows(scope_to_user(pending, request.user), changed_since, ["vendor"]), request,
+            ),
+            "deleted": deleted + left_review,
+        }
+    return await versioned_listing(request, ["invoice", "vendor"], pending, InvoiceSerializer, delta, relations=["vendor"])
@@ -1,14 +1,134 @@
+import threading
+import time
+
 from django.contrib.auth.backends import ModelBackend
-from api.models import CustomUser
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.serializers import TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+from api.models import CustomUser, normalize_login_email
 
 class EmailAuthBackend(ModelBackend):
     """
     Authenticate using email instead of username.
     """
     def authenticate(self, request, username=None, password=None, **kwargs):
+        email = normalize_login_email(username)
+        if not email:
+            return None
         try:
-            user = CustomUser.objects.get(email=username)
+            user = CustomUser.objects.get(email_normalized=email)
             if user.check_password(password):
                 return user
         except CustomUser.DoesNotExist:
             return None
+
+# -------------------------------
+# Cached JWT user resolution
+# -------------------------------
+USER_CACHE_TTL = 30  # Seconds a resolved user is trusted without re-reading the DB
+USER_CACHE_MAX_ENTRIES = 10000
+
+_user_cache_lock = threading.Lock()
+_user_cache = {}  # str(user id) -> (expires_at, CachedUser or None)
+
+class CachedUser:
+    """
+    The part of a user that request handling needs (id, site, role, active flag),
+    resolved from a per-process cache instead of a DB read per request.
+    It is not a model instance and cannot be saved.
+    """
+    is_authenticated = True
+    is_anonymous = False
+
+    def __init__(self, user):
+        self.id = self.pk = user.pk
+        self.username = user.username
+        self.email = user.email
+        self.role = user.role
+        self.site_id = user.site_id
+        self.is_active = user.is_active
+        self.is_staff = user.is_staff
+        self.is_superuser = user.is_superuser
+
+    def __str__(self):
+        return self.username
+
+    def __eq__(self, other):
+        return getattr(other, "pk", None) == self.pk
+
+    def __hash__(self):
+        return hash(self.pk)
+
+def resolve_user(user_id):
+    """Return the CachedUser for user_id, or None if no such user exists."""
+    # Token claims carry the id as a string; model signals as an int.
+    key = str(user_id)
+    now = time.monotonic()
+    with _user_cache_lock:
+        entry = _user_cache.get(key)
+        if entry and entry[0] > now:
+            return entry[1]
+    user = (
+        CustomUser.objects.filter(pk=user_id)
+        .only("id", "username", "email", "role", "site_id", "is_active", "is_staff", "is_superuser")
+        .first()
+    )
+    cached = CachedUser(user) if user else None
+    with _user_cache_lock:
+        if len(_user_cache) >= USER_CACHE_MAX_ENTRIES:
+            _user_cache.clear()
+        _user_cache[key] = (now + USER_CACHE_TTL, cached)
+    return cached
+
+def invalidate_user(user_id):
+    with _user_cache_lock:
+        _user_cache.pop(str(user_id), None)
+
+@receiver(post_save, sender=CustomUser)
+@receiver(post_delete, sender=CustomUser)
+def invalidate_cached_user(sender, instance, **kwargs):
+    # Other processes pick the change up when their entry's TTL runs out.
+    invalidate_user(instance.pk)
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """JWTAuthentication that resolves the token's user through the per-process cache."""
+    def get_user(self, validated_token):
+        if api_settings.CHECK_REVOKE_TOKEN:
+            # Revocation compares password hashes, which the cache does not keep.
+            return super().get_user(validated_token)
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError as e:
+            raise InvalidToken(_("Token contained no recognizable user identification")) from e
+        user = resolve_user(user_id)
+        if user is None:
+            raise AuthenticationFailed(_("User not found"), code="user_not_found")
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+        return user
+
+class CachedTokenRefreshSerializer(TokenRefreshSerializer):
+    """
+    Token refresh that checks the user through the cache and rotates the
+    refresh token statelessly: no user read and no blacklist write per refresh.
+    """
+    def validate(self, attrs):
+        refresh = self.token_class(attrs["refresh"])
+
+        user_id = refresh.payload.get(api_settings.USER_ID_CLAIM, None)
+        if user_id:
+            user = resolve_user(user_id)
+            if user is None or not user.is_active:
+                raise AuthenticationFailed(self.error_messages["no_active_account"], "no_active_account")
+
+        data = {"access": str(refresh.access_token)}
+        if api_settings.ROTATE_REFRESH_TOKENS:
+            refresh.set_jti()
+            refresh.set_exp()
+            refresh.set_iat()
+            data["refresh"] = str(refresh)
+        return data
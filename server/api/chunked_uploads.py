@@ -0,0 +1,163 @@
+"""
+Resumable chunked uploads.
+
+A client opens a session with the file's name and size (and optionally its
+SHA-256), then appends chunks in order, each at the offset the server has
+confirmed so far. Chunks are copied straight into a .part file under
+CHUNKED_UPLOAD_DIR while a running SHA-256 is updated; a chunk that arrives
+short, fails its Upload-Checksum or hits an error is cut back off the file,
+so a retry or resume always continues from the last good offset.
+
+The running hash lives in the process that took the last chunk. When the next
+chunk lands in another process (or after a restart), the hash is rebuilt by
+reading the part file back from disk in blocks.
+
+Finalizing checks the size and digest and wraps the part file as an uploaded
+file exposing `sha256` and `temporary_file_path()`, so the normal upload
+pipeline stores it with a rename, as it does for multipart uploads.
+"""
+import hashlib
+import logging
+import os
+import threading
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import UploadSession
+from .storage import HASH_CHUNK_SIZE, StagedUpload
+
+logger = logging.getLogger(__name__)
+
+COPY_CHUNK_SIZE = 64 * 1024
+
+_hashers_lock = threading.Lock()
+_hashers = {}  # session id -> (offset, running sha256 of the part file up to it)
+
+class OffsetMismatch(Exception):
+    """A chunk was sent for an offset other than the session's; carries the expected one."""
+    def __init__(self, expected):
+        super().__init__(f"Expected offset {expected}")
+        self.expected = expected
+
+def part_path(session):
+    return os.path.join(settings.CHUNKED_UPLOAD_DIR, f"{session.pk}.part")
+
+def discard_session(session):
+    """Delete a session and whatever is left of its part file."""
+    with _hashers_lock:
+        _hashers.pop(session.pk, None)
+    path = part_path(session)
+    if os.path.exists(path):
+        os.remove(path)
+    session.delete()
+
+def purge_expired_sessions():
+    cutoff = timezone.now() - settings.CHUNKED_UPLOAD_EXPIRY
+    for session in UploadSession.objects.filter(updated_at__lt=cutoff):
+        logger.info(f"Discarding expired upload {session.pk} ({session.received}/{session.size} bytes)")
+        discard_session(session)
+
+def start_session(user_id, filename, size, sha256=""):
+    """Open an upload session. Raises ValueError for an unacceptable request."""
+    filename = os.path.basename(filename or "").strip()
+    if not filename:
+        raise ValueError("filename is required")
+    if not isinstance(size, int) or isinstance(size, bool) or size <= 0:
+        raise ValueError("size must be a positive number of bytes")
+    if size > settings.CHUNKED_UPLOAD_MAX_BYTES:
+        raise ValueError(f"Files over {settings.CHUNKED_UPLOAD_MAX_BYTES} bytes are not accepted")
+    sha256 = (sha256 or "").lower()
+    if sha256 and (len(sha256) != 64 or any(c not in "0123456789abcdef" for c in sha256)):
+        raise ValueError("sha256 must be a hex digest")
+
+    purge_expired_sessions()
+    if UploadSession.objects.filter(user_id=user_id).count() >= settings.CHUNKED_UPLOAD_MAX_SESSIONS:
+        raise ValueError("Too many uploads in progress; finish or cancel one first")
+    os.makedirs(settings.CHUNKED_UPLOAD_DIR, exist_ok=True)
+    session = UploadSession.objects.create(user_id=user_id, filename=filename[-255:], size=size, sha256=sha256)
+    open(part_path(session), "wb").close()
+    return session
+
+def _running_hash(session, path):
+    """SHA-256 state of the part file's first session.received bytes."""
+    with _hashers_lock:
+        cached = _hashers.get(session.pk)
+    if cached and cached[0] == session.received:
+        return cached[1]
+    hasher = hashlib.sha256()
+    remaining = session.received
+    with open(path, "rb") as f:
+        while remaining:
+            block = f.read(min(HASH_CHUNK_SIZE, remaining))
+            if not block:
+                raise ValueError("Upload data is missing on disk; start the upload again")
+            hasher.update(block)
+            remaining -= len(block)
+    return hasher
+
+def append_chunk(session_id, user_id, offset, stream, length, checksum=""):
+    """
+    Copy length bytes from stream into the session's part file at offset.
+    Returns the updated session. Raises UploadSession.DoesNotExist,
+    OffsetMismatch, or ValueError for a bad or incomplete chunk; nothing past
+    the previous offset is kept in either case.
+    """
+    if length <= 0:
+        raise ValueError("Chunk is empty")
+    if length > settings.CHUNKED_UPLOAD_MAX_CHUNK_BYTES:
+        raise ValueError(f"Chunks are limited to {settings.CHUNKED_UPLOAD_MAX_CHUNK_BYTES} bytes")
+    with transaction.atomic():
+        # The row lock serializes retries of the same chunk arriving at once.
+        session = UploadSession.objects.select_for_update().get(pk=session_id, user_id=user_id)
+        if offset != session.received:
+            raise OffsetMismatch(session.received)
+        if offset + length > session.size:
+            raise ValueError(f"Chunk runs past the declared size of {session.size} bytes")
+
+        path = part_path(session)
+        hasher = _running_hash(session, path).copy()
+        chunk_hasher = hashlib.sha256()
+        with open(path, "r+b") as f:
+            # Drop anything a failed earlier attempt left past the last good offset.
+            f.truncate(offset)
+            f.seek(offset)
+            try:
+                written = 0
+                while written < length:
+                    block = stream.read(min(COPY_CHUNK_SIZE, length - written))
+                    if not block:
+                        raise ValueError(f"Chunk ended after {written} of {length} bytes")
+                    f.write(block)
+                    hasher.update(block)
+                    chunk_hasher.update(block)
+                    written += len(block)
+                if checksum and chunk_hasher.hexdigest() != checksum.lower():
+                    raise ValueError("Chunk checksum mismatch")
+            except BaseException:
+                f.truncate(offset)
+                raise
+
+        session.received = offset + length
+        session.save(update_fields=["received", "updated_at"])
+    with _hashers_lock:
+        _hashers[session.pk] = (session.received, hasher)
+    return session
+
+def finalize_session(session_id, user_id):
+    """
+    Check a complete session's size and digest. Returns (session,
+    StagedUpload); close the upload when done. A digest mismatch discards
+    the session, since its data cannot be resumed; raises ValueError then and
+    for an incomplete upload.
+    """
+    session = UploadSession.objects.get(pk=session_id, user_id=user_id)
+    if session.received != session.size:
+        raise ValueError(f"Upload is incomplete: {session.received} of {session.size} bytes received")
+    path = part_path(session)
+    digest = _running_hash(session, path).hexdigest()
+    if session.sha256 and digest != session.sha256:
+        discard_session(session)
+        raise ValueError("File checksum mismatch; start the upload again")
+    return session, StagedUpload(path, session.filename, session.size, digest)
@@ -0,0 +1,170 @@
+"""
+Near-duplicate detection for re-scanned invoices.
+
+A second scan of the same paper has different bytes and often a slightly
+different OCR'd invoice number, so neither the file hash nor the
+(vendor, invoice_number) check sees it. Instead each invoice's OCR text is
+reduced to a MinHash signature over word shingles; the fraction of equal
+signature values estimates the Jaccard similarity of the two texts.
+
+The signature is split into BANDS bands of ROWS values and each band is
+hashed into a SketchBucket row. Two invoices land in a common bucket with
+probability 1 - (1 - s**ROWS)**BANDS, about 0.99 at s = 0.7 and 0.1 at
+s = 0.3, so a check is BANDS indexed lookups plus at most MAX_CANDIDATES
+signature comparisons however many invoices are stored. Invoices printed
+from one layout share many buckets, so the lookup already keeps only those
+with a close amount and date, most shared buckets first, before the cap. A
+candidate is flagged when the texts are similar and the amounts and dates
+are close.
+"""
+import datetime
+import hashlib
+import logging
+import random
+import struct
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count
+
+from .models import DuplicateFlag, InvoiceSketch, SketchBucket
+from .search import tokenize
+
+logger = logging.getLogger(__name__)
+
+NUM_HASHES = 64
+BANDS = 16
+ROWS = NUM_HASHES // BANDS
+SHINGLE_SIZE = 3  # Words per shingle
+MIN_SHINGLES = 8  # Shorter texts (failed OCR, a few zones) say nothing about identity
+MAX_CANDIDATES = 50
+SIMILARITY_THRESHOLD = 0.6
+AMOUNT_TOLERANCE = Decimal("0.01")  # Relative; also absorbs OCR dropping a cent
+DATE_WINDOW_DAYS = 10
+SIGNATURE_FORMAT = f"<{NUM_HASHES}I"
+UNAPPROVED_STATUSES = ("Pending for review", "Pending for approval")
+
+_PRIME = (1 << 61) - 1
+# Fixed seed: stored signatures are only comparable with the same permutations.
+_rng = random.Random(20250207)
+_PERMUTATIONS = [(_rng.randrange(1, _PRIME), _rng.randrange(0, _PRIME)) for _ in range(NUM_HASHES)]
+
+# -------------------------------
+# Sketches
+# -------------------------------
+def _hash64(data):
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "big")
+
+def compute_signature(text):
+    """MinHash signature of the text's word shingles, or None when the text is too short."""
+    words = tokenize(text)
+    shingles = {
+        _hash64(" ".join(words[i:i + SHINGLE_SIZE]).encode()) % _PRIME
+        for i in range(len(words) - SHINGLE_SIZE + 1)
+    }
+    if len(shingles) < MIN_SHINGLES:
+        return None
+    return tuple(
+        min((a * shingle + b) % _PRIME for shingle in shingles) & 0xFFFFFFFF
+        for a, b in _PERMUTATIONS
+    )
+
+def similarity(signature, other):
+    return sum(x == y for x, y in zip(signature, other)) / NUM_HASHES
+
+def band_buckets(signature):
+    """One signed 64-bit bucket per band; the band number is hashed in so bands never collide."""
+    return [
+        int.from_bytes(
+            hashlib.blake2b(struct.pack(f"<H{ROWS}I", band, *signature[band * ROWS:(band + 1) * ROWS]), digest_size=8).digest(),
+            "big",
+            signed=True,
+        )
+        for band in range(BANDS)
+    ]
+
+def store_sketch(invoice, signature):
+    with transaction.atomic():
+        InvoiceSketch.objects.update_or_create(invoice=invoice, defaults={"signature": struct.pack(SIGNATURE_FORMAT, *signature)})
+        SketchBucket.objects.filter(invoice=invoice).delete()
+        SketchBucket.objects.bulk_create([SketchBucket(bucket=bucket, invoice=invoice) for bucket in band_buckets(signature)])
+
+# -------------------------------
+# Matching
+# -------------------------------
+def _amounts_close(amount, other):
+    return abs(amount - other) <= max(abs(other) * AMOUNT_TOLERANCE, Decimal("0.01"))
+
+def _dates_close(date, other):
+    return abs((date - other).days) <= DATE_WINDOW_DAYS
+
+def _as_date(value):
+    # Invoices created from extracted fields still hold the ISO string.
+    return value if isinstance(value, datetime.date) else datetime.date.fromisoformat(str(value)[:10])
+
+def find_near_duplicates(invoice, signature):
+    """Stored invoices of the same site whose text, amount and date all match invoice closely, as [(invoice, similarity)], best first."""
+    amount, date = Decimal(str(invoice.amount)), _as_date(invoice.invoice_date)
+    # Every amount _amounts_close() accepts: |a - o| <= |o| * t implies |a - o| <= |a| * t / (1 - t).
+    slack = max(abs(amount) * AMOUNT_TOLERANCE / (1 - AMOUNT_TOLERANCE), Decimal("0.01"))
+    window = datetime.timedelta(days=DATE_WINDOW_DAYS)
+    # Same-layout invoices of a vendor share buckets, so the amount and date
+    # windows narrow the candidates before the cap, and the most similar come first.
+    candidate_ids = list(
+        SketchBucket.objects.filter(
+            bucket__in=band_buckets(signature),
+            invoice__site_id=invoice.site_id,
+            invoice__amount__range=(amount - slack, amount + slack),
+            invoice__invoice_date__range=(date - window, date + window),
+        )
+        .exclude(invoice=invoice)
+        .values("invoice_id")
+        .annotate(bands=Count("id"))
+        .order_by("-bands", "-invoice_id")
+        .values_list("invoice_id", flat=True)[:MAX_CANDIDATES]
+    )
+    matches = []
+    for sketch in InvoiceSketch.objects.filter(invoice_id__in=candidate_ids).select_related("invoice"):
+        score = similarity(signature, struct.unpack(SIGNATURE_FORMAT, bytes(sketch.signature)))
+        other = sketch.invoice
+        if (
+            score >= SIMILARITY_THRESHOLD
+            and _amounts_close(amount, other.amount)
+            and _dates_close(date, other.invoice_date)
+        ):
+            matches.append((other, score))
+    return sorted(matches, key=lambda match: -match[1])
+
+def check_invoice_text(invoice, text, flag=True):
+    """
+    Sketch invoice's OCR text and, when flag is set, record a DuplicateFlag
+    for every near-duplicate already stored. Returns the flags created.
+    """
+    signature = compute_signature(text)
+    if signature is None:
+        return []
+    matches = find_near_duplicates(invoice, signature) if flag else []
+    store_sketch(invoice, signature)
+    flags = []
+    for other, score in matches:
+        duplicate_flag, created = DuplicateFlag.objects.get_or_create(
+            invoice=invoice, duplicate_of=other, defaults={"similarity": score},
+        )
+        if created:
+            logger.warning(f"Invoice {invoice.id} may duplicate invoice {other.id} (similarity {score:.2f})")
+            flags.append(duplicate_flag)
+    return flags
+
+def open_duplicate_flags(invoice):
+    """Undismissed flags of invoice, as JSON-ready dicts."""
+    return [
+        {
+            "duplicate_of": flag.duplicate_of_id,
+            "invoice_number": flag.duplicate_of.invoice_number,
+            "invoice_date": flag.duplicate_of.invoice_date,
+            "amount": flag.duplicate_of.amount,
+            "status": flag.duplicate_of.status,
+            "similarity": round(flag.similarity, 2),
+        }
+        for flag in invoice.duplicate_flags.filter(dismissed=False).select_related("duplicate_of")
+    ]
@@ -0,0 +1,295 @@
+"""
+Benchmark harness for the invoice extraction paths.
+
+Every distinct PDF/image under the samples folder (byte-identical copies are
+run once) goes through the OCR paths, and the recorded Textract response goes
+through the Textract field mapping. For each path the harness records wall
+time per document, exclusive time per stage (a stage excludes the stages it
+calls), pages/sec and peak RSS, and scores the extracted fields against the
+checked-in golden results, which hold the true values of every sample.
+Summaries can be saved as a baseline and later runs checked against it.
+
+Peak RSS is a process-wide high-water mark, so run_path_isolated() runs each
+path in a fresh interpreter and reports that interpreter's peak.
+"""
+import functools
+import json
+import mimetypes
+import multiprocessing
+import os
+import resource
+import statistics
+import time
+from collections import defaultdict
+from decimal import Decimal, InvalidOperation
+
+import pytesseract
+from django.conf import settings
+from django.core.files import File
+
+from . import hybrid_invoice_extractor as extractor
+from .storage import hash_file
+
+SAMPLES_DIR = settings.BASE_DIR / "invoices"
+TEXTRACT_FIXTURE = settings.BASE_DIR / "textract_response.json"
+GOLDEN_PATH = settings.BASE_DIR / "benchmarks" / "extraction_golden.json"
+COMPARED_FIELDS = extractor.REQUIRED_FIELDS
+SAMPLE_TYPES = ("application/pdf", "image/jpeg", "image/png")
+
+# Stage -> (module, functions). Patched for the duration of a run.
+STAGES = {
+    "render": (extractor, ("convert_pdf", "pdf_page_count", "open_image")),
+    "preprocess": (extractor, ("prepare_page",)),
+    "ocr": (pytesseract, ("image_to_string", "image_to_data", "image_to_osd")),
+    "parse": (extractor, ("extract_invoice_fields_universal", "find_required_fields")),
+}
+
+class StageTimer:
+    """Context manager accumulating exclusive wall time per stage. Not thread-safe."""
+
+    def __init__(self):
+        self.totals = defaultdict(float)
+        self._children = []
+        self._originals = []
+
+    def _wrap(self, stage, func):
+        @functools.wraps(func)
+        def timed(*args, **kwargs):
+            self._children.append(0.0)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                self.totals[stage] += elapsed - self._children.pop()
+                if self._children:
+                    self._children[-1] += elapsed
+        return timed
+
+    def take(self):
+        totals, self.totals = dict(self.totals), defaultdict(float)
+        return totals
+
+    def __enter__(self):
+        for stage, (module, names) in STAGES.items():
+            for name in names:
+                func = getattr(module, name)
+                self._originals.append((module, name, func))
+                setattr(module, name, self._wrap(stage, func))
+        return self
+
+    def __exit__(self, *exc_info):
+        for module, name, func in reversed(self._originals):
+            setattr(module, name, func)
+        self._originals = []
+
+class SampleFile(File):
+    """A local file handed to the extractor by path, the way streamed uploads are."""
+
+    def temporary_file_path(self):
+        return self.file.name
+
+# -------------------------------
+# Samples and Paths
+# -------------------------------
+def find_samples(samples_dir=SAMPLES_DIR, textract_fixture=TEXTRACT_FIXTURE):
+    """Return the benchmark samples: one per distinct document, plus the Textract fixture."""
+    samples = []
+    seen = set()
+    for name in sorted(os.listdir(samples_dir)):
+        path = os.path.join(samples_dir, name)
+        if not os.path.isfile(path) or mimetypes.guess_type(name)[0] not in SAMPLE_TYPES:
+            continue
+        digest = hash_file(path)
+        if digest in seen:
+            continue
+        seen.add(digest)
+        samples.append({"id": name, "kind": "document", "path": path})
+    if textract_fixture and os.path.exists(textract_fixture):
+        samples.append({"id": os.path.basename(textract_fixture), "kind": "textract", "path": str(textract_fixture)})
+    return samples
+
+def sample_pages(sample):
+    if sample["kind"] == "textract":
+        with open(sample["path"], encoding="utf-8") as f:
+            return json.load(f).get("DocumentMetadata", {}).get("Pages", 1)
+    if mimetypes.guess_type(sample["path"])[0] == "application/pdf":
+        return extractor.pdf_page_count(sample["path"])
+    return 1
+
+def run_hybrid(sample):
+    with SampleFile(open(sample["path"], "rb")) as f:
+        return extractor.extract_invoice_data_hybrid(f)
+
+def run_zoned(sample):
+    with SampleFile(open(sample["path"], "rb")) as f:
+        return extractor.extract_invoice_data_zoned(extractor.load_zone_pages(f)) or {}
+
+def run_fullpage(sample):
+    with SampleFile(open(sample["path"], "rb")) as f:
+        return extractor.extract_invoice_fields_universal(extractor.extract_text(f))
+
+def run_textract(sample):
+    # Imported here: textract_utils needs boto3, which only this path uses.
+    from .textract_utils import textract_fields
+    with open(sample["path"], encoding="utf-8") as f:
+        return textract_fields(json.load(f))
+
+# Path -> (sample kind, runner)
+PATHS = {
+    "hybrid": ("document", run_hybrid),
+    "zoned": ("document", run_zoned),
+    "fullpage": ("document", run_fullpage),
+    "textract": ("textract", run_textract),
+}
+
+# -------------------------------
+# Scoring
+# -------------------------------
+def normalize_field(field, value):
+    if value is None or str(value).strip() == "":
+        return None
+    text = " ".join(str(value).split())
+    if field == "amount":
+        try:
+            return str(Decimal(text.replace("$", "").replace(",", "")).quantize(Decimal("0.01")))
+        except InvalidOperation:
+            return text
+    if field == "invoice_date":
+        return text[:10]
+    return text.casefold()
+
+def load_golden(path=GOLDEN_PATH):
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+def save_golden(golden, path=GOLDEN_PATH):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(golden, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+def score_fields(fields, expected):
+    """Return (matching, compared) field counts against a golden entry."""
+    compared = matching = 0
+    for field in COMPARED_FIELDS:
+        if field not in expected:
+            continue
+        compared += 1
+        if normalize_field(field, fields.get(field)) == normalize_field(field, expected[field]):
+            matching += 1
+    return matching, compared
+
+# -------------------------------
+# Running
+# -------------------------------
+def peak_rss_mb():
+    """Peak RSS of this process and of its largest finished child (tesseract, poppler), in MB."""
+    # ru_maxrss is in kilobytes on Linux.
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+    return round(own, 1), round(children, 1)
+
+def _run_path_child(path_name, samples, golden, repeat):
+    import django
+    django.setup()
+    return run_path(path_name, samples, golden, repeat), peak_rss_mb()
+
+def run_path_isolated(path_name, samples, golden, repeat=1):
+    """run_path() in a fresh interpreter. Returns (results, (own, child) peak RSS in MB) of that run alone."""
+    with multiprocessing.get_context("spawn").Pool(1) as pool:
+        return pool.apply(_run_path_child, (path_name, samples, golden, repeat))
+
+def run_path(path_name, samples, golden, repeat=1):
+    """Run one extraction path over its samples. Returns the per-run results."""
+    kind, runner = PATHS[path_name]
+    results = []
+    with StageTimer() as timer:
+        for sample in samples:
+            if sample["kind"] != kind:
+                continue
+            try:
+                pages = sample_pages(sample)
+            except Exception as e:
+                results.append({"sample": sample["id"], "path": path_name, "error": f"page count: {e}"})
+                continue
+            for _ in range(repeat):
+                timer.take()
+                start = time.perf_counter()
+                error = None
+                try:
+                    fields = runner(sample)
+                except Exception as e:
+                    fields, error = {}, str(e)
+                seconds = time.perf_counter() - start
+                fields = {field: fields.get(field) for field in COMPARED_FIELDS}
+                matching, compared = score_fields(fields, golden.get(sample["id"], {}))
+                results.append({
+                    "sample": sample["id"],
+                    "path": path_name,
+                    "pages": pages,
+                    "seconds": seconds,
+                    "stages": timer.take(),
+                    "fields": {field: None if value is None else str(value) for field, value in fields.items()},
+                    "matching": matching,
+                    "compared": compared,
+                    "error": error,
+                })
+    return results
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def summarize(results, rss=None):
+    """Aggregate one path's results; rss is the run's (own, child) peak in MB, this process's by default."""
+    timed = [result for result in results if "seconds" in result]
+    seconds = [result["seconds"] for result in timed]
+    pages = sum(result["pages"] for result in timed)
+    stages = defaultdict(float)
+    for result in timed:
+        for stage, value in result["stages"].items():
+            stages[stage] += value
+    compared = sum(result["compared"] for result in timed)
+    own_rss, child_rss = rss or peak_rss_mb()
+    total = sum(seconds)
+    return {
+        "runs": len(timed),
+        "errors": sum(1 for result in results if result.get("error")),
+        "pages": pages,
+        "seconds": round(total, 3),
+        "pages_per_sec": round(pages / total, 3) if total else None,
+        "p50_seconds": round(statistics.median(seconds), 3) if seconds else None,
+        "p95_seconds": round(percentile(seconds, 0.95), 3) if seconds else None,
+        "stages": {stage: round(value, 3) for stage, value in sorted(stages.items())},
+        "accuracy": round(sum(result["matching"] for result in timed) / compared, 4) if compared else None,
+        "golden_fields": compared,
+        "peak_rss_mb": own_rss,
+        "peak_child_rss_mb": child_rss,
+    }
+
+def check_regressions(summaries, baseline=None, min_accuracy=None, max_slowdown=0.2, max_accuracy_drop=0.0):
+    """Return a list of human-readable regression messages; empty when everything passes."""
+    failures = []
+    for path_name, summary in summaries.items():
+        accuracy = summary["accuracy"]
+        if min_accuracy is not None and accuracy is not None and accuracy < min_accuracy:
+            failures.append(f"{path_name}: accuracy {accuracy:.2%} below the minimum {min_accuracy:.2%}")
+        previous = (baseline or {}).get(path_name)
+        if not previous:
+            continue
+        if previous.get("accuracy") is not None and accuracy is not None:
+            if accuracy < previous["accuracy"] - max_accuracy_drop:
+                failures.append(f"{path_name}: accuracy fell from {previous['accuracy']:.2%} to {accuracy:.2%}")
+        if previous.get("pages_per_sec") and summary["pages_per_sec"] is not None:
+            floor = previous["pages_per_sec"] * (1 - max_slowdown)
+            if summary["pages_per_sec"] < floor:
+                failures.append(
+                    f"{path_name}: {summary['pages_per_sec']} pages/sec, below {floor:.3f} "
+                    f"({max_slowdown:.0%} under the baseline {previous['pages_per_sec']})"
+                )
+        if summary["errors"] > previous.get("errors", 0):
+            failures.append(f"{path_name}: {summary['errors']} failed runs, baseline had {previous.get('errors', 0)}")
+    return failures
@@ -0,0 +1,15 @@
+"""
+Field names shared by the extraction paths and the code that stores their
+results, kept apart from hybrid_invoice_extractor so importing them does not
+load the OCR/NER stack.
+"""
+import re
+
+REQUIRED_FIELDS = ("vendor_name", "invoice_number", "invoice_date", "amount")
+
+# Numbers the extractor makes up when the document has none: "INV-<date>-<time>",
+# with "-p<first>-<last>" appended for a statement segment.
+GENERATED_NUMBER_RE = re.compile(r"^INV-\d{8}-\d{6}(?:-p\d+-\d+)?$")
+
+def is_generated_number(number):
+    return bool(GENERATED_NUMBER_RE.match(number or ""))
@@ -0,0 +1,179 @@
+"""
+Efficient delivery of stored invoice files.
+
+Responses carry a strong ETag (the content hash for content-addressed blobs),
+Last-Modified and Accept-Ranges, answer conditional requests with 304/412,
+and serve single byte ranges with 206. When INVOICE_FILE_OFFLOAD is set, the
+body is handed to the front web server with X-Sendfile or X-Accel-Redirect and
+Python never touches the file.
+"""
+import mimetypes
+import os
+import re
+
+from django.conf import settings
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe
+from rest_framework import renderers
+
+from .storage import content_hash
+
+STREAM_CHUNK_SIZE = 64 * 1024
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+class PassthroughRenderer(renderers.BaseRenderer):
+    """Lets file endpoints accept any Accept header; the view returns a ready HttpResponse."""
+    media_type = "*/*"
+    format = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return data
+
+def file_etag(name, stat):
+    digest = content_hash(name)
+    if digest:
+        return f'"{digest}"'
+    # Legacy flat files: size and mtime identify the bytes well enough for a validator.
+    return f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+
+def file_version(name):
+    """Short version token for cache-busting URLs, or None for legacy files."""
+    digest = content_hash(name)
+    return digest[:16] if digest else None
+
+def parse_range(header, size):
+    """
+    Parse a single-range Range header. Returns (start, end) inclusive, None when
+    the header should be ignored, or "unsatisfiable".
+    """
+    match = RANGE_RE.match(header.strip())
+    if not match:
+        # Malformed or multi-range requests get the whole file, as RFC 9110 allows.
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        length = int(last)
+        if length == 0:
+            return "unsatisfiable"
+        return max(0, size - length), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        return "unsatisfiable"
+    return start, end
+
+def _if_range_matches(request, etag, mtime):
+    if_range = request.headers.get("If-Range")
+    if not if_range:
+        return True
+    if if_range.startswith('"'):
+        return if_range == etag
+    modified_since = parse_http_date_safe(if_range)
+    return modified_since is not None and int(mtime) <= modified_since
+
+def _stream_range(path, start, length):
+    with open(path, "rb") as f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(STREAM_CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+def _offload(name, path):
+    mode = getattr(settings, "INVOICE_FILE_OFFLOAD", None)
+    if mode == "x-sendfile":
+        response = HttpResponse()
+        response["X-Sendfile"] = path
+        return response
+    if mode == "x-accel-redirect":
+        response = HttpResponse()
+        response["X-Accel-Redirect"] = settings.INVOICE_FILE_ACCEL_PREFIX.rstrip("/") + "/" + name
+        return response
+    return None
+
+def serve_file(request, path, stat, etag, content_type, filename, immutable=False, offload_name=None):
+    """
+    Respond with a local file, honouring validators and Range. offload_name is
+    the file's name under the media root, for X-Sendfile/X-Accel-Redirect.
+    """
+    headers = {
+        "ETag": etag,
+        "Last-Modified": http_date(stat.st_mtime),
+        "Accept-Ranges": "bytes",
+        "Content-Type": content_type,
+        "Content-Disposition": f'inline; filename="{filename}"',
+    }
+    if immutable:
+        # The URL pins the content, so the browser never needs to ask again.
+        headers["Cache-Control"] = f"private, max-age={IMMUTABLE_MAX_AGE}, immutable"
+    else:
+        headers["Cache-Control"] = "private, no-cache"
+
+    conditional = get_conditional_response(request, etag=etag, last_modified=int(stat.st_mtime))
+    if conditional is not None:
+        for header in ("ETag", "Last-Modified", "Cache-Control"):
+            conditional[header] = headers[header]
+        return conditional
+
+    response = _offload(offload_name, path) if offload_name else None
+    if response is not None:
+        # The front server handles Range and the body itself.
+        for header, value in headers.items():
+            response[header] = value
+        return response
+
+    byte_range = None
+    range_header = request.headers.get("Range")
+    if range_header and request.method == "GET" and _if_range_matches(request, etag, stat.st_mtime):
+        byte_range = parse_range(range_header, stat.st_size)
+
+    if byte_range == "unsatisfiable":
+        response = HttpResponse(status=416)
+        response["Content-Range"] = f"bytes */{stat.st_size}"
+        headers.pop("Content-Type")
+        headers.pop("Content-Disposition")
+    elif byte_range:
+        start, end = byte_range
+        length = end - start + 1
+        response = StreamingHttpResponse(_stream_range(path, start, length), status=206)
+        response["Content-Range"] = f"bytes {start}-{end}/{stat.st_size}"
+        response["Content-Length"] = str(length)
+    else:
+        # FileResponse uses the server's wsgi.file_wrapper (sendfile) when available.
+        response = FileResponse(open(path, "rb"))
+        response["Content-Length"] = str(stat.st_size)
+    for header, value in headers.items():
+        response[header] = value
+    return response
+
+def stat_stored_file(field_file):
+    """Return (path, stat) of a stored FieldFile, raising Http404 when it is missing."""
+    if not field_file:
+        raise Http404("No file attached")
+    path = field_file.storage.path(field_file.name)
+    try:
+        return path, os.stat(path)
+    except FileNotFoundError:
+        raise Http404("File not found")
+
+def serve_stored_file(request, field_file):
+    """Build the response for an invoice's FieldFile."""
+    path, stat = stat_stored_file(field_file)
+    name = field_file.name
+    version = request.GET.get("v")
+    return serve_file(
+        request,
+        path,
+        stat,
+        etag=file_etag(name, stat),
+        content_type=mimetypes.guess_type(name)[0] or "application/octet-stream",
+        filename=os.path.basename(name),
+        immutable=bool(version) and version == file_version(name),
+        offload_name=name,
+    )
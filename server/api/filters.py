@@ -0,0 +1,85 @@
+"""
+Server-side filtering and ordering of invoice listings.
+
+    ?date_from=&date_to=        invoice_date range (YYYY-MM-DD, inclusive)
+    ?amount_min=&amount_max=    amount range
+    ?vendor=3,5                 vendor ids
+    ?category=Food              vendor category
+    ?status=Paid,Closed         statuses
+    ?ordering=-invoice_date,amount
+
+Without ?ordering, a date or amount range orders by that column, newest or
+largest first, so the range index both selects and orders the rows;
+otherwise the queryset keeps its own ordering.
+
+Listings are already scoped to the user's site (api/tenancy.py), so each
+filter is served by a site-leading index on Invoice (or Vendor's site and
+category, or the vendor's own index); keep filter_invoices(), the model
+indexes and the query-plan test in api/tests.py in step.
+"""
+import datetime
+from decimal import Decimal, InvalidOperation
+
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import BaseFilterBackend
+
+from .models import Invoice
+
+ORDERING_FIELDS = ("invoice_date", "amount", "created_at", "invoice_number", "id")
+STATUSES = {value for value, _ in Invoice.STATUS_CHOICES}
+# Range filters and the ordering used for them when none is requested.
+RANGE_ORDERING = (
+    (("date_from", "date_to"), "-invoice_date"),
+    (("amount_min", "amount_max"), "-amount"),
+)
+
+def _parse(params, name, convert, message):
+    try:
+        return convert(params[name])
+    except (ValueError, InvalidOperation):
+        raise ValidationError({name: message})
+
+def _split(value):
+    return [part.strip() for part in value.split(",") if part.strip()]
+
+def filter_invoices(queryset, params):
+    """Apply the supported ?filters and ?ordering from a QueryDict to an Invoice (or ArchivedInvoice) queryset."""
+    lookups = {}
+    if params.get("date_from"):
+        lookups["invoice_date__gte"] = _parse(params, "date_from", datetime.date.fromisoformat, "Use YYYY-MM-DD.")
+    if params.get("date_to"):
+        lookups["invoice_date__lte"] = _parse(params, "date_to", datetime.date.fromisoformat, "Use YYYY-MM-DD.")
+    if params.get("amount_min"):
+        lookups["amount__gte"] = _parse(params, "amount_min", Decimal, "Must be a number.")
+    if params.get("amount_max"):
+        lookups["amount__lte"] = _parse(params, "amount_max", Decimal, "Must be a number.")
+    if params.get("vendor"):
+        lookups["vendor_id__in"] = _parse(params, "vendor", lambda value: [int(part) for part in _split(value)], "Use vendor ids, comma-separated.")
+    if params.get("category"):
+        lookups["vendor__category"] = params["category"]
+    if params.get("status"):
+        statuses = _split(params["status"])
+        unknown = set(statuses) - STATUSES
+        if unknown:
+            raise ValidationError({"status": f"Unknown status: {', '.join(sorted(unknown))}."})
+        lookups["status__in"] = statuses
+    if lookups:
+        queryset = queryset.filter(**lookups)
+
+    if params.get("ordering"):
+        ordering = _split(params["ordering"])
+        invalid = [field for field in ordering if field.lstrip("-") not in ORDERING_FIELDS]
+        if invalid:
+            raise ValidationError({"ordering": f"Order by one of {', '.join(ORDERING_FIELDS)}, optionally prefixed with '-'."})
+        # id breaks ties so pages of equal dates or amounts keep a stable order.
+        queryset = queryset.order_by(*ordering, "-id")
+    else:
+        for names, ordering in RANGE_ORDERING:
+            if any(params.get(name) for name in names):
+                queryset = queryset.order_by(ordering, "-id")
+                break
+    return queryset
+
+class InvoiceFilterBackend(BaseFilterBackend):
+    def filter_queryset(self, request, queryset, view):
+        return filter_invoices(queryset, request.query_params)
@@ -0,0 +1,239 @@
+"""
+Hot-folder ingestion for scanner and mail-to-folder drop directories.
+
+`manage.py watch_invoice_folder` watches one directory, with inotify on Linux
+(through libc, so no extra package is needed) and by rescanning it elsewhere
+or when asked to, e.g. on network mounts where inotify does not see remote
+writes. A file is taken once its size and mtime have held still for the
+settle time, so half-written scans are left alone.
+
+Files move through the folder's subdirectories by rename:
+
+    <folder>/x.pdf -> processing/x.pdf -> done/x.pdf or failed/x.pdf (+ x.pdf.error)
+
+Anything found in processing/ at start-up was interrupted and is ingested
+again. That is safe because ingestion is idempotent: a byte-identical file
+maps to the invoice that already stores it, and a repeated invoice number to
+the vendor's existing invoice.
+"""
+import ctypes
+import ctypes.util
+import errno
+import hashlib
+import logging
+import os
+import select
+import shutil
+import struct
+import sys
+import tempfile
+import time
+from stat import S_ISREG
+
+from django.conf import settings
+
+from .intake import extract_uploaded_invoice, find_stored_duplicate, save_extracted_invoice, save_statement_segments
+from .storage import HASH_CHUNK_SIZE, StagedUpload
+
+logger = logging.getLogger(__name__)
+
+PROCESSING_DIR = "processing"
+# The types the extractor reads. Other files, TIFF scans included, are left in the folder untouched.
+INVOICE_EXTENSIONS = (".pdf", ".png", ".jpg", ".jpeg")
+# Names scanners and mail clients use while a file is still being written.
+PARTIAL_SUFFIXES = (".part", ".partial", ".tmp", ".crdownload")
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+INOTIFY_EVENT = struct.Struct("iIII")  # wd, mask, cookie, name length
+INOTIFY_READ_BYTES = 64 * 1024
+
+def is_candidate(name):
+    lowered = name.lower()
+    if lowered.startswith((".", "~")) or lowered.endswith(PARTIAL_SUFFIXES):
+        return False
+    return lowered.endswith(INVOICE_EXTENSIONS)
+
+# -------------------------------
+# Watching
+# -------------------------------
+class PollingWatcher:
+    """Rescans the folder on every tick; works on any filesystem."""
+    def wait(self, timeout):
+        time.sleep(timeout)
+        return None
+
+    def close(self):
+        pass
+
+class InotifyWatcher:
+    """inotify on the folder itself (not its subdirectories)."""
+    def __init__(self, path):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        if libc.inotify_add_watch(self.fd, os.fsencode(path), IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE) < 0:
+            error = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(error, f"inotify_add_watch failed for {path}")
+
+    def wait(self, timeout):
+        """Names touched within timeout seconds, or None when events were lost and the folder must be rescanned."""
+        names = set()
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return names
+        try:
+            data = os.read(self.fd, INOTIFY_READ_BYTES)
+        except BlockingIOError:
+            return names
+        offset = 0
+        while offset < len(data):
+            _, mask, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+            offset += INOTIFY_EVENT.size
+            if mask & IN_Q_OVERFLOW:
+                return None
+            name = data[offset:offset + length].rstrip(b"\0")
+            offset += length
+            if name:
+                names.add(os.fsdecode(name))
+        return names
+
+    def close(self):
+        os.close(self.fd)
+
+def open_watcher(path, poll=False):
+    if not poll and sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(path)
+        except OSError as e:
+            logger.warning(f"inotify unavailable for {path} ({e}); polling instead")
+    return PollingWatcher()
+
+class StabilityTracker:
+    """Candidate files in a folder, ready once their size and mtime have not changed for settle seconds."""
+    def __init__(self, folder, settle):
+        self.folder = folder
+        self.settle = settle
+        self.seen = {}  # name -> ((size, mtime_ns), monotonic time it last changed)
+
+    def observe(self, names=None):
+        """Re-stat the files being tracked plus names; with names=None, rescan the whole folder."""
+        if names is None:
+            with os.scandir(self.folder) as entries:
+                names = {entry.name for entry in entries}
+            for name in set(self.seen) - names:
+                del self.seen[name]
+        now = time.monotonic()
+        for name in set(self.seen) | {name for name in names if is_candidate(name)}:
+            try:
+                info = os.stat(os.path.join(self.folder, name))
+            except FileNotFoundError:
+                self.seen.pop(name, None)
+                continue
+            if not S_ISREG(info.st_mode):
+                continue
+            signature = (info.st_size, info.st_mtime_ns)
+            previous = self.seen.get(name)
+            if previous is None or previous[0] != signature:
+                self.seen[name] = (signature, now)
+
+    def ready(self):
+        now = time.monotonic()
+        return sorted(
+            name for name, ((size, _), since) in self.seen.items() if size and now - since >= self.settle
+        )
+
+    def pending(self):
+        """Number of non-empty files still waiting to settle."""
+        return sum(1 for (size, _), _ in self.seen.values() if size)
+
+    def forget(self, name):
+        self.seen.pop(name, None)
+
+# -------------------------------
+# Moving files through the folders
+# -------------------------------
+def unique_path(directory, name):
+    path = os.path.join(directory, name)
+    stem, ext = os.path.splitext(name)
+    number = 1
+    while os.path.exists(path):
+        path = os.path.join(directory, f"{stem}.{number}{ext}")
+        number += 1
+    return path
+
+def claim(folder, name):
+    """Move a ready file into processing/; returns its new path, or None if it disappeared."""
+    target = unique_path(os.path.join(folder, PROCESSING_DIR), name)
+    try:
+        os.rename(os.path.join(folder, name), target)
+    except FileNotFoundError:
+        return None
+    return target
+
+def move_file(path, directory):
+    """Move path into directory under a free name, atomically even across filesystems."""
+    os.makedirs(directory, exist_ok=True)
+    target = unique_path(directory, os.path.basename(path))
+    try:
+        os.rename(path, target)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        # Copy under a temporary name first, so a crash never leaves a truncated file under the real one.
+        partial = f"{target}.part"
+        shutil.copy2(path, partial)
+        os.replace(partial, target)
+        os.remove(path)
+    return target
+
+def finish_file(path, directory, error=None):
+    """Move a processed file to done/ or failed/, with the error in a note beside a failed one."""
+    target = move_file(path, directory)
+    if error:
+        with open(f"{target}.error", "w") as f:
+            f.write(f"{error}\n")
+    return target
+
+# -------------------------------
+# Ingestion
+# -------------------------------
+def stage_copy(path):
+    """Copy path into FILE_UPLOAD_TEMP_DIR, hashing it on the way, and return it as a StagedUpload."""
+    os.makedirs(settings.FILE_UPLOAD_TEMP_DIR, exist_ok=True)
+    hasher = hashlib.sha256()
+    with open(path, "rb") as source, tempfile.NamedTemporaryFile(
+        dir=settings.FILE_UPLOAD_TEMP_DIR, prefix="hot-folder-", suffix=".upload", delete=False,
+    ) as staged:
+        for chunk in iter(lambda: source.read(HASH_CHUNK_SIZE), b""):
+            hasher.update(chunk)
+            staged.write(chunk)
+    return StagedUpload(staged.name, os.path.basename(path), os.path.getsize(staged.name), hasher.hexdigest())
+
+def ingest_file(path, site_id):
+    """
+    Extract and save one claimed file into a site the way an upload is. The file itself
+    stays where it is; a copy is what gets stored. Returns a one-line outcome
+    and raises when the file cannot be processed.
+    """
+    upload = stage_copy(path)
+    try:
+        existing = find_stored_duplicate(upload, site_id)
+        if existing:
+            return f"already stored as invoice {existing.id}"
+        extracted, layout, ocr = extract_uploaded_invoice(upload, site_id)
+        if "segments" in extracted:
+            results = save_statement_segments(upload, site_id, extracted["segments"])
+            return "statement: " + ", ".join(
+                f"invoice {invoice.id}" + ("" if is_new else " (existing)") for invoice, is_new in results
+            )
+        invoice, is_new = save_extracted_invoice(upload, site_id, extracted, layout, ocr)
+        return f"invoice {invoice.id}" if is_new else f"invoice {invoice.id} already existed"
+    finally:
+        upload.close()
+        if os.path.exists(upload.path):
+            os.remove(upload.path)
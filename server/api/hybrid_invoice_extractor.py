@@ -1,12 +1,17 @@
 import re
 import datetime
 import io
+import copy
 import logging
-from pdf2image import convert_from_bytes
+import mimetypes
+import threading
+from pdf2image import convert_from_bytes, convert_from_path, pdfinfo_from_bytes, pdfinfo_from_path
 from PIL import Image, ImageOps
 import pytesseract
 from transformers import pipeline
 
+from .extraction_fields import REQUIRED_FIELDS
+
 logger = logging.getLogger(__name__)
 
 POPPLER_PATH = r'C:\poppler-24.08.0\Library\bin'
@@ -47,15 +52,189 @@ def parse_date(raw_date):
             continue
     return datetime.datetime.today().strftime("%Y-%m-%d")
 
-def extract_text_from_pdf(pdf_bytes):
+# -------------------------------
+# Page preprocessing
+# -------------------------------
+# Tesseract time grows with pixel count, and it reads best when a text line is
+# roughly 30-35 px tall, so every page is rendered (PDF) or scaled (photo) to
+# bring its text to that height, within a pixel budget.
+DEFAULT_DPI = 200
+MIN_DPI = 100
+MAX_DPI = 300
+PROBE_DPI = 72
+TARGET_LINE_HEIGHT_PX = 32
+MAX_PAGE_PIXELS = 8_000_000  # About a letter page at 300 DPI
+ANALYSIS_WIDTH = 1000
+SKEW_ANALYSIS_WIDTH = 600
+MAX_SKEW_DEGREES = 5.0
+SKEW_STEP_DEGREES = 0.5
+
+def _row_means(gray):
+    """Mean brightness of every pixel row of a grayscale image."""
+    return list(gray.resize((1, gray.height), Image.BOX).getdata())
+
+def _analysis_copy(image, width):
+    gray = image.convert("L")
+    if gray.width <= width:
+        return gray, 1.0
+    scale = width / gray.width
+    return gray.resize((width, max(1, int(gray.height * scale)))), scale
+
+def estimate_line_height(image):
+    """Median height in pixels of the text lines on image, or None if no lines stand out."""
+    gray, scale = _analysis_copy(image, ANALYSIS_WIDTH)
+    binary = gray.point(lambda p: 0 if p < 128 else 255)
+    runs = []
+    run = 0
+    for mean in _row_means(binary):
+        if mean < 250:
+            run += 1
+        elif run:
+            runs.append(run)
+            run = 0
+    if run:
+        runs.append(run)
+    # Drop specks and solid blocks (logos, shaded bands, photo backgrounds).
+    runs = sorted(r for r in runs if 2 <= r <= binary.height * 0.1)
+    if len(runs) < 3:
+        return None
+    return runs[len(runs) // 2] / scale
+
+def choose_render_dpi(probe):
+    """Pick the render DPI for a PDF page from a low-resolution probe render of it."""
+    line_height = estimate_line_height(probe)
+    if line_height is None:
+        dpi = DEFAULT_DPI
+    else:
+        dpi = TARGET_LINE_HEIGHT_PX * PROBE_DPI / line_height
+    width_in, height_in = probe.width / PROBE_DPI, probe.height / PROBE_DPI
+    dpi = min(dpi, (MAX_PAGE_PIXELS / (width_in * height_in)) ** 0.5)
+    return int(max(MIN_DPI, min(MAX_DPI, dpi)))
+
+def fit_pixel_budget(image):
+    pixels = image.width * image.height
+    if pixels <= MAX_PAGE_PIXELS:
+        return image
+    factor = (MAX_PAGE_PIXELS / pixels) ** 0.5
+    return image.resize((int(image.width * factor), int(image.height * factor)), Image.LANCZOS)
+
+def scale_to_text_height(image):
+    """Downscale image so its text lines are about TARGET_LINE_HEIGHT_PX tall. Never upscales."""
+    line_height = estimate_line_height(image)
+    if line_height is None:
+        return image
+    factor = TARGET_LINE_HEIGHT_PX / line_height
+    if factor >= 0.95:
+        return image
+    return image.resize((int(image.width * factor), int(image.height * factor)), Image.LANCZOS)
+
+def correct_orientation(image):
+    """Rotate a sideways or upside-down page upright using Tesseract's OSD."""
+    try:
+        osd = pytesseract.image_to_osd(image, output_type=pytesseract.Output.DICT)
+    except pytesseract.TesseractError as e:
+        # Too little text for OSD; leave the page as it is.
+        logger.debug(f"OSD skipped: {e}")
+        return image
+    rotate = osd.get("rotate", 0)
+    if rotate:
+        # OSD reports a clockwise correction; PIL rotates counter-clockwise.
+        image = image.rotate(-rotate, expand=True, fillcolor="white")
+    return image
+
+def deskew(image):
+    """Straighten a slightly skewed scan by maximizing the variance of the row profile."""
+    gray, _ = _analysis_copy(image, SKEW_ANALYSIS_WIDTH)
+
+    def score(angle):
+        rows = _row_means(gray.rotate(angle, fillcolor=255))
+        mean = sum(rows) / len(rows)
+        return sum((r - mean) ** 2 for r in rows)
+
+    best_angle, best_score = 0.0, score(0.0)
+    steps = int(MAX_SKEW_DEGREES / SKEW_STEP_DEGREES)
+    for i in range(-steps, steps + 1):
+        angle = i * SKEW_STEP_DEGREES
+        if angle == 0.0:
+            continue
+        angle_score = score(angle)
+        if angle_score > best_score:
+            best_angle, best_score = angle, angle_score
+    if best_angle:
+        image = image.rotate(best_angle, expand=True, fillcolor="white", resample=Image.BICUBIC)
+    return image
+
+def prepare_page(image):
+    """
+    Preprocess one page image once, before any OCR pass: cap its pixel count,
+    fix orientation, scale text to the target height and remove skew.
+    """
+    image = fit_pixel_budget(image)
+    image = correct_orientation(image)
+    image = scale_to_text_height(image)
+    return deskew(image)
+
+def file_source(file_obj):
+    """
+    Return the file's path on disk when it has one (streamed uploads, stored
+    files), so poppler and PIL read it directly; otherwise return its bytes.
+    """
+    if hasattr(file_obj, "temporary_file_path"):
+        return file_obj.temporary_file_path()
+    try:
+        return file_obj.path
+    except (AttributeError, NotImplementedError, ValueError):
+        file_obj.seek(0)
+        return file_obj.read()
+
+def file_content_type(file_obj):
+    content_type = getattr(file_obj, "content_type", None)
+    if not content_type:
+        content_type = mimetypes.guess_type(file_obj.name)[0] or ""
+    return content_type.lower()
+
+def open_image(source):
+    """Open a photo from a path or bytes, letting the JPEG decoder shrink oversized images while decoding."""
+    image = Image.open(io.BytesIO(source) if isinstance(source, (bytes, bytearray)) else source)
+    if image.format == "JPEG" and image.width * image.height > MAX_PAGE_PIXELS:
+        factor = (MAX_PAGE_PIXELS / (image.width * image.height)) ** 0.5
+        image.draft("RGB", (int(image.width * factor), int(image.height * factor)))
+    # Phone cameras record the rotation in EXIF rather than in the pixels.
+    return ImageOps.exif_transpose(image)
+
+def convert_pdf(pdf, **kwargs):
+    """Rasterize a PDF given either as bytes or as a path on disk."""
+    if isinstance(pdf, (bytes, bytearray)):
+        return convert_from_bytes(pdf, poppler_path=POPPLER_PATH, **kwargs)
+    return convert_from_path(pdf, poppler_path=POPPLER_PATH, **kwargs)
+
+def pdf_page_count(pdf):
+    if isinstance(pdf, (bytes, bytearray)):
+        return pdfinfo_from_bytes(pdf, poppler_path=POPPLER_PATH)["Pages"]
+    return pdfinfo_from_path(pdf, poppler_path=POPPLER_PATH)["Pages"]
+
+def render_pdf_page(pdf, page_number):
+    """Render one PDF page (1-based) at a DPI chosen for its text size, then preprocess it."""
+    probe = convert_pdf(pdf, dpi=PROBE_DPI, first_page=page_number, last_page=page_number)[0]
+    dpi = choose_render_dpi(probe)
+    logger.debug(f"Rendering page {page_number} at {dpi} DPI")
+    image = convert_pdf(pdf, dpi=dpi, first_page=page_number, last_page=page_number)[0]
+    return prepare_page(image)
+
+def extract_text_from_pdf(pdf, on_first_page=None, prepared=None):
     try:
-        images = convert_from_bytes(pdf_bytes, poppler_path=POPPLER_PATH)
+        page_count = pdf_page_count(pdf)
     except Exception as e:
         logger.error(f"PDF extraction error: {e}")
         raise ValueError(f"PDF processing failed: {str(e)}")
     full_text = ""
-    for image in images:
+    for page_number in range(1, page_count + 1):
         try:
+            image = prepared.get(page_number) if prepared else None
+            if image is None:
+                image = render_pdf_page(pdf, page_number)
+            if page_number == 1 and on_first_page:
+                on_first_page(image)
             page_text = pytesseract.image_to_string(image)
             if len(page_text.strip()) < 100:
                 page_text = enhanced_ocr(image)
@@ -65,15 +244,23 @@ def extract_text_from_pdf(pdf_bytes):
             continue
     return full_text
 
-def extract_text(file_obj):
-    file_obj.seek(0)
-    content_type = file_obj.content_type.lower()
+def extract_text(file_obj, on_first_page=None, prepared=None):
+    """
+    OCR every page of the file. on_first_page, if given, is called with the
+    first rendered page so callers can reuse it (e.g. for previews). prepared
+    maps page numbers (1-based) to images already rendered and preprocessed,
+    which are OCR'd as they are instead of being rendered again.
+    """
+    content_type = file_content_type(file_obj)
     if content_type == "application/pdf":
-        pdf_bytes = file_obj.read()
-        return extract_text_from_pdf(pdf_bytes)
+        return extract_text_from_pdf(file_source(file_obj), on_first_page, prepared)
     elif content_type in ["image/jpeg", "image/png"]:
         try:
-            image = Image.open(io.BytesIO(file_obj.read()))
+            image = prepared.get(1) if prepared else None
+            if image is None:
+                image = prepare_page(open_image(file_source(file_obj)))
+            if on_first_page:
+                on_first_page(image)
             text = pytesseract.image_to_string(image)
             if len(text.strip()) < 100:
                 text = enhanced_ocr(image)
@@ -123,13 +310,24 @@ def extract_vendor_name(text):
     vendor_name = re.sub(r'\s+m$', '', vendor_name).strip()
     return vendor_name
 
+INVOICE_NUMBER_PATTERNS = [
+    r'Invoice\s*(?:No|#|Number)[:\s-]+([A-Z0-9\-]+)',
+    r'Bill\s*(?:No|#|Number)[:\s-]+([A-Z0-9\-]+)',
+    r'Invoice no\.?:\s*([A-Z0-9\-]+)'
+]
+
+INVOICE_DATE_PATTERNS = [
+    r'Invoice\s*Date[:\s-]+(\d{1,2}[/-]\d{1,2}[/-]\d{2,4})',
+    r'Date[:\s-]+(\d{1,2}[/-]\d{1,2}[/-]\d{2,4})'
+]
+
+AMOUNT_PATTERNS = [
+    r'Total Due[:\s-]*\$?\s*([\d,]+\.\d{2})',
+    r'Grand Total[:\s-]*\$?\s*([\d,]+\.\d{2})'
+]
+
 def extract_invoice_number(text):
-    patterns = [
-        r'Invoice\s*(?:No|#|Number)[:\s-]+([A-Z0-9\-]+)',
-        r'Bill\s*(?:No|#|Number)[:\s-]+([A-Z0-9\-]+)',
-        r'Invoice no\.?:\s*([A-Z0-9\-]+)'
-    ]
-    for pattern in patterns:
+    for pattern in INVOICE_NUMBER_PATTERNS:
         inv_num = extract_field(pattern, text)
         if inv_num:
             return inv_num
@@ -139,11 +337,7 @@ def extract_invoice_number(text):
     return None
 
 def extract_invoice_date(text):
-    date_patterns = [
-        r'Invoice\s*Date[:\s-]+(\d{1,2}[/-]\d{1,2}[/-]\d{2,4})',
-        r'Date[:\s-]+(\d{1,2}[/-]\d{1,2}[/-]\d{2,4})'
-    ]
-    for pattern in date_patterns:
+    for pattern in INVOICE_DATE_PATTERNS:
         raw_date = extract_field(pattern, text)
         if raw_date:
             parsed = parse_date(raw_date)
@@ -152,11 +346,7 @@ def extract_invoice_date(text):
     return datetime.datetime.today().strftime("%Y-%m-%d")
 
 def extract_amount(text):
-    patterns = [
-        r'Total Due[:\s-]*\$?\s*([\d,]+\.\d{2})',
-        r'Grand Total[:\s-]*\$?\s*([\d,]+\.\d{2})'
-    ]
-    for pattern in patterns:
+    for pattern in AMOUNT_PATTERNS:
         amt = extract_field(pattern, text, default="0.00")
         if amt and amt != "0.00":
             try:
@@ -221,14 +411,248 @@ def extract_invoice_fields_universal(text):
         "account_payee": account_payee,
     }
 
-def extract_invoice_data_hybrid(file_obj):
+# -------------------------------
+# Zoned (region-of-interest) OCR
+# -------------------------------
+# Horizontal bands of a page, as (top, bottom) fractions of its height. The
+# persisted fields nearly always sit in the header band or the totals block.
+OCR_ZONES = {
+    "header": (0.0, 0.35),
+    "totals": (0.60, 1.0),
+}
+ZONE_MIN_TEXT_LENGTH = 20
+
+_zone_stats_lock = threading.Lock()
+ZONE_STATS = {
+    "documents": 0,
+    "zone_resolved": 0,
+    "full_page_fallbacks": 0,
+    "zones": {name: {"hits": 0, "misses": 0} for name in OCR_ZONES},
+    "fields": {field: {"hits": 0, "misses": 0} for field in REQUIRED_FIELDS},
+}
+
+def get_zone_stats():
+    """Return a snapshot of the zone hit/miss counters for this process."""
+    with _zone_stats_lock:
+        return copy.deepcopy(ZONE_STATS)
+
+def _record_zone_stats(zone_hits, found_fields, resolved):
+    with _zone_stats_lock:
+        ZONE_STATS["documents"] += 1
+        ZONE_STATS["zone_resolved" if resolved else "full_page_fallbacks"] += 1
+        for name, hit in zone_hits.items():
+            ZONE_STATS["zones"][name]["hits" if hit else "misses"] += 1
+        for field in REQUIRED_FIELDS:
+            ZONE_STATS["fields"][field]["hits" if field in found_fields else "misses"] += 1
+
+def find_required_fields(text, include_vendor=True):
+    """
+    Return the required fields that explicit label patterns find in text.
+    Unlike the extract_* helpers, nothing is guessed: fields without a
+    labelled match are simply left out.
+    """
+    cleaned_text = clean_ocr_text(text)
+    found = {}
+    if include_vendor:
+        vendor_name = extract_vendor_name(cleaned_text)
+        if vendor_name != "Unknown Vendor":
+            found["vendor_name"] = vendor_name
+    for field, patterns in (
+        ("invoice_number", INVOICE_NUMBER_PATTERNS),
+        ("invoice_date", INVOICE_DATE_PATTERNS),
+        ("amount", AMOUNT_PATTERNS),
+    ):
+        for pattern in patterns:
+            value = extract_field(pattern, cleaned_text)
+            if value:
+                found[field] = value
+                break
+    return found
+
+def crop_zone(image, zone):
+    top, bottom = OCR_ZONES[zone]
+    width, height = image.size
+    return image.crop((0, int(height * top), width, int(height * bottom)))
+
+def ocr_lines(image):
+    """
+    OCR an image and return (text, lines), where lines is a list of
+    (line_text, (left, top, right, bottom)) in the image's pixel coordinates.
+    """
+    data = pytesseract.image_to_data(image, output_type=pytesseract.Output.DICT)
+    grouped = {}
+    for i, word in enumerate(data["text"]):
+        word = word.strip()
+        if not word:
+            continue
+        key = (data["block_num"][i], data["par_num"][i], data["line_num"][i])
+        left, top = data["left"][i], data["top"][i]
+        box = (left, top, left + data["width"][i], top + data["height"][i])
+        grouped.setdefault(key, []).append((word, box))
+    lines = []
+    for words in grouped.values():
+        boxes = [box for _, box in words]
+        lines.append((
+            " ".join(word for word, _ in words),
+            (min(b[0] for b in boxes), min(b[1] for b in boxes), max(b[2] for b in boxes), max(b[3] for b in boxes)),
+        ))
+    return "\n".join(line for line, _ in lines), lines
+
+def ocr_zone(image, zone):
+    """
+    OCR one zone of a page. Returns (text, lines) with line boxes expressed
+    as fractions of the full page, so they survive a change of render DPI.
+    """
+    region = crop_zone(image, zone)
+    text, lines = ocr_lines(region)
+    if len(text.strip()) < ZONE_MIN_TEXT_LENGTH:
+        text, lines = ocr_lines(ImageOps.autocontrast(region.convert('L')))
+    width, height = image.size
+    offset = int(height * OCR_ZONES[zone][0])
+    page_lines = [
+        (line, (l / width, (t + offset) / height, r / width, (b + offset) / height))
+        for line, (l, t, r, b) in lines
+    ]
+    return text, page_lines
+
+def load_zone_pages(file_obj, prepared=None):
+    """
+    Return the preprocessed images of the first and (if different) last page.
+    Only those pages are rasterized; a multi-page PDF never renders its middle.
+    If given, the prepared dict is filled with {page number: image} once all
+    of them are loaded, so a full-page fallback can reuse them; pages already
+    in it are not rendered again.
+    """
+    prepared = {} if prepared is None else prepared
+    content_type = file_content_type(file_obj)
+    if content_type == "application/pdf":
+        pdf = file_source(file_obj)
+        page_count = pdf_page_count(pdf)
+        page_numbers = [1] if page_count <= 1 else [1, page_count]
+        pages = [prepared.get(number) or render_pdf_page(pdf, number) for number in page_numbers]
+    elif content_type in ["image/jpeg", "image/png"]:
+        page_numbers = [1]
+        pages = [prepared.get(1) or prepare_page(open_image(file_source(file_obj)))]
+    else:
+        raise ValueError(f"Unsupported file type: {content_type}")
+    prepared.update(zip(page_numbers, pages))
+    return pages
+
+def locate_field(lines, raw_value):
+    """Find the OCR line holding raw_value; return (box, anchor label) or None."""
+    for line, box in lines:
+        position = line.find(raw_value)
+        if position == -1:
+            continue
+        anchor = line[:position].strip(" :#-\t")
+        return box, anchor
+    return None
+
+def locate_vendor_line(lines, vendor_name):
+    """Find the first header line that makes up the vendor name; return (box, line text) or None."""
+    for line, box in lines:
+        line = re.sub(r"[\w\.-]+@[\w\.-]+\.\w+", "", line).strip()
+        if len(line) > 3 and line in vendor_name:
+            return box, line
+    return None
+
+def extract_invoice_data_zoned(pages):
+    """
+    OCR only the header and totals zones of the given first/last page images.
+    Returns the parsed fields, or None when a required field is missing and
+    the caller has to fall back to full-page OCR. The fields carry a "layout"
+    entry recording where each field was found, for vendor templates, and an
+    "ocr" entry with the zone text.
+    """
+    zone_texts = []
+    zone_hits = {name: False for name in OCR_ZONES}
+    found_fields = {}
+    field_locations = {}
+    for page_index, image in enumerate(pages):
+        for zone in OCR_ZONES:
+            text, lines = ocr_zone(image, zone)
+            zone_texts.append(text)
+            # The vendor name is read from the top lines, so only the first
+            # page's header can provide it.
+            include_vendor = page_index == 0 and zone == "header"
+            fields = find_required_fields(text, include_vendor=include_vendor)
+            if fields:
+                zone_hits[zone] = True
+            for field, value in fields.items():
+                if field in found_fields:
+                    continue
+                found_fields[field] = value
+                if field == "vendor_name":
+                    location = locate_vendor_line(lines, value)
+                else:
+                    location = locate_field(lines, value)
+                if location:
+                    # Templates address pages as first (0) or last (-1).
+                    page = 0 if page_index == 0 else -1
+                    field_locations[field] = {"page": page, "box": list(location[0]), "anchor": location[1]}
+
+    resolved = all(field in found_fields for field in REQUIRED_FIELDS)
+    _record_zone_stats(zone_hits, found_fields, resolved)
+    if not resolved:
+        missing = [field for field in REQUIRED_FIELDS if field not in found_fields]
+        logger.info(f"Zoned OCR missing {missing}; falling back to full-page OCR")
+        return None
+    fields = extract_invoice_fields_universal("\n".join(zone_texts))
+    fields["layout"] = {"fields": field_locations}
+    fields["ocr"] = {"text": "\n".join(zone_texts), "complete": False}
+    return fields
+
+# The passes below share a prepared dict of {page number: image} rendered
+# and preprocessed by an earlier pass, so no page is prepared twice. A first
+# page found in it has already been handed to on_first_page.
+def extract_invoice_data_zoned_pass(file_obj, prepared, on_first_page=None, site_id=None):
+    """
+    Fields read by the template of one of site_id's vendors or by zoned OCR,
+    or None when both miss. Without a site no template is tried.
+    """
+    if 1 in prepared:
+        on_first_page = None
     try:
-        text = extract_text(file_obj)
+        pages = load_zone_pages(file_obj, prepared)
+        if on_first_page:
+            on_first_page(pages[0])
+        # Imported here: vendor_templates builds on this module's OCR helpers.
+        from .vendor_templates import extract_invoice_data_templated, header_fingerprint
+        fields = extract_invoice_data_templated(pages, site_id)
+        if fields:
+            logger.info(f"Parsed Invoice Fields (template): {fields}")
+            return fields
+        fields = extract_invoice_data_zoned(pages)
+        if fields:
+            fields["layout"]["fingerprint"] = header_fingerprint(pages[0])
+    except Exception as e:
+        logger.warning(f"Zoned OCR failed, using full-page OCR: {e}")
+        return None
+    if fields:
+        logger.info(f"Parsed Invoice Fields (zoned): {fields}")
+    return fields
+
+def extract_invoice_data_full_page(file_obj, prepared=None, on_first_page=None):
+    """Fields parsed from full-page OCR of every page; raises ValueError on failure."""
+    prepared = prepared or {}
+    if 1 in prepared:
+        on_first_page = None
+    try:
+        text = extract_text(file_obj, on_first_page=on_first_page, prepared=prepared)
         if not text.strip():
             raise ValueError("No text could be extracted from the file")
         fields = extract_invoice_fields_universal(text)
         logger.info(f"Parsed Invoice Fields: {fields}")
+        fields["ocr"] = {"text": text, "complete": True}
         return fields
     except Exception as e:
         logger.error(f"Invoice processing error: {e}", exc_info=True)
         raise ValueError(f"Invoice processing failed: {str(e)}")
+
+def extract_invoice_data_hybrid(file_obj, zoned=True, on_first_page=None, site_id=None):
+    prepared = {}
+    if zoned:
+        fields = extract_invoice_data_zoned_pass(file_obj, prepared, on_first_page, site_id)
+        if fields:
+            return fields
+    return extract_invoice_data_full_page(file_obj, prepared, on_first_page)
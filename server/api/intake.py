@@ -0,0 +1,202 @@
+"""
+Turning an uploaded invoice file into Vendor and Invoice rows.
+
+extract_uploaded_invoice() runs the OCR pipeline and is CPU/subprocess bound;
+the other functions only touch the database. Keeping the two apart lets
+callers run extraction wherever suits them (an executor, a worker) and then
+persist the result. With OCR_DAEMON_SOCKET set, extraction runs in the
+extraction daemon (api/ocr_daemon.py) and this process never imports the OCR
+stack.
+"""
+import logging
+import os
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+
+from .duplicates import check_invoice_text
+from .extraction_fields import is_generated_number
+from .models import ArchivedInvoice, Invoice, Vendor
+from .ocr_daemon import extract_file
+from .previews import preview_saver
+from .search import index_invoice_text
+from .storage import invoice_storage
+from .vendor_templates import layout_template, remember_layout
+
+logger = logging.getLogger(__name__)
+
+VENDOR_DEFAULT_FIELDS = (
+    "account_number",
+    "contact_email",
+    "contact_phone",
+    "address_line_1",
+    "address_line_2",
+    "city",
+    "state",
+    "zip_code",
+    "bank_account_number",
+    "routing_number",
+    "bank_name",
+    "account_payee",
+)
+
+VENDOR_CATEGORIES = {
+    'food': ['meat', 'produce', 'dairy', 'seafood', 'bakery'],
+    'beverage': ['wine', 'beer', 'liquor', 'beverage'],
+    'supplies': ['paper', 'cleaning', 'chemical', 'uniform'],
+    'equipment': ['kitchen', 'appliance', 'repair']
+}
+
+def determine_vendor_category(vendor_name):
+    """Simple heuristic to categorize vendors"""
+    vendor_name = vendor_name.lower()
+    for category, keywords in VENDOR_CATEGORIES.items():
+        if any(keyword in vendor_name for keyword in keywords):
+            return category.capitalize()
+    return "Other"
+
+def find_stored_duplicate(invoice_file, site_id):
+    """
+    The site's invoice already holding a byte-identical file, found by its
+    content hash before any OCR; an archived invoice counts too. Sites share
+    stored blobs but never each other's invoices.
+    """
+    digest = getattr(invoice_file, "sha256", None)
+    if not digest:
+        return None
+    blob_name = invoice_storage.blob_name(digest, os.path.splitext(invoice_file.name)[1])
+    return (
+        Invoice.objects.filter(site_id=site_id, invoice_file=blob_name).first()
+        or ArchivedInvoice.objects.filter(site_id=site_id, archived_file_id=digest).first()
+    )
+
+def run_extraction(invoice_file, preview_key=None, site_id=None):
+    """
+    Extract fields in this process for an upload to site_id, whose vendors'
+    layout templates are tried, saving the preview under preview_key from
+    the page OCR rasterizes. A statement holding several invoices yields
+    {"segments": [...]} instead (see api/statements.py). A multi-page PDF is
+    checked for one before the template and zoned passes, which would read a
+    statement as one invoice; single-page files go straight to them.
+    """
+    from .hybrid_invoice_extractor import extract_invoice_data_full_page, extract_invoice_data_zoned_pass
+    from .statements import split_statement
+    on_first_page = preview_saver(preview_key) if preview_key else None
+    # Pages each pass renders and preprocesses, reused by the passes after it.
+    prepared = {}
+    segments = split_statement(invoice_file, on_first_page=on_first_page, prepared=prepared)
+    if segments:
+        return {"segments": segments}
+    fields = extract_invoice_data_zoned_pass(invoice_file, prepared, on_first_page, site_id)
+    if fields:
+        return fields
+    return extract_invoice_data_full_page(invoice_file, prepared, on_first_page)
+
+def extract_uploaded_invoice(invoice_file, site_id):
+    """
+    Run extraction on a file uploaded to a site. Returns (fields, layout, ocr), where
+    fields is {"segments": [...]} for a multi-invoice statement; raises
+    ValueError on failure.
+    """
+    digest = getattr(invoice_file, "sha256", None)
+    if settings.OCR_DAEMON_SOCKET:
+        extracted = extract_file(invoice_file.temporary_file_path(), preview_key=digest, site_id=site_id)
+    else:
+        extracted = run_extraction(invoice_file, preview_key=digest, site_id=site_id)
+    layout = extracted.pop("layout", None)
+    ocr = extracted.pop("ocr", None)
+    return extracted, layout, ocr
+
+def find_numbered_invoice(vendor, invoice_number):
+    """The vendor's live or archived invoice with this number (case-insensitive), if any."""
+    return (
+        Invoice.objects.filter(vendor=vendor, invoice_number__iexact=invoice_number).first()
+        or ArchivedInvoice.objects.filter(vendor=vendor, invoice_number__iexact=invoice_number).first()
+    )
+
+def _get_vendor(extracted, site_id):
+    vendor, created = Vendor.objects.get_or_create(
+        site_id=site_id,
+        vendor_name=extracted['vendor_name'],
+        defaults={
+            **{field: extracted.get(field) for field in VENDOR_DEFAULT_FIELDS},
+            "category": determine_vendor_category(extracted['vendor_name'])
+        }
+    )
+    return vendor
+
+def save_extracted_invoice(invoice_file, site_id, extracted, layout=None, ocr=None):
+    """
+    Create or reuse the site's vendor and create the invoice for extracted fields.
+    Returns (invoice, is_new); is_new is False when the vendor already has an
+    invoice with the same number (case-insensitive), live or archived.
+    """
+    vendor = _get_vendor(extracted, site_id)
+
+    existing_invoice = find_numbered_invoice(vendor, extracted['invoice_number'])
+    if existing_invoice:
+        return existing_invoice, False
+
+    try:
+        invoice = Invoice.objects.create(
+            vendor=vendor,
+            invoice_number=extracted['invoice_number'],
+            invoice_date=extracted['invoice_date'],
+            amount=extracted['amount'],
+            status="Pending for review",
+            invoice_file=invoice_file,
+            extracted_by_template=layout_template(layout),
+        )
+    except IntegrityError:
+        # A concurrent upload of the same invoice won the race; return its row.
+        existing_invoice = Invoice.objects.filter(
+            vendor=vendor,
+            invoice_number__iexact=extracted['invoice_number']
+        ).first()
+        if existing_invoice:
+            return existing_invoice, False
+        raise
+
+    vendor.update_totals()
+    remember_layout(vendor, invoice, layout)
+    if ocr:
+        index_invoice_text(invoice, ocr["text"], ocr["complete"])
+        check_invoice_text(invoice, ocr["text"])
+    return invoice, True
+
+def save_statement_segments(invoice_file, site_id, segments):
+    """
+    Create one invoice per statement segment in a single transaction, all
+    referencing the same stored file with their page ranges. Returns
+    [(invoice, is_new)] in page order; segments whose number the vendor
+    already has, live or archived, map to the existing invoice. Generated numbers (segments
+    without one) are never matched to an existing invoice.
+    """
+    results = []
+    stored_name = None
+    with transaction.atomic():
+        for segment in segments:
+            extracted = segment["fields"]
+            vendor = _get_vendor(extracted, site_id)
+            existing_invoice = None
+            if not is_generated_number(extracted['invoice_number']):
+                existing_invoice = find_numbered_invoice(vendor, extracted['invoice_number'])
+            if existing_invoice:
+                results.append((existing_invoice, False))
+                continue
+            # The first new invoice stores the file; the others point at the same blob.
+            invoice = Invoice.objects.create(
+                vendor=vendor,
+                invoice_number=extracted['invoice_number'],
+                invoice_date=extracted['invoice_date'],
+                amount=extracted['amount'],
+                status="Pending for review",
+                invoice_file=stored_name or invoice_file,
+                page_start=segment["page_start"],
+                page_end=segment["page_end"],
+            )
+            stored_name = invoice.invoice_file.name
+            index_invoice_text(invoice, segment["ocr"]["text"], segment["ocr"]["complete"])
+            check_invoice_text(invoice, segment["ocr"]["text"])
+            results.append((invoice, True))
+    return results
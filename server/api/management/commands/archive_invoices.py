@@ -0,0 +1,81 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.archive import archivable_invoices, archive_batch, archive_cutoff, sweep_hot_blobs
+from api.models import ArchivedFile
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+class Command(BaseCommand):
+    help = (
+        "Move invoices Closed or Paid for longer than ARCHIVE_AFTER_DAYS into the read-only archive, "
+        "packing their files into compressed monthly bundles under ARCHIVE_ROOT."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--older-than-days", type=int, default=settings.ARCHIVE_AFTER_DAYS,
+            help="Archive invoices closed more than this many days ago.",
+        )
+        parser.add_argument("--batch-size", type=int, default=200, help="Invoices moved per transaction.")
+        parser.add_argument("--limit", type=int, help="Stop after this many invoices.")
+        parser.add_argument("--dry-run", action="store_true", help="Only count what would be archived.")
+        parser.add_argument(
+            "--sweep", action="store_true",
+            help="Also delete hot copies of archived files left behind by an interrupted run.",
+        )
+
+    def handle(self, *args, **options):
+        if options["batch_size"] < 1 or options["older_than_days"] < 0:
+            raise CommandError("--batch-size must be at least 1 and --older-than-days not negative.")
+        cutoff = archive_cutoff(options["older_than_days"])
+        candidates = archivable_invoices(cutoff)
+        if options["dry_run"]:
+            self.stdout.write(f"{candidates.count()} invoices closed before {cutoff:%Y-%m-%d} would be archived.")
+            return
+
+        os.makedirs(settings.ARCHIVE_ROOT, exist_ok=True)
+        lock = self.lock_archive()
+        archived = failed = 0
+        failed_ids = set()
+        try:
+            while options["limit"] is None or archived < options["limit"]:
+                size = options["batch_size"]
+                if options["limit"] is not None:
+                    size = min(size, options["limit"] - archived)
+                # Invoices that failed stay live, so step past them rather than select them again.
+                batch = list(candidates.exclude(pk__in=failed_ids).select_related("vendor")[:size])
+                if not batch:
+                    break
+                moved, failures = archive_batch(batch)
+                archived += moved
+                for invoice_id, error in failures:
+                    failed_ids.add(invoice_id)
+                    self.stderr.write(f"Invoice {invoice_id}: {error}")
+                failed += len(failures)
+                self.stdout.write(f"Archived {archived} invoices so far.")
+            if options["sweep"]:
+                removed = sweep_hot_blobs(ArchivedFile.objects.iterator())
+                self.stdout.write(f"Removed {removed} leftover hot files.")
+        finally:
+            if lock:
+                lock.close()
+        self.stdout.write(self.style.SUCCESS(f"archived {archived}, failed {failed}"))
+
+    def lock_archive(self):
+        """Hold an exclusive lock on ARCHIVE_ROOT, so two runs never append to the same bundle."""
+        if fcntl is None:
+            return None
+        lock = open(os.path.join(settings.ARCHIVE_ROOT, ".lock"), "w")
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock.close()
+            raise CommandError("Another archive run is in progress.")
+        return lock
@@ -0,0 +1,103 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.extraction_benchmark import (
+    GOLDEN_PATH,
+    PATHS,
+    SAMPLES_DIR,
+    TEXTRACT_FIXTURE,
+    check_regressions,
+    find_samples,
+    load_golden,
+    run_path_isolated,
+    save_golden,
+    summarize,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the extraction paths over the sample invoices and the Textract fixture: "
+        "latency per stage, pages/sec, peak RSS and field accuracy against golden results."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--path", action="append", choices=sorted(PATHS), help="Path to run; repeatable. Default: all.")
+        parser.add_argument("--samples", default=str(SAMPLES_DIR), help="Folder of sample PDFs/images.")
+        parser.add_argument("--textract-fixture", default=str(TEXTRACT_FIXTURE), help="Recorded Textract response.")
+        parser.add_argument("--repeat", type=int, default=1, help="Runs per sample.")
+        parser.add_argument("--golden", default=str(GOLDEN_PATH), help="Golden field results (JSON).")
+        parser.add_argument(
+            "--update-golden",
+            metavar="PATH",
+            choices=sorted(PATHS),
+            help="Record this path's fields as the golden results for samples that have none. Review before committing.",
+        )
+        parser.add_argument("--baseline", help="Summary JSON from an earlier --save-baseline run to compare against.")
+        parser.add_argument("--save-baseline", help="Write this run's summaries to a JSON file.")
+        parser.add_argument("--report", help="Write every per-run result to a JSON file.")
+        parser.add_argument("--min-accuracy", type=float, help="Fail when a path's golden accuracy is below this fraction.")
+        parser.add_argument("--max-slowdown", type=float, default=0.2, help="Allowed pages/sec drop against the baseline.")
+        parser.add_argument("--max-accuracy-drop", type=float, default=0.0, help="Allowed accuracy drop against the baseline.")
+
+    def handle(self, *args, **options):
+        samples = find_samples(options["samples"], options["textract_fixture"])
+        golden = load_golden(options["golden"])
+        path_names = options["path"] or list(PATHS)
+        self.stdout.write(f"{len(samples)} samples, {sum(1 for s in samples if s['id'] in golden)} with golden results")
+
+        results = {}
+        summaries = {}
+        for path_name in path_names:
+            # Each path in its own interpreter, so its peak RSS is not another path's high-water mark.
+            results[path_name], rss = run_path_isolated(path_name, samples, golden, repeat=options["repeat"])
+            summaries[path_name] = summarize(results[path_name], rss)
+            self.write_summary(path_name, summaries[path_name])
+            for result in results[path_name]:
+                if result.get("error"):
+                    self.stderr.write(f"  {result['sample']}: {result['error']}")
+
+        if options["update_golden"]:
+            added = 0
+            for result in results.get(options["update_golden"], []):
+                if result["sample"] not in golden and not result.get("error"):
+                    golden[result["sample"]] = {field: value for field, value in result["fields"].items() if value is not None}
+                    added += 1
+            save_golden(golden, options["golden"])
+            self.stdout.write(f"Added {added} golden results to {options['golden']}")
+
+        if options["report"]:
+            with open(options["report"], "w", encoding="utf-8") as f:
+                json.dump({"summaries": summaries, "results": results}, f, indent=2)
+        if options["save_baseline"]:
+            with open(options["save_baseline"], "w", encoding="utf-8") as f:
+                json.dump(summaries, f, indent=2)
+
+        baseline = None
+        if options["baseline"]:
+            with open(options["baseline"], encoding="utf-8") as f:
+                baseline = json.load(f)
+        failures = check_regressions(
+            summaries,
+            baseline,
+            min_accuracy=options["min_accuracy"],
+            max_slowdown=options["max_slowdown"],
+            max_accuracy_drop=options["max_accuracy_drop"],
+        )
+        if failures:
+            raise CommandError("Extraction regressions:\n" + "\n".join(failures))
+        self.stdout.write(self.style.SUCCESS("No regressions."))
+
+    def write_summary(self, path_name, summary):
+        accuracy = "n/a" if summary["accuracy"] is None else f"{summary['accuracy']:.1%}"
+        stages = ", ".join(f"{stage} {seconds:.2f}s" for stage, seconds in summary["stages"].items()) or "-"
+        def value(key, suffix=""):
+            return "-" if summary[key] is None else f"{summary[key]}{suffix}"
+        self.stdout.write(
+            f"{path_name}: {summary['runs']} runs, {summary['pages']} pages in {summary['seconds']:.2f}s "
+            f"({value('pages_per_sec')} pages/sec), p50 {value('p50_seconds', 's')}, p95 {value('p95_seconds', 's')}, "
+            f"accuracy {accuracy} over {summary['golden_fields']} fields, {summary['errors']} errors"
+        )
+        self.stdout.write(f"  stages: {stages}")
+        self.stdout.write(f"  peak RSS {summary['peak_rss_mb']} MB, largest child {summary['peak_child_rss_mb']} MB")
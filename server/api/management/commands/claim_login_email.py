@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api.models import CustomUser, normalize_login_email
+
+
+class Command(BaseCommand):
+    help = (
+        "List accounts whose email cannot be used to log in because a case-duplicate holds it, "
+        "or, given a username, make that account the one that logs in with its email."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("username", nargs="?", help="Account to hand its login email to.")
+
+    def handle(self, *args, **options):
+        if options["username"] is None:
+            blocked = CustomUser.objects.filter(email_normalized__isnull=True).exclude(email="").order_by("id")
+            for user in blocked:
+                holder = CustomUser.objects.filter(email_normalized=normalize_login_email(user.email)).first()
+                self.stdout.write(f"{user.username} <{user.email}>: held by {holder.username if holder else 'nobody'}")
+            self.stdout.write(f"{len(blocked)} accounts without a login email.")
+            return
+        try:
+            user = CustomUser.objects.get(username=options["username"])
+        except CustomUser.DoesNotExist:
+            raise CommandError(f"No user {options['username']}.")
+        if not user.email.strip():
+            raise CommandError(f"{user.username} has no email address.")
+        user.claim_login_email()
+        self.stdout.write(self.style.SUCCESS(f"{user.username} now logs in with {user.email_normalized}"))
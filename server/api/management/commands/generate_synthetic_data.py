@@ -0,0 +1,153 @@
+import bisect
+import datetime
+import itertools
+import random
+import secrets
+import time
+from decimal import Decimal
+
+from django.conf import settings
+from django.contrib.sites.models import Site
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import DecimalField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+from api.intake import determine_vendor_category
+from api.models import Invoice, Vendor, bump_version, site_resource
+
+VENDOR_WORDS = (
+    "Produce", "Meat", "Seafood", "Dairy", "Bakery", "Wine", "Beer", "Liquor", "Beverage",
+    "Paper", "Cleaning", "Chemical", "Uniform", "Kitchen", "Appliance", "Repair", "Supply",
+)
+CITIES = (("Knoxville", "TN"), ("Nashville", "TN"), ("Atlanta", "GA"), ("Austin", "TX"), ("Denver", "CO"))
+
+# Status mix by invoice age in days: older invoices have mostly been paid and closed.
+STATUS_MIX = (
+    (14, {"Pending for review": 0.55, "Pending for approval": 0.3, "Approved": 0.15}),
+    (60, {"Pending for review": 0.05, "Pending for approval": 0.1, "Approved": 0.35, "Paid": 0.5}),
+    (None, {"Pending for review": 0.01, "Approved": 0.04, "Paid": 0.35, "Closed": 0.6}),
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Bulk-generate synthetic vendors and invoices for scale testing: Zipf-skewed vendor sizes, "
+        "an age-dependent status mix and lognormal amounts. Use a scratch database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--vendors", type=int, default=10_000)
+        parser.add_argument("--invoices", type=int, default=5_000_000)
+        parser.add_argument("--chunk-size", type=int, default=5_000, help="Rows per bulk_create batch and transaction.")
+        parser.add_argument("--skew", type=float, default=1.1, help="Zipf exponent of invoices per vendor (0 = uniform).")
+        parser.add_argument("--days", type=int, default=3 * 365, help="Invoice dates span this many days back from today.")
+        parser.add_argument("--prefix", default="SYN", help="Prefix of generated vendor names.")
+        parser.add_argument("--seed", type=int, help="Random seed, for reproducible data sets.")
+        parser.add_argument("--site", type=int, default=settings.SITE_ID, help="Id of the site the data belongs to.")
+
+    def handle(self, *args, **options):
+        if options["vendors"] < 1 or options["chunk_size"] < 1:
+            raise CommandError("--vendors and --chunk-size must be positive.")
+        Site.objects.get_or_create(
+            pk=options["site"], defaults={"domain": f"site-{options['site']}.example.com", "name": f"Site {options['site']}"}
+        )
+        self.site_id = options["site"]
+        rng = random.Random(options["seed"])
+        started = time.monotonic()
+
+        vendors = self.create_vendors(rng, options)
+        self.stdout.write(f"{len(vendors)} vendors ready")
+
+        # Vendor i gets a share proportional to 1 / (i + 1) ** skew.
+        weights = [1 / (rank + 1) ** options["skew"] for rank in range(len(vendors))]
+        cumulative = list(itertools.accumulate(weights))
+        # A typical invoice size per vendor; amounts scatter lognormally around it.
+        medians = [rng.lognormvariate(5.5, 1.0) for _ in vendors]
+        # The run token keeps invoice numbers unique across repeated runs; a seeded run draws it
+        # from the seed too, so the same seed gives the same numbers.
+        run = f"{rng.getrandbits(24):06x}" if options["seed"] is not None else secrets.token_hex(3)
+        if Invoice.objects.filter(site_id=self.site_id, invoice_number__startswith=f"INV-{run}-").exists():
+            raise CommandError(f"Invoices of run {run} already exist in site {self.site_id}; use another --seed.")
+        counters = [0] * len(vendors)
+
+        created = 0
+        while created < options["invoices"]:
+            size = min(options["chunk_size"], options["invoices"] - created)
+            batch = []
+            for _ in range(size):
+                index = bisect.bisect_left(cumulative, rng.random() * cumulative[-1])
+                counters[index] += 1
+                batch.append(self.make_invoice(rng, vendors[index], medians[index], f"{run}-{index}-{counters[index]}", options["days"]))
+            with transaction.atomic():
+                # bulk_create skips save(), so stamp the chunk with one version bump.
+                version = bump_version(site_resource("invoice", self.site_id))
+                for invoice in batch:
+                    invoice.row_version = version
+                Invoice.objects.bulk_create(batch, batch_size=options["chunk_size"])
+            created += size
+            elapsed = time.monotonic() - started
+            self.stdout.write(f"{created} invoices ({created / elapsed:.0f} rows/sec)")
+
+        self.update_totals(vendors)
+        self.stdout.write(self.style.SUCCESS(f"Done in {time.monotonic() - started:.1f}s."))
+
+    def create_vendors(self, rng, options):
+        names = [f"{options['prefix']} {rng.choice(VENDOR_WORDS)} {number:05d}" for number in range(options["vendors"])]
+        existing = set(Vendor.objects.filter(site_id=self.site_id, vendor_name__in=names).values_list("vendor_name", flat=True))
+        new = []
+        for name in names:
+            if name in existing:
+                continue
+            city, state = rng.choice(CITIES)
+            new.append(Vendor(
+                site_id=self.site_id,
+                vendor_name=name,
+                category=determine_vendor_category(name),
+                city=city,
+                state=state,
+                account_number=str(rng.randrange(10**7, 10**8)),
+            ))
+        for start in range(0, len(new), options["chunk_size"]):
+            with transaction.atomic():
+                version = bump_version(site_resource("vendor", self.site_id))
+                chunk = new[start:start + options["chunk_size"]]
+                for vendor in chunk:
+                    vendor.row_version = version
+                Vendor.objects.bulk_create(chunk)
+        by_name = dict(Vendor.objects.filter(site_id=self.site_id, vendor_name__in=names).values_list("vendor_name", "id"))
+        # Keep the generated order: rank 0 is the largest vendor.
+        return [by_name[name] for name in names]
+
+    def make_invoice(self, rng, vendor_id, median, number, days):
+        age = int(rng.random() * days)
+        for max_age, mix in STATUS_MIX:
+            if max_age is None or age < max_age:
+                break
+        status = rng.choices(list(mix), weights=list(mix.values()))[0]
+        amount = Decimal(str(round(median * rng.lognormvariate(0, 0.6), 2)))
+        return Invoice(
+            site_id=self.site_id,
+            vendor_id=vendor_id,
+            invoice_number=f"INV-{number}",
+            invoice_date=datetime.date.today() - datetime.timedelta(days=age),
+            amount=amount,
+            status=status,
+        )
+
+    def update_totals(self, vendor_ids):
+        """Set total_amount_purchased for the vendors in one statement per chunk, as update_totals() would."""
+        totals = (
+            Invoice.objects.filter(vendor=OuterRef("pk"))
+            .order_by()
+            .values("vendor")
+            .annotate(total=Sum("amount"))
+            .values("total")
+        )
+        total = Coalesce(Subquery(totals), Value(Decimal("0")), output_field=DecimalField(max_digits=12, decimal_places=2))
+        for start in range(0, len(vendor_ids), 1000):
+            with transaction.atomic():
+                Vendor.objects.filter(pk__in=vendor_ids[start:start + 1000]).update(
+                    total_amount_purchased=total, row_version=bump_version(site_resource("vendor", self.site_id))
+                )
+        self.stdout.write("Vendor totals updated")
@@ -0,0 +1,77 @@
+from django.core.management.base import BaseCommand
+
+from api.duplicates import UNAPPROVED_STATUSES, check_invoice_text
+from api.hybrid_invoice_extractor import extract_text
+from api.models import Invoice, InvoiceText
+from api.search import index_invoice_text, uses_fulltext
+from api.statements import segment_text
+
+
+class Command(BaseCommand):
+    help = (
+        "Fill the invoice text search index: OCR every page of invoices that have no stored text "
+        "or only the zone/template text from upload."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--limit", type=int, help="Stop after this many invoices.")
+        parser.add_argument("--all", action="store_true", help="Re-OCR every invoice with a file.")
+        parser.add_argument(
+            "--rebuild-terms",
+            action="store_true",
+            help="Rebuild the search postings from the stored text without OCR (after moving off MySQL).",
+        )
+        parser.add_argument(
+            "--rebuild-sketches",
+            action="store_true",
+            help="Rebuild the near-duplicate sketches from the stored text without OCR, flagging unapproved invoices.",
+        )
+
+    def handle(self, *args, **options):
+        if options["rebuild_terms"]:
+            self.rebuild_terms()
+            return
+        if options["rebuild_sketches"]:
+            self.rebuild_sketches()
+            return
+
+        invoices = Invoice.objects.exclude(invoice_file="").exclude(invoice_file__isnull=True).order_by("id")
+        if not options["all"]:
+            invoices = invoices.exclude(ocr_text__complete=True)
+        if options["limit"]:
+            invoices = invoices[:options["limit"]]
+        indexed = failed = 0
+        for invoice in invoices.iterator():
+            try:
+                if invoice.page_start:
+                    # One invoice of a split statement: only its own pages.
+                    text = segment_text(invoice.invoice_file.path, invoice.page_start, invoice.page_end)
+                else:
+                    text = extract_text(invoice.invoice_file)
+            except Exception as e:
+                failed += 1
+                self.stderr.write(f"Invoice {invoice.id}: {e}")
+                continue
+            index_invoice_text(invoice, text, complete=True)
+            check_invoice_text(invoice, text, flag=invoice.status in UNAPPROVED_STATUSES)
+            indexed += 1
+        self.stdout.write(self.style.SUCCESS(f"Indexed {indexed} invoices ({failed} failed)."))
+
+    def rebuild_terms(self):
+        if uses_fulltext():
+            self.stdout.write("This database uses its FULLTEXT index; no postings to rebuild.")
+            return
+        rebuilt = 0
+        for row in InvoiceText.objects.select_related("invoice").iterator():
+            index_invoice_text(row.invoice, row.text, row.complete)
+            rebuilt += 1
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt postings for {rebuilt} invoices."))
+
+    def rebuild_sketches(self):
+        # In id order, so each invoice is matched against the ones stored before it.
+        sketched = flagged = 0
+        for row in InvoiceText.objects.select_related("invoice").order_by("invoice_id").iterator():
+            flags = check_invoice_text(row.invoice, row.text, flag=row.invoice.status in UNAPPROVED_STATUSES)
+            sketched += 1
+            flagged += len(flags)
+        self.stdout.write(self.style.SUCCESS(f"Sketched {sketched} invoices ({flagged} new duplicate flags)."))
@@ -0,0 +1,123 @@
+import json
+import random
+import statistics
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+
+# Endpoint name -> (weight, path). {id} is replaced by a random invoice id.
+DEFAULT_MIX = {
+    "invoices": (3, "/api/invoices/"),
+    "pending_invoices": (3, "/api/pending_invoices/"),
+    "vendors": (2, "/api/vendors/"),
+    "invoice_detail": (4, "/api/invoices/{id}/"),
+}
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class Command(BaseCommand):
+    help = (
+        "Drive the REST endpoints of a running server (e.g. runserver or uvicorn) with concurrent "
+        "clients and report throughput and latency percentiles per endpoint."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+        parser.add_argument("--email", required=True, help="Login used to obtain a JWT.")
+        parser.add_argument("--password", required=True)
+        parser.add_argument("--concurrency", type=int, default=16)
+        parser.add_argument("--duration", type=float, default=30, help="Seconds to run.")
+        parser.add_argument("--endpoint", action="append", choices=sorted(DEFAULT_MIX), help="Limit to these endpoints.")
+        parser.add_argument(
+            "--conditional",
+            action="store_true",
+            help="Send If-None-Match with the last ETag seen per URL, like a polling client.",
+        )
+        parser.add_argument("--max-invoice-id", type=int, default=1000, help="Upper bound for random invoice ids.")
+        parser.add_argument("--timeout", type=float, default=60)
+
+    def handle(self, *args, **options):
+        self.base_url = options["base_url"].rstrip("/")
+        self.timeout = options["timeout"]
+        self.token = self.login(options["email"], options["password"])
+        mix = {name: DEFAULT_MIX[name] for name in (options["endpoint"] or DEFAULT_MIX)}
+        names = list(mix)
+        weights = [mix[name][0] for name in names]
+
+        latencies = defaultdict(list)
+        statuses = defaultdict(Counter)
+        etags = {}
+        lock = threading.Lock()
+        deadline = time.monotonic() + options["duration"]
+
+        def client(seed):
+            rng = random.Random(seed)
+            while time.monotonic() < deadline:
+                name = rng.choices(names, weights=weights)[0]
+                path = mix[name][1].format(id=rng.randint(1, options["max_invoice_id"]))
+                headers = {"Authorization": f"Bearer {self.token}"}
+                if options["conditional"] and path in etags:
+                    headers["If-None-Match"] = etags[path]
+                start = time.perf_counter()
+                status, etag = self.fetch(path, headers)
+                elapsed = time.perf_counter() - start
+                with lock:
+                    latencies[name].append(elapsed)
+                    statuses[name][status] += 1
+                    if etag:
+                        etags[path] = etag
+
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=options["concurrency"]) as pool:
+            for seed in range(options["concurrency"]):
+                pool.submit(client, seed)
+        wall = time.monotonic() - started
+
+        total = sum(len(values) for values in latencies.values())
+        self.stdout.write(
+            f"{total} requests in {wall:.1f}s with {options['concurrency']} clients: {total / wall:.1f} req/s"
+        )
+        for name in names:
+            values = latencies[name]
+            if not values:
+                continue
+            codes = ", ".join(f"{code}: {count}" for code, count in sorted(statuses[name].items(), key=str))
+            self.stdout.write(
+                f"{name}: {len(values)} requests, {len(values) / wall:.1f} req/s, "
+                f"p50 {statistics.median(values) * 1000:.1f} ms, p90 {percentile(values, 0.9) * 1000:.1f} ms, "
+                f"p99 {percentile(values, 0.99) * 1000:.1f} ms, max {max(values) * 1000:.1f} ms ({codes})"
+            )
+
+    def login(self, email, password):
+        request = urllib.request.Request(
+            f"{self.base_url}/api/login/",
+            data=json.dumps({"email": email, "password": password}).encode(),
+            headers={"Content-Type": "application/json"},
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return json.load(response)["access"]
+        except (urllib.error.URLError, KeyError, ValueError) as e:
+            raise CommandError(f"Login failed: {e}")
+
+    def fetch(self, path, headers):
+        """GET path and read the whole body. Returns (status, etag); network errors count as status "error"."""
+        request = urllib.request.Request(f"{self.base_url}{path}", headers=headers)
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                response.read()
+                return response.status, response.headers.get("ETag")
+        except urllib.error.HTTPError as e:
+            e.read()
+            return e.code, e.headers.get("ETag")
+        except (urllib.error.URLError, TimeoutError, ConnectionError):
+            return "error", None
@@ -0,0 +1,44 @@
+import os
+
+from django.core.management.base import BaseCommand
+
+from api.models import Invoice
+from api.storage import content_hash, hash_file, invoice_storage
+
+
+class Command(BaseCommand):
+    help = "Move invoice files from the flat invoices/ folder into the content-addressed, sharded layout."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dry-run", action="store_true", help="Report what would move without changing anything.")
+
+    def handle(self, *args, **options):
+        names = (
+            Invoice.objects.exclude(invoice_file="")
+            .exclude(invoice_file__isnull=True)
+            .values_list("invoice_file", flat=True)
+            .distinct()
+        )
+        moved = missing = 0
+        for name in names.iterator():
+            if content_hash(name):
+                continue
+            path = invoice_storage.path(name)
+            if not os.path.exists(path):
+                missing += 1
+                self.stderr.write(f"Missing file for {name}")
+                continue
+            digest = hash_file(path)
+            ext = os.path.splitext(name)[1]
+            if options["dry_run"]:
+                self.stdout.write(f"{name} -> {invoice_storage.blob_name(digest, ext)}")
+                moved += 1
+                continue
+            new_name = invoice_storage.place_file(path, digest, ext)
+            # Every invoice pointing at the legacy name follows the file.
+            Invoice.objects.filter(invoice_file=name).update(invoice_file=new_name)
+            if os.path.exists(path):
+                # The content was already stored under its hash; drop the duplicate.
+                os.remove(path)
+            moved += 1
+        self.stdout.write(self.style.SUCCESS(f"Moved {moved} files ({missing} missing)."))
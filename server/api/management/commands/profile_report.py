@@ -0,0 +1,148 @@
+import io
+import json
+import os
+import pstats
+import time
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.profiling import PROFILE_HEADER, issue_token
+
+SORT_KEYS = {
+    "p95": lambda row: row["p95"],
+    "max": lambda row: row["max"],
+    "total": lambda row: row["total"],
+    "count": lambda row: row["count"],
+    "sql": lambda row: row["sql_ms"],
+}
+STACK_FRAMES_SHOWN = 8
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class Command(BaseCommand):
+    help = (
+        "Aggregate the sampled request profiles in PROFILING_DIR: the slowest endpoints by wall time "
+        "with CPU and SQL figures, then the hottest functions and stacks behind them."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dir", default=str(settings.PROFILING_DIR), help="Profile directory.")
+        parser.add_argument("--since", type=float, help="Only requests from the last N hours.")
+        parser.add_argument("--route", help="Only routes containing this text.")
+        parser.add_argument("--sort", choices=sorted(SORT_KEYS), default="p95", help="Endpoint ordering.")
+        parser.add_argument("--top", type=int, default=15, help="Endpoints, functions and stacks shown.")
+        parser.add_argument(
+            "--include-concurrent",
+            action="store_true",
+            help="Also merge stack samples of ASGI requests that overlapped others (they include the others' stacks).",
+        )
+        parser.add_argument("--folded", help="Write the merged stack samples here in folded format, for flame graphs.")
+        parser.add_argument("--issue-token", action="store_true", help=f"Print a signed {PROFILE_HEADER} header value and exit.")
+
+    def handle(self, *args, **options):
+        if options["issue_token"]:
+            self.stdout.write(f"{PROFILE_HEADER}: {issue_token()}")
+            self.stdout.write(f"Valid for {settings.PROFILING_TOKEN_MAX_AGE} seconds.")
+            return
+        records = self.load(options)
+        if not records:
+            raise CommandError(f"No profiles matched in {options['dir']}.")
+        self.report_endpoints(records, options)
+        self.report_functions(records, options)
+        self.report_stacks(records, options)
+
+    def load(self, options):
+        directory = options["dir"]
+        if not os.path.isdir(directory):
+            raise CommandError(f"{directory} does not exist; is PROFILING_SAMPLE_RATE set?")
+        cutoff = time.time() - options["since"] * 3600 if options["since"] else None
+        records = []
+        for name in sorted(os.listdir(directory)):
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(directory, name)) as f:
+                    record = json.load(f)
+            except (OSError, ValueError):
+                # Pruned or being replaced while we read.
+                continue
+            if cutoff and record["at"] < cutoff:
+                continue
+            if options["route"] and options["route"] not in record["route"]:
+                continue
+            record["profile"] = os.path.join(directory, f"{record['id']}.prof")
+            records.append(record)
+        return records
+
+    def report_endpoints(self, records, options):
+        by_endpoint = defaultdict(list)
+        for record in records:
+            by_endpoint[(record["method"], record["route"])].append(record)
+        rows = []
+        for (method, route), group in by_endpoint.items():
+            walls = [record["wall_ms"] for record in group]
+            rows.append({
+                "endpoint": f"{method} {route}",
+                "count": len(group),
+                "p50": percentile(walls, 0.5),
+                "p95": percentile(walls, 0.95),
+                "max": max(walls),
+                "total": sum(walls),
+                "cpu_ms": sum(record["cpu_ms"] for record in group) / len(group),
+                "sql_count": sum(record["sql_count"] for record in group) / len(group),
+                "sql_ms": sum(record["sql_ms"] for record in group) / len(group),
+            })
+        rows.sort(key=SORT_KEYS[options["sort"]], reverse=True)
+
+        self.stdout.write(self.style.MIGRATE_HEADING(f"Endpoints ({len(records)} requests, by {options['sort']}, times in ms)"))
+        self.stdout.write(f"{'count':>6} {'p50':>9} {'p95':>9} {'max':>9} {'cpu':>9} {'queries':>8} {'sql':>9}  endpoint")
+        for row in rows[:options["top"]]:
+            self.stdout.write(
+                f"{row['count']:>6} {row['p50']:>9.1f} {row['p95']:>9.1f} {row['max']:>9.1f} {row['cpu_ms']:>9.1f} "
+                f"{row['sql_count']:>8.1f} {row['sql_ms']:>9.1f}  {row['endpoint']}"
+            )
+
+    def report_functions(self, records, options):
+        profiles = [record["profile"] for record in records if record["mode"] == "cprofile" and os.path.exists(record["profile"])]
+        if not profiles:
+            return
+        buffer = io.StringIO()
+        stats = pstats.Stats(profiles[0], stream=buffer)
+        for path in profiles[1:]:
+            stats.add(path)
+        stats.files = []  # Otherwise the report opens with one line per dump
+        stats.strip_dirs().sort_stats(pstats.SortKey.CUMULATIVE).print_stats(options["top"])
+        self.stdout.write(self.style.MIGRATE_HEADING(f"\nFunctions by cumulative time ({len(profiles)} cProfile dumps)"))
+        self.stdout.write(buffer.getvalue().strip("\n"))
+
+    def report_stacks(self, records, options):
+        stacks = Counter()
+        sampled = 0
+        for record in records:
+            if record["mode"] != "samples":
+                continue
+            if record["concurrent"] > 1 and not options["include_concurrent"]:
+                continue
+            stacks.update(record["stacks"])
+            sampled += 1
+        if not stacks:
+            return
+        if options["folded"]:
+            with open(options["folded"], "w") as f:
+                for stack, count in stacks.most_common():
+                    f.write(f"{stack} {count}\n")
+            self.stdout.write(f"Wrote {len(stacks)} folded stacks to {options['folded']}.")
+
+        total = sum(stacks.values())
+        self.stdout.write(self.style.MIGRATE_HEADING(f"\nHottest stacks ({total} samples from {sampled} requests)"))
+        for stack, count in stacks.most_common(options["top"]):
+            frames = stack.split(";")
+            shown = " > ".join(frames[-STACK_FRAMES_SHOWN:])
+            prefix = "... > " if len(frames) > STACK_FRAMES_SHOWN else ""
+            self.stdout.write(f"{count / total:>6.1%}  {prefix}{shown}")
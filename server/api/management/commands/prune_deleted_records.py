@@ -0,0 +1,27 @@
+import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from api.versioning import prune_deleted_records
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete tombstones of rows deleted more than DELETED_RECORD_RETENTION_DAYS ago. "
+        "Delta listings older than the pruned versions answer 410 and clients reload in full."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--older-than-days", type=int, default=settings.DELETED_RECORD_RETENTION_DAYS,
+            help="Prune tombstones recorded more than this many days ago.",
+        )
+
+    def handle(self, *args, **options):
+        if options["older_than_days"] < 0:
+            raise CommandError("--older-than-days must not be negative.")
+        cutoff = timezone.now() - datetime.timedelta(days=options["older_than_days"])
+        removed = prune_deleted_records(cutoff)
+        self.stdout.write(self.style.SUCCESS(f"pruned {removed} tombstones"))
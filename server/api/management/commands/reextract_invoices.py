@@ -0,0 +1,165 @@
+import datetime
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.models import Invoice
+from api.reextraction import EDITABLE_STATUS, apply_changes, diff_fields, extract_stored_file, init_worker
+from api.storage import invoice_storage
+
+COUNTERS = ("processed", "updated", "unchanged", "held", "conflicts", "stale", "failed", "missing")
+
+
+class Command(BaseCommand):
+    help = (
+        "Re-run extraction over stored invoice files in a process pool and update the invoices whose "
+        "fields changed. Progress is checkpointed after every batch so an interrupted run resumes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Extraction processes.")
+        parser.add_argument("--batch-size", type=int, default=50, help="Invoices extracted and written per transaction.")
+        parser.add_argument("--checkpoint", default="reextract_checkpoint.json", help="Progress file; resumed when present.")
+        parser.add_argument("--restart", action="store_true", help="Ignore an existing checkpoint and start from the first invoice.")
+        parser.add_argument("--limit", type=int, help="Stop after this many invoices in this run.")
+        parser.add_argument("--full-page", action="store_true", help="Use full-page OCR instead of the template/zone path.")
+        parser.add_argument(
+            "--include-reviewed",
+            action="store_true",
+            help=f"Also update invoices past '{EDITABLE_STATUS}'; by default their differences are only reported.",
+        )
+        parser.add_argument("--dry-run", action="store_true", help="Report differences without writing invoices.")
+        parser.add_argument("--diff-log", help="Append one JSON line per changed invoice to this file.")
+
+    def handle(self, *args, **options):
+        if options["workers"] < 1 or options["batch_size"] < 1:
+            raise CommandError("--workers and --batch-size must be at least 1.")
+        checkpoint = options["checkpoint"]
+        # A dry run must not advance the checkpoint of a real one.
+        state = self.load_checkpoint(checkpoint) if not (options["restart"] or options["dry_run"]) else None
+        state = state or {"last_id": 0, **{counter: 0 for counter in COUNTERS}}
+        if state["last_id"]:
+            self.stdout.write(f"Resuming after invoice {state['last_id']}.")
+
+        invoices = (
+            Invoice.objects.exclude(invoice_file="")
+            .exclude(invoice_file__isnull=True)
+            .filter(id__gt=state["last_id"])
+            .select_related("vendor")
+            .order_by("id")
+        )
+        if options["limit"]:
+            invoices = invoices[:options["limit"]]
+        diff_log = open(options["diff_log"], "a") if options["diff_log"] else None
+        # Spawned rather than forked workers, so none inherits the parent's open database connection.
+        context = multiprocessing.get_context("spawn")
+        try:
+            with ProcessPoolExecutor(max_workers=options["workers"], mp_context=context, initializer=init_worker) as pool:
+                for batch in self.batches(invoices, options["batch_size"]):
+                    self.run_batch(pool, batch, state, options, diff_log)
+                    state["last_id"] = batch[-1].id
+                    if not options["dry_run"]:
+                        self.save_checkpoint(checkpoint, state)
+                    self.stdout.write(
+                        f"Through invoice {state['last_id']}: "
+                        + ", ".join(f"{counter} {state[counter]}" for counter in COUNTERS)
+                    )
+        finally:
+            if diff_log:
+                diff_log.close()
+
+        self.stdout.write(self.style.SUCCESS(
+            ("Dry run: " if options["dry_run"] else "")
+            + ", ".join(f"{counter} {state[counter]}" for counter in COUNTERS)
+        ))
+        if not options["dry_run"] and os.path.exists(checkpoint) and not options["limit"]:
+            # The run reached the last invoice; the next one starts over.
+            os.remove(checkpoint)
+
+    def batches(self, invoices, size):
+        batch = []
+        for invoice in invoices.iterator(chunk_size=size):
+            batch.append(invoice)
+            if len(batch) == size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def run_batch(self, pool, batch, state, options, diff_log):
+        tasks = []
+        by_id = {}
+        for invoice in batch:
+            path = invoice_storage.path(invoice.invoice_file.name)
+            if not os.path.exists(path):
+                state["missing"] += 1
+                self.stderr.write(f"Invoice {invoice.id}: missing file {invoice.invoice_file.name}")
+                continue
+            pages = (invoice.page_start, invoice.page_end) if invoice.page_start else None
+            tasks.append((invoice.id, path, options["full_page"], pages, invoice.site_id))
+            by_id[invoice.id] = invoice
+
+        pending = {}
+        for invoice_id, fields, error in pool.map(extract_stored_file, tasks):
+            state["processed"] += 1
+            if error:
+                state["failed"] += 1
+                self.stderr.write(f"Invoice {invoice_id}: {error}")
+                continue
+            invoice = by_id[invoice_id]
+            changes = diff_fields(invoice, fields)
+            vendor_name = fields.get("vendor_name")
+            vendor_changed = bool(vendor_name) and vendor_name != invoice.vendor.vendor_name
+            if not changes and not vendor_changed:
+                state["unchanged"] += 1
+                continue
+            editable = options["include_reviewed"] or invoice.status == EDITABLE_STATUS
+            if diff_log:
+                diff_log.write(json.dumps({
+                    "invoice": invoice_id,
+                    "status": invoice.status,
+                    "eligible": bool(changes) and editable,
+                    "changes": {field: [str(old), str(new)] for field, (old, new) in changes.items()},
+                    # Vendor reassignment is left to a reviewer.
+                    "vendor_name": [invoice.vendor.vendor_name, vendor_name] if vendor_changed else None,
+                    "at": datetime.datetime.now().isoformat(timespec="seconds"),
+                }) + "\n")
+            if not changes:
+                state["unchanged"] += 1
+            elif editable:
+                pending[invoice_id] = changes
+            else:
+                state["held"] += 1
+
+        if options["dry_run"]:
+            state["updated"] += len(pending)
+            return
+        updated, conflicts, stale = apply_changes(pending, include_reviewed=options["include_reviewed"])
+        state["updated"] += updated
+        state["conflicts"] += len(conflicts)
+        state["stale"] += len(stale)
+        for invoice_id in conflicts:
+            self.stderr.write(f"Invoice {invoice_id}: vendor already has an invoice with the new number; skipped.")
+        for invoice_id in stale:
+            self.stderr.write(f"Invoice {invoice_id}: edited or reviewed while being re-extracted; skipped.")
+        if diff_log:
+            diff_log.flush()
+
+    def load_checkpoint(self, path):
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            state = json.load(f)
+        for counter in COUNTERS:
+            state.setdefault(counter, 0)
+        return state
+
+    def save_checkpoint(self, path, state):
+        # Write then rename so a crash never leaves a truncated checkpoint.
+        tmp = f"{path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp, path)
@@ -0,0 +1,36 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.ocr_daemon import OCRDaemon
+
+
+class Command(BaseCommand):
+    help = (
+        "Run the extraction daemon: a pool of OCR worker processes serving jobs from web processes "
+        "over a Unix socket (see OCR_DAEMON_SOCKET)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--socket", default=settings.OCR_DAEMON_SOCKET, help="Socket path; defaults to OCR_DAEMON_SOCKET.")
+        parser.add_argument("--workers", type=int, default=settings.OCR_DAEMON_WORKERS)
+        parser.add_argument("--max-jobs", type=int, default=settings.OCR_WORKER_MAX_JOBS, help="Replace a worker after this many jobs.")
+        parser.add_argument("--max-rss-mb", type=int, default=settings.OCR_WORKER_MAX_RSS_MB, help="Replace a worker above this RSS.")
+        parser.add_argument("--job-timeout", type=int, default=settings.OCR_JOB_TIMEOUT, help="Kill a worker stuck on one job this long.")
+
+    def handle(self, *args, **options):
+        if not options["socket"]:
+            raise CommandError("Set OCR_DAEMON_SOCKET or pass --socket.")
+        if options["workers"] < 1:
+            raise CommandError("--workers must be at least 1.")
+        daemon = OCRDaemon(
+            options["socket"],
+            workers=options["workers"],
+            max_jobs=options["max_jobs"],
+            max_rss_mb=options["max_rss_mb"],
+            job_timeout=options["job_timeout"],
+        )
+        self.stdout.write(f"Listening on {options['socket']} with {options['workers']} workers.")
+        try:
+            daemon.serve_forever()
+        except KeyboardInterrupt:
+            self.stdout.write("Stopped.")
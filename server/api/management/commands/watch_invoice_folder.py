@@ -0,0 +1,138 @@
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.conf import settings
+from django.contrib.sites.models import Site
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+from api.hot_folder import (
+    PROCESSING_DIR,
+    StabilityTracker,
+    claim,
+    finish_file,
+    ingest_file,
+    is_candidate,
+    move_file,
+    open_watcher,
+)
+from api.ocr_daemon import OCRDaemonUnavailable
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+COUNTERS = ("done", "failed", "retried")
+
+
+class Command(BaseCommand):
+    help = (
+        "Watch a drop folder (scanners, mail-to-folder rules) and ingest invoice files once they stop "
+        "changing, moving each to done/ or failed/. Files interrupted by a crash are picked up again on restart."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("folder", help="Directory to watch; processing/, done/ and failed/ are created inside it.")
+        parser.add_argument("--done-dir", help="Where ingested files go; defaults to <folder>/done.")
+        parser.add_argument("--failed-dir", help="Where files that could not be ingested go; defaults to <folder>/failed.")
+        parser.add_argument("--site", type=int, default=settings.SITE_ID, help="Id of the site the invoices belong to.")
+        parser.add_argument("--workers", type=int, default=settings.EXTRACTION_WORKERS, help="Files extracted in parallel.")
+        parser.add_argument("--batch-size", type=int, default=20, help="Most files claimed at once.")
+        parser.add_argument("--settle", type=float, default=5, help="Seconds a file must stay unchanged before it is taken.")
+        parser.add_argument("--interval", type=float, default=1, help="Seconds between checks (and rescans when polling).")
+        parser.add_argument("--poll", action="store_true", help="Rescan instead of using inotify, e.g. on network mounts.")
+        parser.add_argument("--once", action="store_true", help="Ingest what is in the folder now, then exit.")
+
+    def handle(self, *args, **options):
+        if options["workers"] < 1 or options["batch_size"] < 1:
+            raise CommandError("--workers and --batch-size must be at least 1.")
+        if not Site.objects.filter(pk=options["site"]).exists():
+            raise CommandError(f"No site with id {options['site']}.")
+        self.site_id = options["site"]
+        folder = os.path.abspath(options["folder"])
+        if not os.path.isdir(folder):
+            raise CommandError(f"{folder} is not a directory.")
+        self.processing_dir = os.path.join(folder, PROCESSING_DIR)
+        self.done_dir = options["done_dir"] or os.path.join(folder, "done")
+        self.failed_dir = options["failed_dir"] or os.path.join(folder, "failed")
+        self.folder = folder
+        os.makedirs(self.processing_dir, exist_ok=True)
+        self.counts = dict.fromkeys(COUNTERS, 0)
+        lock = self.lock_folder()
+
+        watcher = open_watcher(folder, poll=options["poll"])
+        tracker = StabilityTracker(folder, options["settle"])
+        self.stdout.write(f"Watching {folder} ({type(watcher).__name__}, {options['workers']} workers).")
+        try:
+            with ThreadPoolExecutor(max_workers=options["workers"], thread_name_prefix="hot-folder") as pool:
+                # Files a previous run claimed but never finished.
+                interrupted = sorted(
+                    os.path.join(self.processing_dir, name) for name in os.listdir(self.processing_dir) if is_candidate(name)
+                )
+                if interrupted:
+                    self.stdout.write(f"Resuming {len(interrupted)} interrupted files.")
+                for start in range(0, len(interrupted), options["batch_size"]):
+                    self.run_batch(pool, interrupted[start:start + options["batch_size"]])
+
+                tracker.observe()
+                while True:
+                    ready = tracker.ready()[:options["batch_size"]]
+                    if ready:
+                        for name in ready:
+                            tracker.forget(name)
+                        claimed = [path for path in (claim(folder, name) for name in ready) if path]
+                        self.run_batch(pool, claimed)
+                        tracker.observe()
+                        continue
+                    if options["once"] and not tracker.pending():
+                        break
+                    tracker.observe(watcher.wait(options["interval"]))
+        except KeyboardInterrupt:
+            self.stdout.write("Stopped; files being processed are resumed on the next start.")
+        finally:
+            watcher.close()
+            if lock:
+                lock.close()
+        self.stdout.write(self.style.SUCCESS(", ".join(f"{counter} {self.counts[counter]}" for counter in COUNTERS)))
+
+    def lock_folder(self):
+        """Hold an exclusive lock on the folder for the life of the process, so two watchers never share it."""
+        if fcntl is None:
+            return None
+        lock = open(os.path.join(self.processing_dir, ".lock"), "w")
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock.close()
+            raise CommandError(f"Another watcher is already running on {self.folder}.")
+        return lock
+
+    def run_batch(self, pool, paths):
+        futures = {pool.submit(self.ingest, path): path for path in paths}
+        for future in as_completed(futures):
+            path = futures[future]
+            name = os.path.basename(path)
+            try:
+                outcome = future.result()
+            except OCRDaemonUnavailable as e:
+                # Not the file's fault: put it back to be taken again once it settles.
+                move_file(path, self.folder)
+                self.counts["retried"] += 1
+                self.stderr.write(f"{name}: {e}; will retry")
+            except Exception as e:
+                finish_file(path, self.failed_dir, error=str(e))
+                self.counts["failed"] += 1
+                self.stderr.write(f"{name}: failed: {e}")
+            else:
+                finish_file(path, self.done_dir)
+                self.counts["done"] += 1
+                self.stdout.write(f"{name}: {outcome}")
+
+    def ingest(self, path):
+        # Worker threads live as long as the watcher; drop connections the database may have timed out.
+        close_old_connections()
+        try:
+            return ingest_file(path, self.site_id)
+        finally:
+            close_old_connections()
@@ -0,0 +1,54 @@
+# Generated by Django 5.1.7 on 2026-10-19 16:01
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0002_alter_vendor_vendor_name"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="VendorTemplate",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("fingerprint", models.CharField(max_length=16)),
+                ("field_boxes", models.JSONField(default=dict)),
+                ("sample_values", models.JSONField(default=dict)),
+                ("confirmed", models.BooleanField(default=False)),
+                ("confidence", models.FloatField(default=1.0)),
+                ("uses", models.PositiveIntegerField(default=0)),
+                ("failures", models.PositiveIntegerField(default=0)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                (
+                    "source_invoice",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="+",
+                        to="api.invoice",
+                    ),
+                ),
+                (
+                    "vendor",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="template",
+                        to="api.vendor",
+                    ),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.1.7 on 2026-10-19 16:05
+
+import api.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0003_vendortemplate"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="invoice",
+            name="invoice_file",
+            field=models.FileField(
+                blank=True,
+                db_index=True,
+                null=True,
+                storage=api.storage.ContentAddressedStorage(),
+                upload_to="invoices/",
+            ),
+        ),
+    ]
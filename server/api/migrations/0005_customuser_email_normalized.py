@@ -0,0 +1,41 @@
+# Generated by Django 5.1.7 on 2026-10-19 16:40
+
+from django.db import migrations, models
+
+
+def populate_email_normalized(apps, schema_editor):
+    CustomUser = apps.get_model("api", "CustomUser")
+    seen = set()
+    for user in CustomUser.objects.order_by("id").only("id", "email"):
+        email = (user.email or "").strip().lower() or None
+        if email in seen:
+            # Duplicate addresses cannot log in by email; the oldest account keeps it.
+            email = None
+        if email:
+            seen.add(email)
+        CustomUser.objects.filter(pk=user.pk).update(email_normalized=email)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0004_invoice_file_content_addressed"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="customuser",
+            name="email_normalized",
+            field=models.CharField(
+                blank=True, editable=False, max_length=254, null=True
+            ),
+        ),
+        migrations.RunPython(populate_email_normalized, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name="customuser",
+            name="email_normalized",
+            field=models.CharField(
+                blank=True, editable=False, max_length=254, null=True, unique=True
+            ),
+        ),
+    ]
@@ -0,0 +1,67 @@
+# Generated by Django 5.1.7 on 2026-10-19 16:10
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def seed_resource_versions(apps, schema_editor):
+    ResourceVersion = apps.get_model("api", "ResourceVersion")
+    for name in ("invoice", "vendor"):
+        ResourceVersion.objects.get_or_create(name=name)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0005_customuser_email_normalized"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ResourceVersion",
+            fields=[
+                (
+                    "name",
+                    models.CharField(max_length=50, primary_key=True, serialize=False),
+                ),
+                ("version", models.BigIntegerField(default=0)),
+                ("updated_at", models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.AddField(
+            model_name="invoice",
+            name="row_version",
+            field=models.BigIntegerField(db_index=True, default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="vendor",
+            name="row_version",
+            field=models.BigIntegerField(db_index=True, default=0, editable=False),
+        ),
+        migrations.CreateModel(
+            name="DeletedRecord",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("resource", models.CharField(max_length=50)),
+                ("object_id", models.BigIntegerField()),
+                ("version", models.BigIntegerField()),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["resource", "version"],
+                        name="api_deleted_resourc_a85b16_idx",
+                    )
+                ],
+            },
+        ),
+        migrations.RunPython(seed_resource_versions, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,85 @@
+# Generated by Django 5.1.7 on 2026-10-19 16:21
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+FULLTEXT_INDEX = "api_invoicetext_text_ft"
+
+
+def create_fulltext_index(apps, schema_editor):
+    # Only MySQL gets a FULLTEXT index; other backends use the SearchTerm postings.
+    if schema_editor.connection.vendor == "mysql":
+        schema_editor.execute(
+            f"CREATE FULLTEXT INDEX {FULLTEXT_INDEX} ON api_invoicetext (text)"
+        )
+
+
+def drop_fulltext_index(apps, schema_editor):
+    if schema_editor.connection.vendor == "mysql":
+        schema_editor.execute(f"DROP INDEX {FULLTEXT_INDEX} ON api_invoicetext")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0006_change_tracking"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="InvoiceText",
+            fields=[
+                (
+                    "invoice",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="ocr_text",
+                        serialize=False,
+                        to="api.invoice",
+                    ),
+                ),
+                ("text", models.TextField()),
+                ("complete", models.BooleanField(default=False)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name="SearchTermStat",
+            fields=[
+                (
+                    "term",
+                    models.CharField(max_length=64, primary_key=True, serialize=False),
+                ),
+                ("documents", models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name="SearchTerm",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("term", models.CharField(max_length=64)),
+                ("weight", models.FloatField()),
+                (
+                    "invoice",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="search_terms",
+                        to="api.invoice",
+                    ),
+                ),
+            ],
+            options={
+                "unique_together": {("term", "invoice")},
+            },
+        ),
+        migrations.RunPython(create_fulltext_index, drop_fulltext_index),
+    ]
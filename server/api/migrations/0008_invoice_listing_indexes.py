@@ -0,0 +1,48 @@
+# Generated by Django 5.1.7 on 2026-10-19 16:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0007_invoice_text_search"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="vendor",
+            name="category",
+            field=models.CharField(
+                blank=True, db_index=True, max_length=255, null=True
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="invoice",
+            index=models.Index(
+                fields=["vendor", "invoice_date"], name="api_invoice_vendor__f9ad68_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="invoice",
+            index=models.Index(
+                fields=["status", "invoice_date"], name="api_invoice_status_3ccb68_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="invoice",
+            index=models.Index(
+                fields=["status", "created_at"], name="api_invoice_status_0fdef1_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="invoice",
+            index=models.Index(
+                fields=["invoice_date"], name="api_invoice_invoice_540bba_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="invoice",
+            index=models.Index(fields=["amount"], name="api_invoice_amount_a4d5a9_idx"),
+        ),
+    ]
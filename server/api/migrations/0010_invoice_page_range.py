@@ -0,0 +1,23 @@
+# Generated by Django 5.1.7 on 2026-10-19 16:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0009_near_duplicate_sketches"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="invoice",
+            name="page_end",
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="invoice",
+            name="page_start",
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
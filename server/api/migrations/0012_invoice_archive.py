@@ -0,0 +1,90 @@
+# Generated by Django 5.1.7 on 2026-10-19 16:52
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0011_chunked_upload_sessions"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ArchivedFile",
+            fields=[
+                (
+                    "sha256",
+                    models.CharField(max_length=64, primary_key=True, serialize=False),
+                ),
+                ("name", models.CharField(max_length=255)),
+                ("bundle", models.CharField(max_length=32)),
+                ("offset", models.BigIntegerField()),
+                ("length", models.BigIntegerField()),
+                ("size", models.BigIntegerField()),
+                ("codec", models.CharField(max_length=8)),
+            ],
+        ),
+        migrations.AddField(
+            model_name="invoice",
+            name="closed_at",
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.CreateModel(
+            name="ArchivedInvoice",
+            fields=[
+                ("id", models.BigIntegerField(primary_key=True, serialize=False)),
+                ("invoice_number", models.CharField(max_length=100)),
+                ("invoice_date", models.DateField()),
+                ("amount", models.DecimalField(decimal_places=2, max_digits=12)),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("Pending for review", "Pending for review"),
+                            ("Pending for approval", "Pending for approval"),
+                            ("Approved", "Approved"),
+                            ("Paid", "Paid"),
+                            ("Closed", "Closed"),
+                        ],
+                        max_length=50,
+                    ),
+                ),
+                ("page_start", models.PositiveIntegerField(blank=True, null=True)),
+                ("page_end", models.PositiveIntegerField(blank=True, null=True)),
+                ("created_at", models.DateTimeField()),
+                ("closed_at", models.DateTimeField(blank=True, null=True)),
+                ("archived_at", models.DateTimeField(auto_now_add=True)),
+                (
+                    "archived_file",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.PROTECT,
+                        related_name="invoices",
+                        to="api.archivedfile",
+                    ),
+                ),
+                (
+                    "vendor",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="archived_invoices",
+                        to="api.vendor",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["vendor", "invoice_date"],
+                        name="api_archive_vendor__ead9ec_idx",
+                    ),
+                    models.Index(
+                        fields=["invoice_date"], name="api_archive_invoice_d2f7ac_idx"
+                    ),
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,170 @@
+# Generated by Django 5.1.7 on 2026-10-19 16:57
+
+import api.models
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def create_default_site(apps, schema_editor):
+    # Existing rows get SITE_ID, which must exist before the foreign keys are added.
+    Site = apps.get_model("sites", "Site")
+    Site.objects.get_or_create(
+        pk=settings.SITE_ID, defaults={"domain": "example.com", "name": "example.com"}
+    )
+
+
+def move_counters_to_default_site(apps, schema_editor):
+    # Existing rows and the versions clients already hold now count under SITE_ID.
+    ResourceVersion = apps.get_model("api", "ResourceVersion")
+    DeletedRecord = apps.get_model("api", "DeletedRecord")
+    for resource in ("invoice", "vendor"):
+        name = f"{resource}@{settings.SITE_ID}"
+        counter = ResourceVersion.objects.filter(name=resource).first()
+        if counter:
+            ResourceVersion.objects.update_or_create(
+                name=name,
+                defaults={"version": counter.version, "updated_at": counter.updated_at},
+            )
+            counter.delete()
+        DeletedRecord.objects.filter(resource=resource).update(resource=name)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0012_invoice_archive"),
+        ("sites", "0002_alter_domain_unique"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_default_site, migrations.RunPython.noop),
+        migrations.AddField(
+            model_name="archivedinvoice",
+            name="site",
+            field=models.ForeignKey(
+                default=api.models.default_site_id,
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="archived_invoices",
+                to="sites.site",
+            ),
+        ),
+        migrations.AddField(
+            model_name="customuser",
+            name="site",
+            field=models.ForeignKey(
+                default=api.models.default_site_id,
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="users",
+                to="sites.site",
+            ),
+        ),
+        migrations.AddField(
+            model_name="invoice",
+            name="site",
+            field=models.ForeignKey(
+                default=api.models.default_site_id,
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="invoices",
+                to="sites.site",
+            ),
+        ),
+        migrations.AddField(
+            model_name="vendor",
+            name="site",
+            field=models.ForeignKey(
+                default=api.models.default_site_id,
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="vendors",
+                to="sites.site",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="vendor",
+            name="category",
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+        migrations.AlterField(
+            model_name="vendor",
+            name="vendor_name",
+            field=models.CharField(max_length=500),
+        ),
+        migrations.AddIndex(
+            model_name="archivedinvoice",
+            index=models.Index(
+                fields=["site", "invoice_date"], name="api_archive_site_id_1334ef_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="archivedinvoice",
+            index=models.Index(
+                fields=["site", "created_at"], name="api_archive_site_id_6f48d8_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="invoice",
+            index=models.Index(
+                fields=["site", "status", "invoice_date"],
+                name="api_invoice_site_id_913d60_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="invoice",
+            index=models.Index(
+                fields=["site", "status", "created_at"],
+                name="api_invoice_site_id_f87edc_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="invoice",
+            index=models.Index(
+                fields=["site", "invoice_date"], name="api_invoice_site_id_334244_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="invoice",
+            index=models.Index(
+                fields=["site", "amount"], name="api_invoice_site_id_43760c_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="invoice",
+            index=models.Index(
+                fields=["site", "created_at"], name="api_invoice_site_id_2e6011_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="vendor",
+            index=models.Index(
+                fields=["site", "category"], name="api_vendor_site_id_68c3fe_idx"
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="vendor",
+            constraint=models.UniqueConstraint(
+                fields=("site", "vendor_name"), name="unique_vendor_name_per_site"
+            ),
+        ),
+        # The new indexes are in place before the ones they replace go.
+        migrations.RemoveIndex(
+            model_name="archivedinvoice",
+            name="api_archive_invoice_d2f7ac_idx",
+        ),
+        migrations.RemoveIndex(
+            model_name="invoice",
+            name="api_invoice_status_3ccb68_idx",
+        ),
+        migrations.RemoveIndex(
+            model_name="invoice",
+            name="api_invoice_status_0fdef1_idx",
+        ),
+        migrations.RemoveIndex(
+            model_name="invoice",
+            name="api_invoice_invoice_540bba_idx",
+        ),
+        migrations.RemoveIndex(
+            model_name="invoice",
+            name="api_invoice_amount_a4d5a9_idx",
+        ),
+        migrations.RunPython(move_counters_to_default_site, migrations.RunPython.noop),
+    ]
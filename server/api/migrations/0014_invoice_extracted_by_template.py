@@ -0,0 +1,26 @@
+# Generated by Django 5.1.7 on 2026-10-19 17:08
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0013_site_tenancy"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="invoice",
+            name="extracted_by_template",
+            field=models.ForeignKey(
+                blank=True,
+                editable=False,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="+",
+                to="api.vendortemplate",
+            ),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.1.7 on 2026-10-19 17:10
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0014_invoice_extracted_by_template"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="deletedrecord",
+            name="deleted_at",
+            field=models.DateTimeField(
+                db_index=True, default=django.utils.timezone.now
+            ),
+        ),
+        migrations.AddField(
+            model_name="resourceversion",
+            name="pruned_through",
+            field=models.BigIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.1.7 on 2026-10-19 17:18
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0015_prune_deleted_records"),
+        ("sites", "0002_alter_domain_unique"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="archivedinvoice",
+            name="vendor",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="archived_invoices",
+                to="api.vendor",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="archivedinvoice",
+            index=models.Index(
+                fields=["vendor", "invoice_number"],
+                name="api_archive_vendor__80c23c_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.1.7 on 2026-10-19 17:29
+
+import api.models
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def copy_vendor_sites(apps, schema_editor):
+    VendorTemplate = apps.get_model("api", "VendorTemplate")
+    Vendor = apps.get_model("api", "Vendor")
+    VendorTemplate.objects.update(
+        site_id=Subquery(
+            Vendor.objects.filter(pk=OuterRef("vendor_id")).values("site_id")[:1]
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0016_archived_invoice_protect_vendor"),
+        ("sites", "0002_alter_domain_unique"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="vendortemplate",
+            name="site",
+            field=models.ForeignKey(
+                default=api.models.default_site_id,
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="vendor_templates",
+                to="sites.site",
+            ),
+        ),
+        migrations.RunPython(copy_vendor_sites, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="vendortemplate",
+            index=models.Index(
+                fields=["site", "confirmed"], name="api_vendort_site_id_dd8e10_idx"
+            ),
+        ),
+    ]
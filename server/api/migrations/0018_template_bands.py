@@ -0,0 +1,82 @@
+# Generated by Django 5.1.7 on 2026-10-19 17:30
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# As in api/vendor_templates.py when this migration was written.
+FINGERPRINT_BITS = 64
+FINGERPRINT_BANDS = 9
+
+
+def fingerprint_buckets(fingerprint):
+    bits = int(fingerprint, 16)
+    bounds = [
+        band * FINGERPRINT_BITS // FINGERPRINT_BANDS
+        for band in range(FINGERPRINT_BANDS + 1)
+    ]
+    return [
+        (band << 16) | ((bits >> (FINGERPRINT_BITS - end)) & ((1 << (end - start)) - 1))
+        for band, (start, end) in enumerate(zip(bounds, bounds[1:]))
+    ]
+
+
+def band_confirmed_templates(apps, schema_editor):
+    VendorTemplate = apps.get_model("api", "VendorTemplate")
+    TemplateBand = apps.get_model("api", "TemplateBand")
+    TemplateBand.objects.bulk_create(
+        TemplateBand(bucket=bucket, template_id=template.id, site_id=template.site_id)
+        for template in VendorTemplate.objects.filter(confirmed=True).only(
+            "id", "site_id", "fingerprint"
+        )
+        for bucket in fingerprint_buckets(template.fingerprint)
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0017_vendortemplate_site"),
+        ("sites", "0002_alter_domain_unique"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TemplateBand",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("bucket", models.IntegerField()),
+                (
+                    "site",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.PROTECT,
+                        related_name="+",
+                        to="sites.site",
+                    ),
+                ),
+                (
+                    "template",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="bands",
+                        to="api.vendortemplate",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["site", "bucket"], name="api_templat_site_id_4833b1_idx"
+                    )
+                ],
+            },
+        ),
+        migrations.RunPython(band_confirmed_templates, migrations.RunPython.noop),
+    ]
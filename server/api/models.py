@@ -1,9 +1,22 @@
 # api/models.py
+import uuid
+
+from django.conf import settings
 from django.contrib.auth.models import AbstractUser, Group, Permission
-from django.db import models
-from django.db.models import Sum
+from django.contrib.sites.models import Site
+from django.db import models, transaction
+from django.db.models import F, Sum
 from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
+from django.utils import timezone
+from .storage import invoice_storage
+
+def normalize_login_email(email):
+    """Canonical form of an email address for login lookups; None when blank."""
+    return (email or "").strip().lower() or None
+
+def default_site_id():
+    return settings.SITE_ID
 
 # -------------------------------
 # Custom User Model (Users remain)
@@ -17,15 +30,93 @@ class CustomUser(AbstractUser):
     role = models.CharField(max_length=20, choices=ROLE_CHOICES, default='user')
     groups = models.ManyToManyField(Group, related_name="customuser_set", blank=True)
     user_permissions = models.ManyToManyField(Permission, related_name="customuser_set", blank=True)
+    # Lower-cased email, unique and indexed so login is a single index lookup.
+    email_normalized = models.CharField(max_length=254, unique=True, blank=True, null=True, editable=False)
+    # The restaurant whose vendors and invoices the user works with (see api/tenancy.py).
+    site = models.ForeignKey(Site, on_delete=models.PROTECT, default=default_site_id, related_name='users')
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # The address as loaded (None while deferred), so save() only renormalizes a changed one.
+        self._loaded_email = self.__dict__.get("email")
 
     def __str__(self):
         return self.username
 
+    def save(self, *args, **kwargs):
+        # An account left without a login email as a case-duplicate (migration 0005)
+        # keeps none until claim_login_email() hands it one.
+        if self._state.adding or self.__dict__.get("email") != self._loaded_email:
+            self.email_normalized = normalize_login_email(self.email)
+            update_fields = kwargs.get("update_fields")
+            if update_fields is not None and "email" in update_fields:
+                kwargs["update_fields"] = set(update_fields) | {"email_normalized"}
+        super().save(*args, **kwargs)
+        self._loaded_email = self.__dict__.get("email")
+
+    def claim_login_email(self):
+        """Make this account the one that logs in with its email, taking it from a case-duplicate."""
+        email = normalize_login_email(self.email)
+        with transaction.atomic():
+            CustomUser.objects.filter(email_normalized=email).exclude(pk=self.pk).update(email_normalized=None)
+            CustomUser.objects.filter(pk=self.pk).update(email_normalized=email)
+        self.email_normalized = email
+
+# -------------------------------
+# Change Tracking Models
+# -------------------------------
+class ResourceVersion(models.Model):
+    """Change counter per resource and site ("invoice@1", "vendor@1"), bumped by every write to it."""
+    name = models.CharField(max_length=50, primary_key=True)
+    version = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(default=timezone.now)
+    # Tombstones up to this version were pruned; older deltas need a full reload.
+    pruned_through = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.name} v{self.version}"
+
+class DeletedRecord(models.Model):
+    """Tombstone of a deleted row, so delta listings can report deletions."""
+    resource = models.CharField(max_length=50)
+    object_id = models.BigIntegerField()
+    version = models.BigIntegerField()
+    deleted_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['resource', 'version'])]
+
+def site_resource(resource, site_id):
+    """
+    Name of a resource's change counter for one site. Each site counts its
+    own writes, so they neither invalidate nor lock other sites' listings.
+    """
+    return f"{resource}@{site_id}"
+
+def bump_version(resource):
+    """
+    Increment a resource's change counter and return the new value. Call it
+    inside the writing transaction: the counter row stays locked until commit,
+    so versions are handed out in commit order.
+    """
+    updated = ResourceVersion.objects.filter(name=resource).update(version=F('version') + 1, updated_at=timezone.now())
+    if not updated:
+        ResourceVersion.objects.get_or_create(name=resource)
+        ResourceVersion.objects.filter(name=resource).update(version=F('version') + 1, updated_at=timezone.now())
+    return ResourceVersion.objects.filter(name=resource).values_list('version', flat=True).get()
+
+def _with_version_field(kwargs):
+    update_fields = kwargs.get("update_fields")
+    if update_fields is not None:
+        kwargs["update_fields"] = set(update_fields) | {"row_version"}
+    return kwargs
+
 # -------------------------------
 # Vendor Model
 # -------------------------------
 class Vendor(models.Model):
-    vendor_name = models.CharField(max_length=500, unique=True)
+    site = models.ForeignKey(Site, on_delete=models.PROTECT, default=default_site_id, related_name='vendors')
+    vendor_name = models.CharField(max_length=500)
     account_number = models.CharField(max_length=100, blank=True, null=True)  # Customer registered number at vendor
     items_supplied = models.TextField(blank=True, null=True)  # e.g., comma-separated list or JSON array
     category = models.CharField(max_length=255, blank=True, null=True)
@@ -41,12 +132,24 @@ class Vendor(models.Model):
     routing_number = models.CharField(max_length=100, blank=True, null=True)
     bank_name = models.CharField(max_length=255, blank=True, null=True)
     account_payee = models.CharField(max_length=255, blank=True, null=True)
+    row_version = models.BigIntegerField(default=0, db_index=True, editable=False)  # Site's "vendor" version of the last write
+
+    class Meta:
+        # Every site keeps its own vendor list; the site leads each index, as every query is scoped by it.
+        constraints = [models.UniqueConstraint(fields=['site', 'vendor_name'], name='unique_vendor_name_per_site')]
+        indexes = [models.Index(fields=['site', 'category'])]
 
     def __str__(self):
         return self.vendor_name
 
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            self.row_version = bump_version(site_resource("vendor", self.site_id))
+            super().save(*args, **_with_version_field(kwargs))
+
     def update_totals(self):
         total = self.invoices.aggregate(total=Sum('amount'))['total'] or 0
+        total += self.archived_invoices.aggregate(total=Sum('amount'))['total'] or 0
         print(f"Updating totals for vendor {self.vendor_name}: {total}")  # Debug output
         self.total_amount_purchased = total
         self.save()
@@ -54,6 +157,8 @@ class Vendor(models.Model):
 # -------------------------------
 # Invoice Model
 # -------------------------------
+CLOSED_STATUSES = ('Paid', 'Closed')  # Finished invoices, moved to the archive once old enough
+
 class Invoice(models.Model):
     STATUS_CHOICES = (
         ('Pending for review', 'Pending for review'),
@@ -62,19 +167,53 @@ class Invoice(models.Model):
         ('Paid', 'Paid'),
         ('Closed', 'Closed'),
     )
+    # Always the vendor's site, copied so that listings filter and order on one table's index.
+    site = models.ForeignKey(Site, on_delete=models.PROTECT, default=default_site_id, related_name='invoices')
     vendor = models.ForeignKey(Vendor, on_delete=models.CASCADE, related_name='invoices')
     invoice_number = models.CharField(max_length=100)
     invoice_date = models.DateField()
     amount = models.DecimalField(max_digits=12, decimal_places=2)
-    invoice_file = models.FileField(upload_to='invoices/', blank=True, null=True)
+    invoice_file = models.FileField(upload_to='invoices/', storage=invoice_storage, blank=True, null=True, db_index=True)
+    # Pages of invoice_file (1-based, inclusive) when it is a statement holding several invoices.
+    page_start = models.PositiveIntegerField(blank=True, null=True)
+    page_end = models.PositiveIntegerField(blank=True, null=True)
     status = models.CharField(max_length=50, choices=STATUS_CHOICES, default='Pending for review')
     created_at = models.DateTimeField(auto_now_add=True)
+    # When the invoice last became Closed or Paid; null otherwise and for invoices closed before this was tracked.
+    closed_at = models.DateTimeField(blank=True, null=True, editable=False)
+    row_version = models.BigIntegerField(default=0, db_index=True, editable=False)  # Site's "invoice" version of the last write
+    # The confirmed layout template that read this invoice's values, until a reviewer has checked them.
+    extracted_by_template = models.ForeignKey(
+        'VendorTemplate', on_delete=models.SET_NULL, blank=True, null=True, editable=False, related_name='+'
+    )
 
     class Meta:
         unique_together = (('vendor', 'invoice_number'),)
+        # One index per listing filter and ordering (see api/filters.py). Listings are
+        # scoped to a site, so the site leads; a vendor already belongs to one site.
+        indexes = [
+            models.Index(fields=['vendor', 'invoice_date']),
+            models.Index(fields=['site', 'status', 'invoice_date']),
+            models.Index(fields=['site', 'status', 'created_at']),
+            models.Index(fields=['site', 'invoice_date']),
+            models.Index(fields=['site', 'amount']),
+            models.Index(fields=['site', 'created_at']),
+        ]
 
     def __str__(self):
         return f"Invoice {self.invoice_number} ({self.vendor.vendor_name})"
+
+    def save(self, *args, **kwargs):
+        closed = self.status in CLOSED_STATUSES
+        if closed != bool(self.closed_at):
+            self.closed_at = timezone.now() if closed else None
+            if kwargs.get("update_fields") is not None:
+                kwargs["update_fields"] = set(kwargs["update_fields"]) | {"closed_at"}
+        if self.vendor_id:
+            self.site_id = self.vendor.site_id
+        with transaction.atomic():
+            self.row_version = bump_version(site_resource("invoice", self.site_id))
+            super().save(*args, **_with_version_field(kwargs))
     
 @receiver(post_save, sender=Invoice)
 def update_vendor_total_on_save(sender, instance, **kwargs):
@@ -87,3 +226,162 @@ def update_vendor_total_on_delete(sender, instance, **kwargs):
     # When an invoice is deleted, update its vendor totals.
     if instance.vendor:
         instance.vendor.update_totals()
+
+@receiver(post_delete, sender=Invoice)
+@receiver(post_delete, sender=Vendor)
+def record_deletion(sender, instance, **kwargs):
+    # Runs inside the delete's transaction, like the save-side bump.
+    resource = site_resource(sender.__name__.lower(), instance.site_id)
+    DeletedRecord.objects.create(resource=resource, object_id=instance.pk, version=bump_version(resource))
+
+# -------------------------------
+# Invoice Archive Models
+# -------------------------------
+class ArchivedFile(models.Model):
+    """An invoice file packed into a compressed monthly bundle (see api/archive.py), one row per content."""
+    sha256 = models.CharField(max_length=64, primary_key=True)
+    name = models.CharField(max_length=255)  # Its name in the hot store, for the extension and a restore
+    bundle = models.CharField(max_length=32)  # e.g. "2023-04.bundle" under ARCHIVE_ROOT
+    offset = models.BigIntegerField()  # Start of the compressed member in the bundle
+    length = models.BigIntegerField()  # Compressed bytes
+    size = models.BigIntegerField()  # Original bytes
+    codec = models.CharField(max_length=8)  # "zstd" or "zlib"
+
+    def __str__(self):
+        return f"{self.name} in {self.bundle}"
+
+class ArchivedInvoice(models.Model):
+    """A Closed or Paid invoice moved out of the hot Invoice table; it keeps its id and is read-only."""
+    id = models.BigIntegerField(primary_key=True)
+    site = models.ForeignKey(Site, on_delete=models.PROTECT, default=default_site_id, related_name='archived_invoices')
+    # PROTECT: deleting a vendor must not silently take its payment history with it.
+    vendor = models.ForeignKey(Vendor, on_delete=models.PROTECT, related_name='archived_invoices')
+    invoice_number = models.CharField(max_length=100)
+    invoice_date = models.DateField()
+    amount = models.DecimalField(max_digits=12, decimal_places=2)
+    status = models.CharField(max_length=50, choices=Invoice.STATUS_CHOICES)
+    archived_file = models.ForeignKey(ArchivedFile, on_delete=models.PROTECT, blank=True, null=True, related_name='invoices')
+    page_start = models.PositiveIntegerField(blank=True, null=True)
+    page_end = models.PositiveIntegerField(blank=True, null=True)
+    created_at = models.DateTimeField()
+    closed_at = models.DateTimeField(blank=True, null=True)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['vendor', 'invoice_date']),
+            models.Index(fields=['vendor', 'invoice_number']),  # Duplicate-number checks at intake
+            models.Index(fields=['site', 'invoice_date']),
+            models.Index(fields=['site', 'created_at']),
+        ]
+
+    def __str__(self):
+        return f"Archived invoice {self.invoice_number} ({self.vendor_id})"
+
+# -------------------------------
+# Chunked Upload Model
+# -------------------------------
+class UploadSession(models.Model):
+    """A resumable upload in progress; its bytes live in a .part file (see api/chunked_uploads.py)."""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='upload_sessions')
+    filename = models.CharField(max_length=255)
+    size = models.BigIntegerField()  # Declared by the client at init
+    received = models.BigIntegerField(default=0)  # Bytes written so far: the offset of the next chunk
+    sha256 = models.CharField(max_length=64, blank=True)  # Expected digest of the whole file, when given
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    def __str__(self):
+        return f"Upload {self.id} of {self.filename} ({self.received}/{self.size})"
+
+# -------------------------------
+# Vendor Layout Template Model
+# -------------------------------
+class VendorTemplate(models.Model):
+    vendor = models.OneToOneField(Vendor, on_delete=models.CASCADE, related_name='template')
+    # The vendor's site, copied so uploads only match their own site's templates from one index.
+    site = models.ForeignKey(Site, on_delete=models.PROTECT, default=default_site_id, related_name='vendor_templates')
+    fingerprint = models.CharField(max_length=16)  # dHash of the first page header, in hex
+    field_boxes = models.JSONField(default=dict)  # field -> {"page", "box", "anchor"}
+    sample_values = models.JSONField(default=dict)  # Values read when the layout was learned
+    source_invoice = models.ForeignKey(Invoice, on_delete=models.SET_NULL, blank=True, null=True, related_name='+')
+    confirmed = models.BooleanField(default=False)
+    confidence = models.FloatField(default=1.0)
+    uses = models.PositiveIntegerField(default=0)
+    failures = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['site', 'confirmed'])]
+
+    def __str__(self):
+        state = "confirmed" if self.confirmed else "candidate"
+        return f"Template for {self.vendor.vendor_name} ({state}, {self.confidence:.2f})"
+
+class TemplateBand(models.Model):
+    """
+    One band of a confirmed template's header fingerprint. A header within
+    matching distance of the template shares at least one band with it
+    (see api/vendor_templates.py), so matching looks up bands, not templates.
+    """
+    bucket = models.IntegerField()  # (band number << 16) | band bits
+    template = models.ForeignKey(VendorTemplate, on_delete=models.CASCADE, related_name='bands')
+    site = models.ForeignKey(Site, on_delete=models.PROTECT, related_name='+')
+
+    class Meta:
+        indexes = [models.Index(fields=['site', 'bucket'])]
+
+# -------------------------------
+# Invoice Text Search Models
+# -------------------------------
+class InvoiceText(models.Model):
+    invoice = models.OneToOneField(Invoice, on_delete=models.CASCADE, primary_key=True, related_name='ocr_text')
+    text = models.TextField()  # FULLTEXT-indexed on MySQL
+    complete = models.BooleanField(default=False)  # False when only zones or template boxes were OCR'd
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Text of invoice {self.invoice_id}"
+
+class SearchTerm(models.Model):
+    """Posting of the local inverted index, used on backends without FULLTEXT."""
+    term = models.CharField(max_length=64)
+    invoice = models.ForeignKey(Invoice, on_delete=models.CASCADE, related_name='search_terms')
+    weight = models.FloatField()  # 1 + log(term frequency in the invoice)
+
+    class Meta:
+        unique_together = (('term', 'invoice'),)
+
+class SearchTermStat(models.Model):
+    term = models.CharField(max_length=64, primary_key=True)
+    documents = models.PositiveIntegerField(default=0)  # Invoices whose text contains the term
+
+# -------------------------------
+# Near-Duplicate Detection Models
+# -------------------------------
+class InvoiceSketch(models.Model):
+    invoice = models.OneToOneField(Invoice, on_delete=models.CASCADE, primary_key=True, related_name='sketch')
+    signature = models.BinaryField()  # MinHash of the OCR text's word shingles, packed 32-bit values
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Sketch of invoice {self.invoice_id}"
+
+class SketchBucket(models.Model):
+    """LSH band of an invoice's sketch; invoices sharing a bucket are near-duplicate candidates."""
+    bucket = models.BigIntegerField(db_index=True)  # Hash of (band number, band values)
+    invoice = models.ForeignKey(Invoice, on_delete=models.CASCADE, related_name='sketch_buckets')
+
+class DuplicateFlag(models.Model):
+    invoice = models.ForeignKey(Invoice, on_delete=models.CASCADE, related_name='duplicate_flags')
+    duplicate_of = models.ForeignKey(Invoice, on_delete=models.CASCADE, related_name='+')
+    similarity = models.FloatField()  # Estimated Jaccard similarity of the two texts
+    dismissed = models.BooleanField(default=False)  # Cleared by a reviewer
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = (('invoice', 'duplicate_of'),)
+
+    def __str__(self):
+        return f"Invoice {self.invoice_id} may duplicate {self.duplicate_of_id} ({self.similarity:.2f})"
@@ -0,0 +1,302 @@
+"""
+Extraction daemon and its client.
+
+`manage.py run_ocr_daemon` owns the OCR/NER stack: a supervisor listens on
+the Unix socket OCR_DAEMON_SOCKET and hands each job to one of a fixed set of
+spawned worker processes, which load hybrid_invoice_extractor once and then
+serve jobs until they have run OCR_WORKER_MAX_JOBS of them or their RSS
+exceeds OCR_WORKER_MAX_RSS_MB, when the supervisor replaces them. A worker
+stuck past OCR_JOB_TIMEOUT is killed and replaced too.
+
+Jobs carry a file path on the shared disk, never the file's bytes. The daemon
+usually runs as its own user in the web processes' group: the socket is
+group-writable, the client makes each file it sends group-readable, and the
+upload directories must be group-searchable. Messages in both directions are
+JSON preceded by a 4-byte big-endian length:
+
+    {"op": "extract", "path": ..., "preview_key": ..., "site_id": ...} -> {"fields": {...}} or {"error": ...}
+    {"op": "stats"} -> supervisor counters and the workers' zone statistics
+
+This module is imported by web processes for the client; everything that
+loads the OCR stack is imported inside worker_main().
+"""
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import socket
+import stat
+import struct
+import threading
+import time
+
+import django
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+logger = logging.getLogger(__name__)
+
+HEADER = struct.Struct(">I")
+MAX_MESSAGE_BYTES = 16 * 1024 * 1024
+STATS_TIMEOUT = 5
+WORKER_START_TIMEOUT = 300  # Loading the NER model dominates
+RESTART_DELAY = 5
+
+class OCRDaemonUnavailable(Exception):
+    """The daemon could not be reached or did not answer in time."""
+
+# -------------------------------
+# Protocol
+# -------------------------------
+def send_message(sock, message):
+    data = json.dumps(message, cls=DjangoJSONEncoder).encode()
+    sock.sendall(HEADER.pack(len(data)) + data)
+
+def _recv_exact(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(min(size, 65536))
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+def recv_message(sock):
+    """Next message from sock, or None once the peer has closed the connection."""
+    header = _recv_exact(sock, HEADER.size)
+    if header is None:
+        return None
+    (size,) = HEADER.unpack(header)
+    if size > MAX_MESSAGE_BYTES:
+        raise ValueError(f"Message of {size} bytes is too large")
+    data = _recv_exact(sock, size)
+    if data is None:
+        return None
+    return json.loads(data)
+
+# -------------------------------
+# Client
+# -------------------------------
+def call(message, timeout=None):
+    """Send one request to the daemon and return its reply."""
+    timeout = timeout or settings.OCR_DAEMON_TIMEOUT
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(timeout)
+            sock.connect(settings.OCR_DAEMON_SOCKET)
+            send_message(sock, message)
+            reply = recv_message(sock)
+    except (OSError, ValueError) as e:
+        raise OCRDaemonUnavailable(f"Extraction daemon at {settings.OCR_DAEMON_SOCKET}: {e}")
+    if reply is None:
+        raise OCRDaemonUnavailable("Extraction daemon closed the connection")
+    return reply
+
+def share_with_daemon(path):
+    """
+    Make a file the daemon is to read group-readable. Upload temp files are
+    created 0600 by the web process's user, and the daemon runs as another
+    user in its group.
+    """
+    mode = stat.S_IMODE(os.stat(path).st_mode)
+    if not mode & stat.S_IRGRP:
+        os.chmod(path, mode | stat.S_IRGRP)
+
+def extract_file(path, preview_key=None, site_id=None):
+    """Extract fields from the file at path in the daemon. Raises ValueError when extraction fails."""
+    share_with_daemon(path)
+    reply = call({"op": "extract", "path": os.path.abspath(path), "preview_key": preview_key, "site_id": site_id})
+    if "error" in reply:
+        raise ValueError(reply["error"])
+    return reply["fields"]
+
+def daemon_stats():
+    return call({"op": "stats"}, timeout=STATS_TIMEOUT)
+
+# -------------------------------
+# Worker processes
+# -------------------------------
+def current_rss_mb():
+    """Resident set size of this process in MB (peak RSS where /proc is unavailable)."""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def worker_main(conn, max_jobs, max_rss_mb):
+    """Serve jobs from the supervisor's pipe until told to stop or due for recycling."""
+    django.setup()
+    # Loading the stack here, before the first job, keeps model start-up out of job latency.
+    from .hybrid_invoice_extractor import get_zone_stats
+    from .intake import run_extraction
+    from .reextraction import StoredFile
+
+    conn.send({"ready": True})
+    jobs = 0
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            return
+        try:
+            with StoredFile(open(job["path"], "rb"), name=job["path"]) as f:
+                reply = {"fields": run_extraction(f, job.get("preview_key"), job.get("site_id"))}
+        except Exception as e:
+            reply = {"error": str(e)}
+        jobs += 1
+        rss = current_rss_mb()
+        reply["zone_stats"] = get_zone_stats()
+        reply["retire"] = jobs >= max_jobs or rss > max_rss_mb
+        if reply["retire"]:
+            logger.info(f"OCR worker {os.getpid()} retiring after {jobs} jobs at {rss:.0f} MB")
+        conn.send(reply)
+        if reply["retire"]:
+            return
+
+def _merge_counts(total, counts):
+    for key, value in counts.items():
+        if isinstance(value, dict):
+            _merge_counts(total.setdefault(key, {}), value)
+        else:
+            total[key] = total.get(key, 0) + value
+    return total
+
+# -------------------------------
+# Supervisor
+# -------------------------------
+class OCRDaemon:
+    def __init__(self, path, workers, max_jobs, max_rss_mb, job_timeout):
+        self.path = path
+        self.workers = workers
+        self.max_jobs = max_jobs
+        self.max_rss_mb = max_rss_mb
+        self.job_timeout = job_timeout
+        self.context = multiprocessing.get_context("spawn")
+        self.idle = queue.Queue()
+        self.lock = threading.Lock()
+        self.counters = {"jobs": 0, "failed": 0, "timeouts": 0, "recycled": 0, "crashed": 0}
+        self.zone_stats = {}  # worker pid -> its latest cumulative snapshot
+        self.started = time.time()
+
+    def start_worker(self):
+        parent, child = self.context.Pipe()
+        process = self.context.Process(
+            target=worker_main, args=(child, self.max_jobs, self.max_rss_mb), daemon=True,
+        )
+        process.start()
+        child.close()
+        # The worker joins the idle queue once loaded, so start-up never counts against a job's timeout.
+        threading.Thread(target=self._await_ready, args=(process, parent), daemon=True).start()
+
+    def _await_ready(self, process, conn):
+        try:
+            ready = conn.poll(WORKER_START_TIMEOUT) and conn.recv().get("ready")
+        except (EOFError, OSError):
+            ready = False
+        if ready:
+            self.idle.put((process, conn))
+            return
+        logger.error(f"OCR worker {process.pid} failed to start; retrying in {RESTART_DELAY}s")
+        if process.is_alive():
+            process.kill()
+        process.join()
+        conn.close()
+        time.sleep(RESTART_DELAY)
+        self.start_worker()
+
+    def _replace(self, process, conn, counter):
+        if process.is_alive():
+            process.kill()
+        process.join()
+        conn.close()
+        with self.lock:
+            self.counters[counter] += 1
+        self.start_worker()
+
+    def run_job(self, job):
+        try:
+            process, conn = self.idle.get(timeout=self.job_timeout)
+        except queue.Empty:
+            return {"error": "No extraction worker became free in time"}
+        try:
+            conn.send(job)
+            if not conn.poll(self.job_timeout):
+                logger.warning(f"OCR worker {process.pid} timed out on {job.get('path')}")
+                self._replace(process, conn, "timeouts")
+                return {"error": f"Extraction took longer than {self.job_timeout}s"}
+            reply = conn.recv()
+        except (EOFError, OSError):
+            logger.error(f"OCR worker {process.pid} died on {job.get('path')}")
+            self._replace(process, conn, "crashed")
+            return {"error": "Extraction worker crashed"}
+
+        with self.lock:
+            self.counters["jobs"] += 1
+            if "error" in reply:
+                self.counters["failed"] += 1
+            self.zone_stats[process.pid] = reply.pop("zone_stats", {})
+        if reply.pop("retire", False):
+            self._replace(process, conn, "recycled")
+        else:
+            self.idle.put((process, conn))
+        return reply
+
+    def stats(self):
+        with self.lock:
+            zone_stats = {}
+            for snapshot in self.zone_stats.values():
+                _merge_counts(zone_stats, snapshot)
+            return {
+                **self.counters,
+                "workers": self.workers,
+                "idle_workers": self.idle.qsize(),
+                "uptime": round(time.time() - self.started),
+                "zone_stats": zone_stats,
+            }
+
+    def handle(self, sock):
+        with sock:
+            while True:
+                try:
+                    message = recv_message(sock)
+                except (OSError, ValueError) as e:
+                    logger.warning(f"Dropping OCR client connection: {e}")
+                    return
+                if message is None:
+                    return
+                op = message.get("op")
+                if op == "extract":
+                    reply = self.run_job({
+                        "path": message["path"], "preview_key": message.get("preview_key"), "site_id": message.get("site_id"),
+                    })
+                elif op == "stats":
+                    reply = self.stats()
+                else:
+                    reply = {"error": f"Unknown op {op!r}"}
+                try:
+                    send_message(sock, reply)
+                except OSError:
+                    return
+
+    def serve_forever(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        for _ in range(self.workers):
+            self.start_worker()
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as server:
+            server.bind(self.path)
+            # Web processes connect as other users of the daemon's group.
+            os.chmod(self.path, 0o660)
+            server.listen(64)
+            logger.info(f"OCR daemon listening on {self.path} with {self.workers} workers")
+            try:
+                while True:
+                    sock, _ = server.accept()
+                    threading.Thread(target=self.handle, args=(sock,), daemon=True).start()
+            finally:
+                os.remove(self.path)
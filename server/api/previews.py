@@ -0,0 +1,121 @@
+"""
+First-page preview thumbnails for invoice files.
+
+Previews are small WebP images keyed by the content hash of the invoice file
+and stored under PREVIEW_ROOT/<aa>/<key>-<width>.webp. Uploads save one from
+the page already rasterized for OCR; other files get theirs rendered at a low
+DPI on first request. The cache is bounded in bytes: hits refresh a file's
+mtime, and the least recently used previews are removed once the total goes
+over PREVIEW_CACHE_MAX_BYTES.
+"""
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from PIL import Image
+
+from .file_delivery import file_etag, stat_stored_file
+
+logger = logging.getLogger(__name__)
+
+PREVIEW_WIDTH = 320
+PREVIEW_MAX_HEIGHT = PREVIEW_WIDTH * 2
+PREVIEW_RENDER_DPI = 50  # A letter page at 50 DPI is 425 px wide
+PREVIEW_QUALITY = 60
+TOUCH_INTERVAL = 60 * 60  # Refresh LRU mtimes at most hourly
+EVICTION_TARGET = 0.9  # Evict down to this fraction of the limit
+
+_cache_lock = threading.Lock()
+_cache_bytes = None  # This process's running estimate of the cache size
+
+def preview_key(name, stat):
+    return file_etag(name, stat).strip('"')
+
+def preview_path(key):
+    return os.path.join(str(settings.PREVIEW_ROOT), key[:2], f"{key}-{PREVIEW_WIDTH}.webp")
+
+def make_thumbnail(image):
+    """Scaled-down RGB copy of a page image; the page itself is left untouched for OCR."""
+    scale = min(PREVIEW_WIDTH / image.width, PREVIEW_MAX_HEIGHT / image.height, 1.0)
+    size = (max(1, int(image.width * scale)), max(1, int(image.height * scale)))
+    return image.convert("RGB").resize(size, Image.LANCZOS, reducing_gap=2.0)
+
+def evict_previews():
+    """Remove least recently used previews until the cache is under its limit. Returns the new total."""
+    root = str(settings.PREVIEW_ROOT)
+    entries = []
+    for dirpath, _, filenames in os.walk(root):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+    total = sum(size for _, size, _ in entries)
+    limit = settings.PREVIEW_CACHE_MAX_BYTES
+    if total > limit:
+        entries.sort()
+        for _, size, path in entries:
+            if total <= limit * EVICTION_TARGET:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except FileNotFoundError:
+                continue
+    return total
+
+def _account(size):
+    global _cache_bytes
+    with _cache_lock:
+        if _cache_bytes is None:
+            _cache_bytes = evict_previews()
+        _cache_bytes += size
+        if _cache_bytes > settings.PREVIEW_CACHE_MAX_BYTES:
+            _cache_bytes = evict_previews()
+
+def save_preview(key, image):
+    """Store the preview for key from a rendered first page, unless one exists."""
+    path = preview_path(key)
+    if os.path.exists(path):
+        return path
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), suffix=".part", delete=False) as tmp:
+        make_thumbnail(image).save(tmp, format="WEBP", quality=PREVIEW_QUALITY, method=4)
+    os.replace(tmp.name, path)
+    _account(os.path.getsize(path))
+    return path
+
+def preview_saver(key):
+    """Callback for extract_invoice_data_hybrid(on_first_page=...) that never disturbs extraction."""
+    def save(page):
+        try:
+            save_preview(key, page)
+        except Exception as e:
+            logger.warning(f"Could not save preview {key}: {e}")
+    return save
+
+def get_preview(field_file):
+    """Return (path, key) of the preview for a stored invoice file, rendering it if needed."""
+    source_path, stat = stat_stored_file(field_file)
+    key = preview_key(field_file.name, stat)
+    path = preview_path(key)
+    try:
+        preview_stat = os.stat(path)
+        if time.time() - preview_stat.st_mtime > TOUCH_INTERVAL:
+            os.utime(path)
+        return path, key
+    except FileNotFoundError:
+        pass
+
+    # Only a cache miss needs the rendering helpers and what they pull in.
+    from .hybrid_invoice_extractor import convert_pdf, file_content_type, open_image
+    if file_content_type(field_file) == "application/pdf":
+        image = convert_pdf(source_path, dpi=PREVIEW_RENDER_DPI, first_page=1, last_page=1)[0]
+    else:
+        image = open_image(source_path)
+    return save_preview(key, image), key
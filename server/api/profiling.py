@@ -0,0 +1,259 @@
+"""
+Sampled request profiling.
+
+ProfilingMiddleware records a fraction PROFILING_SAMPLE_RATE of requests,
+plus any carrying an X-Profile header signed by `manage.py profile_report
+--issue-token`. Everything else pays for one random() call and a header
+lookup. A profiled request gets a JSON record of its wall and CPU time and SQL
+count and time, and either:
+
+- a cProfile dump (.prof) when it was handled synchronously (WSGI), where the
+  view runs on the middleware's thread; or
+- folded stack samples when it was handled under ASGI, where the view runs on
+  executor threads. The sampler reads every thread in the process, so the
+  samples are exact only for requests that ran alone (concurrent == 1 in the
+  record); CPU time is then process-wide too.
+
+Records go to PROFILING_DIR, which keeps the newest PROFILING_MAX_RECORDS, and
+are written off the request path. `manage.py profile_report` aggregates them.
+"""
+import contextvars
+import cProfile
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core import signing
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = "X-Profile"
+TOKEN_SALT = "api.profiling"
+MAX_STACK_DEPTH = 64
+
+_active = contextvars.ContextVar("profiled_request", default=None)
+_in_flight = 0
+_in_flight_lock = threading.Lock()
+_writer = None
+_writer_lock = threading.Lock()
+
+def issue_token():
+    """A value for the X-Profile header, valid for PROFILING_TOKEN_MAX_AGE seconds."""
+    return signing.TimestampSigner(salt=TOKEN_SALT).sign(uuid.uuid4().hex)
+
+def valid_token(token):
+    try:
+        signing.TimestampSigner(salt=TOKEN_SALT).unsign(token, max_age=settings.PROFILING_TOKEN_MAX_AGE)
+    except signing.BadSignature:
+        return False
+    return True
+
+def should_profile(request):
+    token = request.headers.get(PROFILE_HEADER)
+    if token:
+        return valid_token(token)
+    return settings.PROFILING_SAMPLE_RATE > 0 and random.random() < settings.PROFILING_SAMPLE_RATE
+
+# -------------------------------
+# SQL timing
+# -------------------------------
+def record_query(execute, sql, params, many, context):
+    record = _active.get()
+    if record is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        # Context variables follow sync_to_async into executor threads, so async views' queries count too.
+        record["sql"].append(time.perf_counter() - start)
+
+@receiver(connection_created)
+def install_query_recorder(sender, connection, **kwargs):
+    connection.execute_wrappers.append(record_query)
+
+# -------------------------------
+# Stack sampling
+# -------------------------------
+def _frame_label(code, project):
+    filename = code.co_filename
+    if filename.startswith(project):
+        filename = os.path.relpath(filename, project)
+    else:
+        filename = os.path.basename(filename)
+    return f"{filename}:{code.co_name}"
+
+class StackSampler:
+    """Folded stacks ("outer;...;inner" -> samples) of threads running project code."""
+    def __init__(self, interval):
+        self.interval = interval
+        self.stacks = Counter()
+        self.peak_in_flight = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+        self._project = os.path.join(str(settings.BASE_DIR), "")
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return self.stacks
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            self.peak_in_flight = max(self.peak_in_flight, _in_flight)
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                stack = []
+                in_project = False
+                while frame is not None and len(stack) < MAX_STACK_DEPTH:
+                    filename = frame.f_code.co_filename
+                    in_project = in_project or (
+                        filename.startswith(self._project) and "site-packages" not in filename and filename != __file__
+                    )
+                    stack.append(_frame_label(frame.f_code, self._project))
+                    frame = frame.f_back
+                # Idle executor and event-loop threads never pass through project code.
+                if in_project:
+                    self.stacks[";".join(reversed(stack))] += 1
+
+# -------------------------------
+# Recording
+# -------------------------------
+def _writer_pool():
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="profile-writer")
+        return _writer
+
+def prune_records(directory, keep):
+    """Delete the oldest records beyond keep (names start with a timestamp, so they sort by age)."""
+    records = sorted(name for name in os.listdir(directory) if name.endswith(".json"))
+    for name in records[:max(0, len(records) - keep)]:
+        record_id = name[:-len(".json")]
+        for suffix in (".json", ".prof"):
+            try:
+                os.remove(os.path.join(directory, record_id + suffix))
+            except FileNotFoundError:
+                pass
+
+def write_record(record, profile=None):
+    directory = settings.PROFILING_DIR
+    try:
+        os.makedirs(directory, exist_ok=True)
+        if profile is not None:
+            profile.dump_stats(os.path.join(directory, f"{record['id']}.prof"))
+        # The .json goes last and by rename, so readers never see a record without its profile.
+        path = os.path.join(directory, f"{record['id']}.json")
+        with open(f"{path}.tmp", "w") as f:
+            json.dump(record, f)
+        os.replace(f"{path}.tmp", path)
+        prune_records(directory, settings.PROFILING_MAX_RECORDS)
+    except OSError as e:
+        logger.warning(f"Could not write profile {record['id']}: {e}")
+
+def new_record(request):
+    return {
+        "id": f"{time.time_ns()}-{os.getpid()}-{uuid.uuid4().hex[:8]}",
+        "at": time.time(),
+        "method": request.method,
+        "path": request.path,
+        "sql": [],
+    }
+
+def finish_record(record, request, response, wall, cpu):
+    match = getattr(request, "resolver_match", None)
+    sql = record.pop("sql")
+    record.update({
+        # The URL pattern, so /invoices/1/ and /invoices/2/ aggregate together.
+        "route": f"/{match.route}" if match and match.route else request.path,
+        "view": match.view_name if match else None,
+        "status": response.status_code,
+        "wall_ms": round(wall * 1000, 3),
+        "cpu_ms": round(cpu * 1000, 3),
+        "sql_count": len(sql),
+        "sql_ms": round(sum(sql) * 1000, 3),
+    })
+    return record
+
+class ProfilingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not should_profile(request):
+            return self.get_response(request)
+
+        record = new_record(request)
+        token = _active.set(record)
+        profile = cProfile.Profile()
+        wall_start, cpu_start = time.perf_counter(), time.thread_time()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiler is already active on this thread; keep the timings only.
+            profile = None
+        try:
+            response = self.get_response(request)
+        finally:
+            if profile:
+                profile.disable()
+            _active.reset(token)
+        finish_record(record, request, response, time.perf_counter() - wall_start, time.thread_time() - cpu_start)
+        record.update({"mode": "cprofile" if profile else "timing", "cpu_scope": "thread", "concurrent": 1})
+        _writer_pool().submit(write_record, record, profile)
+        return response
+
+    async def __acall__(self, request):
+        global _in_flight
+        with _in_flight_lock:
+            _in_flight += 1
+        try:
+            if not should_profile(request):
+                return await self.get_response(request)
+
+            record = new_record(request)
+            token = _active.set(record)
+            sampler = StackSampler(settings.PROFILING_STACK_INTERVAL)
+            wall_start, cpu_start = time.perf_counter(), time.process_time()
+            sampler.start()
+            try:
+                response = await self.get_response(request)
+            finally:
+                stacks = sampler.stop()
+                _active.reset(token)
+            finish_record(record, request, response, time.perf_counter() - wall_start, time.process_time() - cpu_start)
+            record.update({
+                "mode": "samples",
+                "cpu_scope": "process",
+                "concurrent": max(1, sampler.peak_in_flight),
+                "stacks": dict(stacks),
+            })
+            _writer_pool().submit(write_record, record)
+            return response
+        finally:
+            with _in_flight_lock:
+                _in_flight -= 1
@@ -0,0 +1,156 @@
+"""
+Re-running extraction over stored invoices.
+
+extract_stored_file() runs in worker processes. It writes no invoice rows,
+but the template path reads vendor templates and records each template's
+outcome (see record_template_outcome()) from the worker. diff_fields()
+compares its output with the stored invoice, ignoring the extractor's
+fallbacks (today's date, 0.00, a generated INV- number) so a failed read
+never overwrites a good value. apply_changes() writes one batch in a single
+transaction with one change-counter bump per site, then refreshes the totals
+of the vendors it touched. Rows a reviewer edited or moved on since they
+were diffed are left alone.
+"""
+import datetime
+from decimal import Decimal, InvalidOperation
+
+import django
+from django.core.files import File
+from django.db import transaction
+from django.db.models import Q
+
+from .extraction_fields import is_generated_number
+from .hybrid_invoice_extractor import extract_invoice_data_hybrid, extract_invoice_fields_universal, extract_text
+from .models import Invoice, Vendor, bump_version, site_resource
+from .statements import extract_segment
+
+UPDATED_FIELDS = ("invoice_number", "invoice_date", "amount")
+EDITABLE_STATUS = "Pending for review"
+
+class StoredFile(File):
+    """A stored invoice file handed to the extractor by path."""
+
+    def temporary_file_path(self):
+        return self.file.name
+
+def init_worker():
+    """Process pool initializer: spawned workers start without Django set up."""
+    django.setup()
+
+def extract_stored_file(task):
+    """
+    Worker entry point: task is (invoice_id, path, full_page, pages, site_id),
+    pages being the (first, last) range of an invoice split from a statement,
+    or None; only site_id's layout templates are tried. Returns (invoice_id,
+    fields, error); fields keep only the compared values.
+    """
+    invoice_id, path, full_page, pages, site_id = task
+    try:
+        with StoredFile(open(path, "rb"), name=path) as f:
+            if pages:
+                fields = extract_segment(path, *pages)["fields"]
+            elif full_page:
+                fields = extract_invoice_fields_universal(extract_text(f))
+            else:
+                fields = extract_invoice_data_hybrid(f, site_id=site_id)
+    except Exception as e:
+        return invoice_id, None, str(e)
+    return invoice_id, {key: fields.get(key) for key in ("vendor_name", *UPDATED_FIELDS)}, None
+
+def _clean(field, value, today):
+    """Extracted value in the model's type, or None when it is missing or an extractor fallback."""
+    if value in (None, ""):
+        return None
+    value = str(value).strip()
+    if field == "invoice_number":
+        return None if is_generated_number(value) else value[:100]
+    if field == "invoice_date":
+        try:
+            date = datetime.date.fromisoformat(value[:10])
+        except ValueError:
+            return None
+        return None if date == today else date
+    if field == "amount":
+        try:
+            amount = Decimal(value.replace(",", "")).quantize(Decimal("0.01"))
+        except InvalidOperation:
+            return None
+        return amount or None
+    return value
+
+def diff_fields(invoice, fields, today=None):
+    """Return {field: (stored, extracted)} for the fields whose trustworthy new value differs."""
+    today = today or datetime.date.today()
+    changes = {}
+    for field in UPDATED_FIELDS:
+        new = _clean(field, fields.get(field), today)
+        old = getattr(invoice, field)
+        if new is None:
+            continue
+        if field == "invoice_number" and new.lower() == (old or "").lower():
+            continue
+        if new != old:
+            changes[field] = (old, new)
+    return changes
+
+def is_stale(invoice, changes, include_reviewed=False):
+    """Whether the invoice changed since it was diffed: a field no longer holds its old value, or it left review."""
+    if not include_reviewed and invoice.status != EDITABLE_STATUS:
+        return True
+    return any(getattr(invoice, field) != old for field, (old, _) in changes.items())
+
+def apply_changes(changes_by_id, include_reviewed=False):
+    """
+    Write {invoice_id: {field: (old, new)}} in one transaction. Returns
+    (updated count, conflicts, stale): conflicts are rows whose new invoice
+    number the vendor already has, stale ones rows edited or reviewed since
+    they were diffed (see is_stale()). Both are skipped.
+    """
+    if not changes_by_id:
+        return 0, [], []
+    with transaction.atomic():
+        invoices = Invoice.objects.select_for_update().in_bulk(list(changes_by_id))
+        stale = [pk for pk, invoice in invoices.items() if is_stale(invoice, changes_by_id[pk], include_reviewed)]
+        for pk in stale:
+            del invoices[pk]
+        # (vendor, number) pairs that are taken, including ones this batch assigns.
+        wanted = {
+            (invoices[pk].vendor_id, changes["invoice_number"][1].lower())
+            for pk, changes in changes_by_id.items()
+            if pk in invoices and "invoice_number" in changes
+        }
+        taken = set()
+        if wanted:
+            condition = Q()
+            for vendor_id, number in wanted:
+                condition |= Q(vendor_id=vendor_id, invoice_number__iexact=number)
+            taken = {
+                (vendor_id, number.lower())
+                for vendor_id, number in Invoice.objects.filter(condition).values_list("vendor_id", "invoice_number")
+            }
+        updated, conflicts, fields = [], [], set()
+        for pk, changes in changes_by_id.items():
+            invoice = invoices.get(pk)
+            if invoice is None:
+                continue
+            if "invoice_number" in changes:
+                key = (invoice.vendor_id, changes["invoice_number"][1].lower())
+                if key in taken:
+                    conflicts.append(pk)
+                    continue
+                taken.add(key)
+            for field, (_, new) in changes.items():
+                setattr(invoice, field, new)
+                fields.add(field)
+            updated.append(invoice)
+        if not updated:
+            return 0, conflicts, stale
+        # bulk_update skips save(), so each site's invoices in the batch share one version bump.
+        versions = {site_id: bump_version(site_resource("invoice", site_id)) for site_id in sorted({invoice.site_id for invoice in updated})}
+        for invoice in updated:
+            invoice.row_version = versions[invoice.site_id]
+        Invoice.objects.bulk_update(updated, [*sorted(fields), "row_version"])
+        if "amount" in fields:
+            for vendor in Vendor.objects.filter(pk__in={invoice.vendor_id for invoice in updated}):
+                vendor.update_totals()
+    return len(updated), conflicts, stale
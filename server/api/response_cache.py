@@ -0,0 +1,80 @@
+"""
+Server-side cache of serialized vendor payloads and listing pages.
+
+Entries live in the "api" cache alias (any Django backend). Vendor payloads
+are stored per vendor together with the row_version they were built from, so
+a reader never uses a payload older than the row. Vendor save signals write
+the fresh payload through and delete signals drop it. Listing pages are keyed
+by their ETag, which already encodes the site's invoice/vendor change counters
+bumped in the writing transaction, so every write moves that site's readers to
+new keys and old pages simply expire; other sites' pages stay valid.
+"""
+import copy
+import threading
+
+from django.core.cache import caches
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Vendor
+
+CACHE_ALIAS = "api"
+
+_stats_lock = threading.Lock()
+CACHE_STATS = {
+    kind: {"hits": 0, "misses": 0, "writes": 0, "invalidations": 0}
+    for kind in ("vendor", "page")
+}
+
+def api_cache():
+    return caches[CACHE_ALIAS]
+
+def _count(kind, outcome):
+    with _stats_lock:
+        CACHE_STATS[kind][outcome] += 1
+
+def get_cache_stats():
+    """Return a snapshot of this process's hit/miss counters."""
+    with _stats_lock:
+        return copy.deepcopy(CACHE_STATS)
+
+def vendor_key(pk):
+    return f"vendor:{pk}"
+
+def store_vendor_payload(vendor, payload):
+    api_cache().set(vendor_key(vendor.pk), (vendor.row_version, payload))
+    _count("vendor", "writes")
+
+def get_vendor_payload(vendor, serialize):
+    """Return the cached payload for vendor, building it with serialize(vendor) on a miss."""
+    entry = api_cache().get(vendor_key(vendor.pk))
+    if entry is not None and entry[0] == vendor.row_version:
+        _count("vendor", "hits")
+        return entry[1]
+    _count("vendor", "misses")
+    payload = serialize(vendor)
+    store_vendor_payload(vendor, payload)
+    return payload
+
+def page_key(etag):
+    return f"page:{etag}"
+
+def get_page(etag):
+    data = api_cache().get(page_key(etag))
+    _count("page", "misses" if data is None else "hits")
+    return data
+
+def store_page(etag, data):
+    api_cache().set(page_key(etag), data)
+    _count("page", "writes")
+
+@receiver(post_save, sender=Vendor)
+def write_through_vendor(sender, instance, **kwargs):
+    # Imported here: the serializers module itself reads this cache.
+    from .serializers import VendorSerializer
+    store_vendor_payload(instance, VendorSerializer().uncached_representation(instance))
+
+@receiver(post_delete, sender=Vendor)
+def invalidate_vendor(sender, instance, **kwargs):
+    api_cache().delete(vendor_key(instance.pk))
+    _count("vendor", "invalidations")
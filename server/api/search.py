@@ -0,0 +1,161 @@
+"""
+Full-text search over the OCR text stored per invoice.
+
+On MySQL the text column carries a FULLTEXT index and queries use MATCH ...
+AGAINST in boolean mode. Other backends keep a small inverted index instead:
+one SearchTerm posting per (term, invoice) weighted by 1 + log(tf), plus the
+number of invoices per term in SearchTermStat. A query requires every term;
+candidates come from the postings of its rarest term, and ranking sums
+weight * idf over the query terms in the database.
+"""
+import datetime
+import math
+import re
+from collections import Counter
+
+from django.db import connection, transaction
+from django.db.models import Case, Count, F, FloatField, Sum, Value, When
+from django.db.models.expressions import RawSQL
+from django.db.models.signals import pre_delete
+from django.dispatch import receiver
+from rest_framework.exceptions import ValidationError
+
+from .models import Invoice, InvoiceText, SearchTerm, SearchTermStat
+from .response_cache import api_cache
+
+MAX_TERM_LENGTH = 64
+MAX_QUERY_TERMS = 8
+SNIPPET_CHARS = 160
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+DOCUMENT_COUNT_TTL = 10 * 60  # idf only needs a rough invoice count
+FULLTEXT_MIN_TOKEN_SIZE = 3  # innodb_ft_min_token_size; shorter words are not indexed
+TERM_RE = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset(
+    "a an and are as at be by for from in is it of on or the to with".split()
+)
+
+def tokenize(text):
+    return [
+        term for term in TERM_RE.findall((text or "").lower())
+        if len(term) > 1 and term not in STOPWORDS
+    ]
+
+def query_terms(query):
+    """Distinct terms of a search query, in order, capped at MAX_QUERY_TERMS."""
+    terms = [term[:MAX_TERM_LENGTH] for term in dict.fromkeys(tokenize(query))]
+    return terms[:MAX_QUERY_TERMS]
+
+def uses_fulltext():
+    return connection.vendor == "mysql"
+
+# -------------------------------
+# Indexing
+# -------------------------------
+def _adjust_stats(terms, delta):
+    # Sorted so concurrent indexers lock the stat rows in the same order.
+    for term in sorted(terms):
+        updated = SearchTermStat.objects.filter(term=term).update(documents=F('documents') + delta)
+        if not updated and delta > 0:
+            SearchTermStat.objects.get_or_create(term=term)
+            SearchTermStat.objects.filter(term=term).update(documents=F('documents') + delta)
+
+def index_invoice_text(invoice, text, complete):
+    """Store an invoice's OCR text and, without FULLTEXT, refresh its postings."""
+    with transaction.atomic():
+        InvoiceText.objects.update_or_create(invoice=invoice, defaults={"text": text, "complete": complete})
+        if uses_fulltext():
+            return
+        counts = Counter(term[:MAX_TERM_LENGTH] for term in tokenize(text))
+        old_terms = set(SearchTerm.objects.filter(invoice=invoice).values_list('term', flat=True))
+        SearchTerm.objects.filter(invoice=invoice).delete()
+        SearchTerm.objects.bulk_create([
+            SearchTerm(term=term, invoice=invoice, weight=1 + math.log(count))
+            for term, count in counts.items()
+        ])
+        _adjust_stats(old_terms - counts.keys(), -1)
+        _adjust_stats(counts.keys() - old_terms, 1)
+
+@receiver(pre_delete, sender=Invoice)
+def forget_invoice_terms(sender, instance, **kwargs):
+    # The postings go with the invoice by cascade; their counts have to follow.
+    if not uses_fulltext():
+        _adjust_stats(SearchTerm.objects.filter(invoice=instance).values_list('term', flat=True), -1)
+
+# -------------------------------
+# Searching
+# -------------------------------
+def _search_fulltext(terms, filters, limit):
+    terms = [term for term in terms if len(term) >= FULLTEXT_MIN_TOKEN_SIZE]
+    if not terms:
+        return []
+    # Tokens carry no boolean operators, so "+term" requires each one.
+    against = " ".join(f"+{term}" for term in terms)
+    table = InvoiceText._meta.db_table
+    score = RawSQL(f"MATCH({table}.text) AGAINST (%s IN BOOLEAN MODE)", (against,))
+    rows = (
+        InvoiceText.objects.filter(**{f"invoice__{key}": value for key, value in filters.items()})
+        .annotate(score=score)
+        .filter(score__gt=0)
+        .order_by('-score')
+        .values_list('invoice_id', 'score')[:limit]
+    )
+    return list(rows)
+
+def _search_postings(terms, filters, limit):
+    stats = dict(SearchTermStat.objects.filter(term__in=terms).values_list('term', 'documents'))
+    if any(not stats.get(term) for term in terms):
+        return []
+    total = max(api_cache().get_or_set("search:documents", InvoiceText.objects.count, DOCUMENT_COUNT_TTL), 1)
+    idf = {term: math.log(1 + total / stats[term]) for term in terms}
+    rarest = min(terms, key=stats.get)
+    candidates = SearchTerm.objects.filter(
+        term=rarest, **{f"invoice__{key}": value for key, value in filters.items()}
+    ).values('invoice_id')
+    score = Sum(Case(
+        *[When(term=term, then=F('weight') * Value(idf[term])) for term in terms],
+        output_field=FloatField(),
+    ))
+    rows = (
+        SearchTerm.objects.filter(term__in=terms, invoice_id__in=candidates)
+        .values('invoice_id')
+        .annotate(score=score, matched=Count('id'))
+        .filter(matched=len(terms))
+        .order_by('-score', '-invoice_id')
+        .values_list('invoice_id', 'score')[:limit]
+    )
+    return list(rows)
+
+def parse_search_params(params):
+    """Return (filters, limit) from ?vendor=&status=&date_from=&date_to=&limit= query parameters."""
+    filters = {}
+    try:
+        if params.get("vendor"):
+            filters["vendor_id"] = int(params["vendor"])
+        if params.get("date_from"):
+            filters["invoice_date__gte"] = datetime.date.fromisoformat(params["date_from"])
+        if params.get("date_to"):
+            filters["invoice_date__lte"] = datetime.date.fromisoformat(params["date_to"])
+        limit = min(max(int(params.get("limit", DEFAULT_LIMIT)), 1), MAX_LIMIT)
+    except ValueError:
+        raise ValidationError("vendor and limit must be integers; dates must be YYYY-MM-DD.")
+    if params.get("status"):
+        filters["status"] = params["status"]
+    return filters, limit
+
+def search_invoice_ids(query, filters=None, limit=20):
+    """Return [(invoice_id, score)] best first. filters are Invoice lookups, e.g. {"status": "Paid"}."""
+    terms = query_terms(query)
+    if not terms:
+        return []
+    search = _search_fulltext if uses_fulltext() else _search_postings
+    return search(terms, filters or {}, limit)
+
+def snippet(text, query):
+    """The stretch of text around the first query term, on one line."""
+    flat = " ".join((text or "").split())
+    lowered = flat.lower()
+    positions = [lowered.find(term) for term in query_terms(query)]
+    positions = [position for position in positions if position >= 0]
+    start = max(0, min(positions) - SNIPPET_CHARS // 4) if positions else 0
+    return flat[start:start + SNIPPET_CHARS]
@@ -1,7 +1,11 @@
 # api/serializers.py
 from rest_framework import serializers
+from rest_framework.reverse import reverse
 from django.contrib.auth import get_user_model
-from .models import Vendor, Invoice, CustomUser
+from .models import Vendor, Invoice, ArchivedInvoice, CustomUser, normalize_login_email
+from .file_delivery import file_version
+from .response_cache import get_vendor_payload
+from .tenancy import scope_to_user
 
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
@@ -12,15 +16,65 @@ class CustomUserSerializer(serializers.ModelSerializer):
     class Meta:
         model = CustomUser
         fields = '__all__'
+        # Users are created in, and stay in, the site of whoever manages them.
+        read_only_fields = ['site']
+
+    def validate_email(self, value):
+        # Login emails are unique regardless of case (email_normalized), which DRF does not check.
+        email = normalize_login_email(value)
+        if self.instance is not None and normalize_login_email(self.instance.email) == email:
+            # An unchanged address is not claimed again on save.
+            return value
+        if email and CustomUser.objects.filter(email_normalized=email).exists():
+            raise serializers.ValidationError("user with this email already exists.")
+        return value
 
 class VendorSerializer(serializers.ModelSerializer):
     class Meta:
         model = Vendor
         fields = '__all__'
+        read_only_fields = ['site']
+
+    def validate_vendor_name(self, value):
+        # Names are unique per site (Meta.constraints), which the read-only site keeps DRF from checking.
+        request = self.context.get('request')
+        taken = Vendor.objects.filter(site_id=request.user.site_id, vendor_name=value)
+        if self.instance is not None:
+            taken = taken.exclude(pk=self.instance.pk)
+        if taken.exists():
+            raise serializers.ValidationError("vendor with this vendor name already exists.")
+        return value
+
+    def to_representation(self, instance):
+        # Vendor payloads are reused across lists and nested invoices until the row changes.
+        return get_vendor_payload(instance, self.uncached_representation)
+
+    def uncached_representation(self, instance):
+        return super().to_representation(instance)
+
+def versioned_file_url(view_name, field_file, request):
+    """URL of a per-invoice file endpoint, pinned to the file's content when it is known."""
+    url = reverse(view_name, kwargs={'pk': field_file.instance.pk}, request=request)
+    version = file_version(field_file.name)
+    return f"{url}?v={version}" if version else url
+
+class InvoiceFileField(serializers.FileField):
+    """Writable file field whose URL points at the authenticated file endpoint."""
+    def to_representation(self, value):
+        if not value:
+            return None
+        return versioned_file_url('invoice-file', value, self.context.get('request'))
+
+class SiteVendorField(serializers.PrimaryKeyRelatedField):
+    """Vendor id field that only accepts vendors of the requesting user's site."""
+    def get_queryset(self):
+        return scope_to_user(super().get_queryset(), self.context['request'].user)
 
 class InvoiceSerializer(serializers.ModelSerializer):
     vendor = VendorSerializer(read_only=True)
-    vendor_id = serializers.PrimaryKeyRelatedField(
+    invoice_file = InvoiceFileField(required=False, allow_null=True)
+    preview_url = serializers.SerializerMethodField()
+    vendor_id = SiteVendorField(
         queryset=Vendor.objects.all(),
         source='vendor',
         write_only=True,
@@ -30,4 +84,31 @@ class InvoiceSerializer(serializers.ModelSerializer):
     
     class Meta:
         model = Invoice
-        fields = ['id', 'vendor', 'vendor_id', 'invoice_number', 'invoice_date', 'amount', 'invoice_file', 'status', 'created_at']
+        fields = ['id', 'vendor', 'vendor_id', 'invoice_number', 'invoice_date', 'amount', 'invoice_file', 'page_start', 'page_end', 'preview_url', 'status', 'created_at']
+        read_only_fields = ['page_start', 'page_end']
+
+    def get_preview_url(self, obj):
+        if not obj.invoice_file:
+            return None
+        return versioned_file_url('invoice-preview', obj.invoice_file, self.context.get('request'))
+
+class ArchivedInvoiceSerializer(serializers.ModelSerializer):
+    """Read-only counterpart of InvoiceSerializer for archived invoices, plus archived_at."""
+    vendor = VendorSerializer(read_only=True)
+    invoice_file = serializers.SerializerMethodField()
+    preview_url = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ArchivedInvoice
+        fields = ['id', 'vendor', 'invoice_number', 'invoice_date', 'amount', 'invoice_file', 'page_start', 'page_end', 'preview_url', 'status', 'created_at', 'archived_at']
+        read_only_fields = fields
+
+    def get_invoice_file(self, obj):
+        if not obj.archived_file_id:
+            return None
+        url = reverse('archived-invoice-file', kwargs={'pk': obj.pk}, request=self.context.get('request'))
+        return f"{url}?v={obj.archived_file_id[:16]}"
+
+    def get_preview_url(self, obj):
+        # Previews are not kept for archived invoices.
+        return None
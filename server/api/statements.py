@@ -0,0 +1,152 @@
+"""
+Splitting multi-invoice statements.
+
+Some PDFs (account activity exports, carrier statements) bundle several
+invoices or billing periods. split_statement() renders each page and OCRs
+only its header band, then starts a new segment where a page says
+"Page 1 of N" or its header carries a labelled invoice number different from
+the current segment's. Pages without either signal, or whose header cannot
+be read, continue the segment before them. When more than one segment is
+found, each is OCR'd in full and parsed on its own, segments in parallel;
+otherwise the caller reads the file as a single invoice. Every page is
+rendered once: the pages the header check renders are kept for the segments
+or the single-invoice passes to OCR.
+
+run_extraction() makes the check on every multi-page PDF before the template
+and zoned passes: a statement usually labels its first invoice's number and
+date on page 1 and ends with the last one's total, which those passes would
+happily read as one invoice. Single-page files skip it. A segment without an
+invoice number gets a generated one carrying its page range, unique within
+the statement.
+
+Runs wherever extraction runs (a scheduler thread or a daemon worker): it
+builds on hybrid_invoice_extractor's OCR helpers.
+"""
+import logging
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+import pytesseract
+
+from .extraction_fields import is_generated_number
+from .hybrid_invoice_extractor import (
+    INVOICE_NUMBER_PATTERNS,
+    crop_zone,
+    enhanced_ocr,
+    extract_field,
+    extract_invoice_fields_universal,
+    file_content_type,
+    file_source,
+    pdf_page_count,
+    render_pdf_page,
+)
+
+logger = logging.getLogger(__name__)
+
+MAX_STATEMENT_PAGES = 200  # Larger files are treated as one document
+SEGMENT_WORKERS = 4  # Tesseract runs as a subprocess, so threads overlap well
+PAGE_MARKER_RE = re.compile(r"\bpage\s*(\d+)\s*(?:of|/)\s*(\d+)\b", re.IGNORECASE)
+
+def header_number(text):
+    """Invoice number from a labelled field in the header text; unlabelled digits do not count."""
+    for pattern in INVOICE_NUMBER_PATTERNS:
+        number = extract_field(pattern, text)
+        if number:
+            return number.upper()
+    return None
+
+def prepared_page(pdf, page_number, prepared):
+    """A page's image from prepared, released from it as segments OCR each page once; rendered if missing."""
+    image = prepared.pop(page_number, None) if prepared else None
+    return render_pdf_page(pdf, page_number) if image is None else image
+
+def read_header(pdf, page_number, on_first_page=None, prepared=None):
+    """
+    Return (invoice number or None, page marker (n, of) or None) for one page;
+    a page that cannot be rendered or read yields (None, None).
+    """
+    try:
+        image = prepared.get(page_number) if prepared else None
+        if image is None:
+            image = render_pdf_page(pdf, page_number)
+            # Kept for the segments or the single-invoice passes, so no page is rendered twice.
+            if prepared is not None:
+                prepared[page_number] = image
+            if page_number == 1 and on_first_page:
+                on_first_page(image)
+        text = pytesseract.image_to_string(crop_zone(image, "header"))
+    except Exception as e:
+        logger.error(f"Statement header error on page {page_number}: {e}")
+        return None, None
+    marker = PAGE_MARKER_RE.search(text)
+    return header_number(text), (int(marker.group(1)), int(marker.group(2))) if marker else None
+
+def find_boundaries(headers):
+    """
+    First page numbers (1-based) of the segments found in headers, a list of
+    (number, marker) per page.
+    """
+    starts = [1]
+    current = headers[0][0] if headers else None
+    for page_number, (number, marker) in enumerate(headers[1:], start=2):
+        restarts = marker is not None and marker[0] == 1
+        if restarts or (number and current and number != current):
+            starts.append(page_number)
+            current = number
+        elif number and not current:
+            current = number
+    return starts
+
+def ocr_page(pdf, page_number, prepared=None):
+    """Full OCR text of one page; empty when the page cannot be read, like extract_text() does."""
+    try:
+        image = prepared_page(pdf, page_number, prepared)
+        text = pytesseract.image_to_string(image)
+        if len(text.strip()) < 100:
+            text = enhanced_ocr(image)
+    except Exception as e:
+        logger.error(f"Statement page {page_number} error: {e}")
+        return ""
+    return text
+
+def segment_text(pdf, first, last, prepared=None):
+    """Full OCR text of pages first..last (1-based, inclusive) of a PDF path or bytes."""
+    return "\n".join(ocr_page(pdf, number, prepared) for number in range(first, last + 1))
+
+def extract_segment(pdf, first, last, prepared=None):
+    text = segment_text(pdf, first, last, prepared)
+    fields = extract_invoice_fields_universal(text)
+    if is_generated_number(fields["invoice_number"]):
+        # Segments are parsed in the same second; the page range keeps their made-up numbers apart.
+        fields["invoice_number"] = f"{fields['invoice_number']}-p{first}-{last}"
+    return {"page_start": first, "page_end": last, "fields": fields, "ocr": {"text": text, "complete": True}}
+
+def split_statement(file_obj, on_first_page=None, prepared=None):
+    """
+    Segments of a multi-invoice PDF, as a list of {"page_start", "page_end",
+    "fields", "ocr"}, or None when the file holds a single invoice. Pages
+    found in prepared ({page number: image}) are not rendered again, and the
+    pages the header check renders are added to it.
+    """
+    if file_content_type(file_obj) != "application/pdf":
+        return None
+    pdf = file_source(file_obj)
+    try:
+        page_count = pdf_page_count(pdf)
+    except Exception as e:
+        # Let the single-invoice path report the unreadable file.
+        logger.warning(f"Statement check skipped: {e}")
+        return None
+    if page_count < 2 or page_count > MAX_STATEMENT_PAGES:
+        return None
+
+    with ThreadPoolExecutor(max_workers=SEGMENT_WORKERS, thread_name_prefix="statement") as pool:
+        headers = list(pool.map(
+            lambda number: read_header(pdf, number, on_first_page, prepared), range(1, page_count + 1),
+        ))
+        starts = find_boundaries(headers)
+        if len(starts) < 2:
+            return None
+        ranges = list(zip(starts, [start - 1 for start in starts[1:]] + [page_count]))
+        logger.info(f"Splitting statement into {len(ranges)} invoices at pages {starts}")
+        return list(pool.map(lambda pages: extract_segment(pdf, *pages, prepared), ranges))
@@ -0,0 +1,115 @@
+"""
+Content-addressed storage for invoice files.
+
+Each file is stored once, under invoices/<aa>/<bb>/<sha256><ext>, where aa and
+bb are the first two byte pairs of its SHA-256. Identical uploads share one
+blob, so names never collide and no random suffix is needed, and no directory
+holds more than a few hundred entries.
+
+Uploads are streamed to a temporary file on disk by HashingFileUploadHandler,
+which hashes them on the way; saving then only renames that file into place.
+"""
+import hashlib
+import mimetypes
+import os
+import re
+import tempfile
+
+from django.core.files.move import file_move_safe
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+
+HASH_CHUNK_SIZE = 1024 * 1024
+BLOB_NAME_RE = re.compile(r"^invoices/[0-9a-f]{2}/[0-9a-f]{2}/(?P<digest>[0-9a-f]{64})(?:\.\w+)?$")
+
+def hash_file(path):
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+def content_hash(name):
+    """Return the SHA-256 encoded in a content-addressed file name, or None for legacy names."""
+    match = BLOB_NAME_RE.match(name or "")
+    return match.group("digest") if match else None
+
+class HashingFileUploadHandler(TemporaryFileUploadHandler):
+    """
+    Stream every upload straight to a temporary file, computing its SHA-256
+    while the chunks arrive. The resulting file exposes `sha256`.
+    """
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.hasher = hashlib.sha256()
+
+    def receive_data_chunk(self, raw_data, start):
+        self.hasher.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        file.sha256 = self.hasher.hexdigest()
+        return file
+
+class StagedUpload(UploadedFile):
+    """
+    A hashed file already on local disk (an assembled chunked upload, a
+    hot-folder copy), presented to the upload pipeline like a streamed
+    upload. Storing it moves the file into place.
+    """
+    def __init__(self, path, name, size, sha256):
+        content_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+        super().__init__(open(path, "rb"), name, content_type, size)
+        self.path = path
+        self.sha256 = sha256
+
+    def temporary_file_path(self):
+        return self.path
+
+class ContentAddressedStorage(FileSystemStorage):
+    """FileSystemStorage that names files by the SHA-256 of their content."""
+
+    def blob_name(self, digest, ext=""):
+        return f"invoices/{digest[:2]}/{digest[2:4]}/{digest}{ext.lower()}"
+
+    def get_available_name(self, name, max_length=None):
+        # The final name is derived from the content in _save().
+        return name
+
+    def place_file(self, source_path, digest, ext):
+        """Move a local file into its content-addressed location and return the blob name."""
+        name = self.blob_name(digest, ext)
+        path = self.path(name)
+        if os.path.exists(path):
+            # Same content is already stored; the source is left for its owner to clean up.
+            return name
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        file_move_safe(source_path, path, allow_overwrite=True)
+        if self.file_permissions_mode is not None:
+            os.chmod(path, self.file_permissions_mode)
+        return name
+
+    def _save(self, name, content):
+        ext = os.path.splitext(name)[1]
+        if hasattr(content, "temporary_file_path"):
+            source_path = content.temporary_file_path()
+            digest = getattr(content, "sha256", None) or hash_file(source_path)
+            return self.place_file(source_path, digest, ext)
+
+        # In-memory content: stream it to a temp file beside the blobs, hashing as we go.
+        incoming = self.path("invoices")
+        os.makedirs(incoming, exist_ok=True)
+        hasher = hashlib.sha256()
+        with tempfile.NamedTemporaryFile(dir=incoming, suffix=".part", delete=False) as tmp:
+            for chunk in content.chunks():
+                hasher.update(chunk)
+                tmp.write(chunk)
+        try:
+            return self.place_file(tmp.name, hasher.hexdigest(), ext)
+        finally:
+            if os.path.exists(tmp.name):
+                os.remove(tmp.name)
+
+invoice_storage = ContentAddressedStorage()
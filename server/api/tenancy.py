@@ -0,0 +1,36 @@
+"""
+Per-site (tenant) scoping.
+
+Each restaurant is a django.contrib.sites Site. Every user belongs to one,
+and vendors, invoices and archived invoices carry a site column. The API
+only reads and writes rows of the requesting user's site: the viewsets
+through SiteScopedMixin, the async views through scope_to_user().
+
+Each site also has its own change counters ("invoice@<site>", see
+site_resource() in api/models.py). Listing ETags, ?changed_since= deltas and
+the listing page cache therefore sit in per-site namespaces: a write in one
+restaurant neither invalidates nor locks another's listings.
+"""
+from .models import site_resource
+
+def user_site_id(user):
+    return user.site_id
+
+def scope_to_user(queryset, user):
+    """Narrow a queryset of a site-scoped model to the user's site."""
+    return queryset.filter(site_id=user_site_id(user))
+
+def site_resources(resources, site_id):
+    """Change counter names of resources ("invoice", "vendor") for one site."""
+    return [site_resource(resource, site_id) for resource in resources]
+
+class SiteScopedMixin:
+    """
+    ViewSet mixin limiting get_queryset() to the requesting user's site and
+    creating rows in it; another site's row id answers 404, as a missing row does.
+    """
+    def get_queryset(self):
+        return scope_to_user(super().get_queryset(), self.request.user)
+
+    def perform_create(self, serializer):
+        serializer.save(site_id=user_site_id(self.request.user))
@@ -1,3 +1,628 @@
-from django.test import TestCase
+import asyncio
+import datetime
+import hashlib
+import importlib
+import io
+import json
+import os
+import stat
+import sys
+import tempfile
+import threading
+import types
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.sites.models import Site
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.http import QueryDict
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient, APIRequestFactory, force_authenticate
+from rest_framework_simplejwt.tokens import AccessToken
+from PIL import Image
+
+from .admission import ADMISSION_STATS, _in_flight, admit, release, try_admit
+from .archive import archive_batch
+from .chunked_uploads import OffsetMismatch, _hashers, append_chunk, finalize_session, part_path, start_session
+from .duplicates import MAX_CANDIDATES, check_invoice_text
+from .file_delivery import parse_range
+from .filters import filter_invoices
+from .intake import run_extraction, save_statement_segments
+from .models import ArchivedInvoice, CustomUser, Invoice, UploadSession, Vendor, VendorTemplate
+from .ocr_daemon import extract_file
+from .scheduler import BULK, INTERACTIVE, ExtractionScheduler
+from .vendor_templates import confirm_template, extract_invoice_data_templated, invoice_values, match_template
+from .versioning import prune_deleted_records
+from .views import VendorViewSet
+
+# Every supported listing filter, alone and in the combinations the indexes are built for.
+FILTER_QUERIES = (
+    "date_from=2025-06-01",
+    "date_to=2023-02-01",
+    "date_from=2024-01-01&date_to=2024-01-31",
+    "amount_min=990",
+    "amount_max=5",
+    "vendor=3",
+    "vendor=3,4",
+    "category=Beverage",
+    "status=Pending for review",
+    "status=Pending for review,Pending for approval",
+    "status=Approved&date_from=2024-01-01",
+    "vendor=3&date_from=2024-01-01&date_to=2024-06-30",
+    "vendor=3&ordering=-invoice_date",
+    "status=Approved&ordering=-invoice_date",
+)
+
+
+def ocr_module(name):
+    """
+    Import an api module built on hybrid_invoice_extractor. That module loads
+    the transformers NER model on import, which these tests never use, so the
+    import gets a stand-in pipeline: the OCR tests run without transformers
+    or the model installed, and the other tests never import the OCR stack.
+    """
+    module_name = f"api.{name}"
+    if module_name in sys.modules:
+        return sys.modules[module_name]
+    stand_in = types.ModuleType("transformers")
+    stand_in.pipeline = lambda *args, **kwargs: None
+    real = sys.modules.get("transformers")
+    sys.modules["transformers"] = stand_in
+    try:
+        return importlib.import_module(module_name)
+    finally:
+        if real is None:
+            del sys.modules["transformers"]
+        else:
+            sys.modules["transformers"] = real
+
+
+def full_scans(queryset, table):
+    """Return the plan lines (or nodes) in which the database reads every row of table."""
+    if connection.vendor == "mysql":
+        found = []
+
+        def walk(node):
+            if isinstance(node, dict):
+                if node.get("table_name") == table and node.get("access_type") == "ALL":
+                    found.append(node)
+                for value in node.values():
+                    walk(value)
+            elif isinstance(node, list):
+                for value in node:
+                    walk(value)
+
+        walk(json.loads(queryset.explain(format="json")))
+        return found
+    if connection.vendor == "sqlite":
+        # "SCAN t" and "SCAN t USING INDEX i" both visit every row; "SEARCH" uses the index.
+        return [line for line in queryset.explain().splitlines() if f"SCAN {table}" in line]
+    raise NotImplementedError(connection.vendor)
+
+
+class InvoiceFilterQueryPlanTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        categories = ["Food", "Beverage", "Supplies", "Equipment", "Other"]
+        # Listings are scoped to one site, so spread the rows over several.
+        sites = [Site.objects.get_current()] + Site.objects.bulk_create(
+            Site(domain=f"site-{number}.example.com", name=f"Site {number}") for number in range(3)
+        )
+        vendors = Vendor.objects.bulk_create(
+            Vendor(site=sites[number % len(sites)], vendor_name=f"Vendor {number}", category=categories[number % len(categories)])
+            for number in range(40)
+        )
+        statuses = [value for value, _ in Invoice.STATUS_CHOICES]
+        start = datetime.date(2023, 1, 1)
+        Invoice.objects.bulk_create(
+            Invoice(
+                site=vendors[number % len(vendors)].site,
+                vendor=vendors[number % len(vendors)],
+                invoice_number=f"INV-{number}",
+                invoice_date=start + datetime.timedelta(days=number % 900),
+                amount=Decimal(number % 1000),
+                # Mostly settled invoices, as in production; pending ones are rare.
+                status=statuses[2 + number % 3] if number % 20 else statuses[number % 2],
+            )
+            for number in range(16000)
+        )
+        with connection.cursor() as cursor:
+            if connection.vendor == "mysql":
+                cursor.execute("ANALYZE TABLE api_invoice, api_vendor")
+            else:
+                cursor.execute("ANALYZE")
+
+    def test_supported_filters_use_an_index(self):
+        for query in FILTER_QUERIES:
+            with self.subTest(query=query):
+                queryset = Invoice.objects.filter(site_id=1).select_related("vendor").order_by("-created_at")
+                queryset = filter_invoices(queryset, QueryDict(query))
+                self.assertEqual(full_scans(queryset, Invoice._meta.db_table), [])
+
+class ExtractionBenchmarkTests(SimpleTestCase):
+    def test_golden_results_cover_every_sample(self):
+        benchmark = ocr_module("extraction_benchmark")
+        golden = benchmark.load_golden()
+        for sample in benchmark.find_samples():
+            with self.subTest(sample=sample["id"]):
+                self.assertEqual(sorted(golden.get(sample["id"], {})), sorted(benchmark.COMPARED_FIELDS))
+
+    def test_score_fields_normalizes_values(self):
+        benchmark = ocr_module("extraction_benchmark")
+        expected = {"vendor_name": "Acme Foods", "invoice_number": "1172", "invoice_date": "2025-02-07", "amount": "1167.80"}
+        fields = {"vendor_name": "  ACME   foods", "invoice_number": "1172", "invoice_date": "2025-02-07", "amount": "$1,167.8"}
+        self.assertEqual(benchmark.score_fields(fields, expected), (4, 4))
+        self.assertEqual(benchmark.score_fields({**fields, "amount": "167.80"}, expected), (3, 4))
+        self.assertEqual(benchmark.score_fields(fields, {"amount": "1167.80"}), (1, 1))
+
+    def test_run_path_times_stages_and_scores_against_golden(self):
+        benchmark = ocr_module("extraction_benchmark")
+        text = "Acme Foods\nInvoice No: 1172\nInvoice Date: 02/07/2025\nTotal Due: $167.86\n"
+
+        def parse_fixed_text(sample):
+            return benchmark.extractor.extract_invoice_fields_universal(text)
+
+        sample = {"id": "fixture", "kind": "textract", "path": str(benchmark.TEXTRACT_FIXTURE)}
+        golden = {"fixture": {"invoice_number": "1172", "invoice_date": "2025-02-07", "amount": "167.86"}}
+        with mock.patch.dict(benchmark.PATHS, {"fixed": ("textract", parse_fixed_text)}):
+            results = benchmark.run_path("fixed", [sample], golden, repeat=2)
+        self.assertEqual(len(results), 2)
+        self.assertEqual([(result["matching"], result["compared"]) for result in results], [(3, 3), (3, 3)])
+        self.assertGreater(results[0]["stages"]["parse"], 0)
+
+        summary = benchmark.summarize(results, rss=(100.0, 20.0))
+        self.assertEqual((summary["runs"], summary["errors"], summary["accuracy"]), (2, 0, 1.0))
+        self.assertEqual((summary["peak_rss_mb"], summary["peak_child_rss_mb"]), (100.0, 20.0))
+
+    def test_check_regressions(self):
+        benchmark = ocr_module("extraction_benchmark")
+        baseline = {"zoned": {"accuracy": 0.9, "pages_per_sec": 2.0, "errors": 0}}
+        passing = {"zoned": {"accuracy": 0.9, "pages_per_sec": 1.8, "errors": 0}}
+        self.assertEqual(benchmark.check_regressions(passing, baseline), [])
+        failing = {"zoned": {"accuracy": 0.8, "pages_per_sec": 1.0, "errors": 1}}
+        self.assertEqual(len(benchmark.check_regressions(failing, baseline)), 3)
+        self.assertEqual(len(benchmark.check_regressions(passing, min_accuracy=0.95)), 1)
+
+class StatementSegmentTests(TestCase):
+    def test_unnumbered_segments_are_saved_apart(self):
+        statements = ocr_module("statements")
+        # No labelled number and no run of three digits: the extractor has to make one up.
+        text = "Acme Foods\nStatement of account\nTotal Due: $12.50\n"
+        with mock.patch.object(statements, "segment_text", return_value=text):
+            segments = [statements.extract_segment("statement.pdf", 1, 2), statements.extract_segment("statement.pdf", 3, 3)]
+        first, second = (segment["fields"]["invoice_number"] for segment in segments)
+        self.assertNotEqual(first, second)
+
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+            results = save_statement_segments(SimpleUploadedFile("statement.pdf", b"%PDF-1.4 statement"), 1, segments)
+        self.assertEqual([is_new for _, is_new in results], [True, True])
+        self.assertEqual(
+            sorted(Invoice.objects.values_list("invoice_number", "page_start", "page_end")),
+            sorted([(first, 1, 2), (second, 3, 3)]),
+        )
+
+    def test_statement_is_split_even_when_the_zoned_pass_resolves_it(self):
+        extractor = ocr_module("hybrid_invoice_extractor")
+        statements = ocr_module("statements")
+        # Page 1 labels the first invoice's number and date; the last page carries the second one's total.
+        headers = {1: "Acme Foods\nPage 1 of 1\nInvoice No: A100\n", 2: "Acme Foods\nPage 1 of 1\nInvoice No: B200\n"}
+        # Pages told apart by their width, which the header crop keeps.
+        pages = {number: Image.new("RGB", (100 + number, 100)) for number in headers}
+        zoned = {"vendor_name": "Acme Foods", "invoice_number": "A100", "invoice_date": "2025-02-07", "amount": "80.00"}
+
+        with mock.patch.object(statements, "pdf_page_count", return_value=2), \
+                mock.patch.object(statements, "render_pdf_page", side_effect=lambda pdf, number: pages[number]) as render, \
+                mock.patch("pytesseract.image_to_string", side_effect=lambda image: headers[image.width - 100]), \
+                mock.patch.object(extractor, "extract_invoice_data_zoned_pass", return_value=zoned):
+            extracted = run_extraction(SimpleUploadedFile("statement.pdf", b"%PDF-1.4 statement", "application/pdf"))
+        self.assertEqual(
+            [(segment["page_start"], segment["page_end"], segment["fields"]["invoice_number"]) for segment in extracted["segments"]],
+            [(1, 1, "A100"), (2, 2, "B200")],
+        )
+        # The segments OCR the pages the header check rendered.
+        self.assertEqual(sorted(call.args[1] for call in render.call_args_list), [1, 2])
+
+class LoginEmailTests(TestCase):
+    def test_case_duplicate_email_is_rejected(self):
+        admin = CustomUser.objects.create_user("admin", email="A@x.com", password="secret", role="admin")
+        client = APIClient()
+        client.force_authenticate(admin)
+        response = client.post("/api/users/", {"username": "other", "email": "a@X.com", "password": "secret"}, format="json")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("email", response.json())
+
+    def test_account_without_login_email_keeps_none_until_it_claims_it(self):
+        holder = CustomUser.objects.create_user("holder", email="a@x.com")
+        # As migration 0005 leaves a case-duplicate.
+        duplicate = CustomUser.objects.create_user("duplicate", email="b@x.com")
+        CustomUser.objects.filter(pk=duplicate.pk).update(email="A@x.com", email_normalized=None)
+
+        duplicate = CustomUser.objects.get(pk=duplicate.pk)
+        duplicate.set_password("changed")
+        duplicate.save()
+        self.assertIsNone(CustomUser.objects.get(pk=duplicate.pk).email_normalized)
+
+        duplicate.claim_login_email()
+        self.assertEqual(CustomUser.objects.get(pk=duplicate.pk).email_normalized, "a@x.com")
+        self.assertIsNone(CustomUser.objects.get(pk=holder.pk).email_normalized)
+
+class VendorTemplateTests(TestCase):
+    def confirmed_template(self, vendor, fingerprint):
+        invoice = Invoice.objects.create(
+            site=vendor.site, vendor=vendor, invoice_number=f"T-{fingerprint}", invoice_date=datetime.date(2025, 2, 7), amount=Decimal("10.00"),
+        )
+        VendorTemplate.objects.create(
+            vendor=vendor, site=vendor.site, fingerprint=fingerprint, sample_values=invoice_values(invoice), source_invoice=invoice,
+        )
+        confirm_template(invoice)
+        return VendorTemplate.objects.get(vendor=vendor)
+
+    def test_template_of_another_site_is_never_matched(self):
+        here = Site.objects.get_current()
+        there = Site.objects.create(domain="there.example.com", name="There")
+        template = self.confirmed_template(Vendor.objects.create(site=there, vendor_name="Acme Foods"), "00ff00ff00ff00ff")
+
+        self.assertEqual(match_template("00ff00ff00ff00ff", there.id), template)
+        self.assertIsNone(match_template("00ff00ff00ff00ff", here.id))
+        with mock.patch("api.vendor_templates.header_fingerprint", return_value="00ff00ff00ff00ff"):
+            self.assertIsNone(extract_invoice_data_templated([Image.new("RGB", (100, 100))], here.id))
+        template.refresh_from_db()
+        self.assertEqual(template.uses, 0)
+
+    def test_headers_within_matching_distance_are_found_through_their_bands(self):
+        site = Site.objects.get_current()
+        fingerprints = [f"{number * 0x1111111111111111:016x}" for number in range(1, 16)]
+        templates = {
+            fingerprint: self.confirmed_template(Vendor.objects.create(site=site, vendor_name=f"Vendor {number}"), fingerprint)
+            for number, fingerprint in enumerate(fingerprints)
+        }
+        target = fingerprints[6]
+        # Eight flipped bits in eight different bands: a single band still agrees.
+        near = f"{int(target, 16) ^ 0x8040201008040201:016x}"
+        self.assertEqual(match_template(near, site.id), templates[target])
+        self.assertIsNone(match_template(f"{int(target, 16) ^ 0x80402010080402ff:016x}", site.id))
+
+class NearDuplicateTests(TestCase):
+    def test_real_duplicate_is_found_among_many_same_layout_invoices(self):
+        vendor = Vendor.objects.create(vendor_name="Acme Foods")
+        layout = (
+            "Acme Foods wholesale produce and dairy 12 Market Street Springfield "
+            "remit to the address above terms net thirty days late payments accrue interest "
+            "thank you for your business please reference the invoice number with every payment "
+            "Invoice No {number} Invoice Date {date} Total Due {amount}"
+        )
+        start = datetime.date(2025, 1, 1)
+        invoices = []
+        for number in range(MAX_CANDIDATES + 20):
+            fields = {"number": f"A{number}", "date": start + datetime.timedelta(days=number % 5), "amount": Decimal(100 + 10 * number)}
+            invoice = Invoice.objects.create(
+                vendor=vendor, invoice_number=fields["number"], invoice_date=fields["date"], amount=fields["amount"],
+            )
+            check_invoice_text(invoice, layout.format(**fields), flag=False)
+            invoices.append((invoice, fields))
+
+        original, fields = invoices[-1]
+        rescan = Invoice.objects.create(
+            vendor=vendor, invoice_number="A69-1", invoice_date=fields["date"], amount=fields["amount"],
+        )
+        flags = check_invoice_text(rescan, layout.format(**fields))
+        self.assertEqual([flag.duplicate_of for flag in flags], [original])
+
+class OCRDaemonClientTests(SimpleTestCase):
+    def test_private_upload_is_made_group_readable_before_it_is_sent(self):
+        with tempfile.NamedTemporaryFile() as upload:
+            self.assertEqual(stat.S_IMODE(os.stat(upload.name).st_mode), 0o600)
+            with mock.patch("api.ocr_daemon.call", return_value={"fields": {}}) as call:
+                extract_file(upload.name, site_id=1)
+            self.assertEqual(stat.S_IMODE(os.stat(upload.name).st_mode), 0o640)
+        self.assertEqual(call.call_args.args[0]["site_id"], 1)
+
+class ListingVersionTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user("reader", email="reader@x.com", password="secret")
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(self.user)}")
+
+    def test_unchanged_listing_answers_304_until_a_write_moves_the_etag(self):
+        Vendor.objects.create(vendor_name="Acme Foods")
+        etag = self.client.get("/api/vendors/")["ETag"]
+        self.assertEqual(self.client.get("/api/vendors/", HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        Vendor.objects.create(vendor_name="Bolt Beverage")
+        response = self.client.get("/api/vendors/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertEqual(len(response.json()), 2)
+
+    def test_delta_lists_written_rows_and_deleted_ids(self):
+        kept, edited, deleted = (Vendor.objects.create(vendor_name=name) for name in ("Kept", "Edited", "Deleted"))
+        version = self.client.get("/api/vendors/")["X-Resource-Version"]
+        edited.category = "Beverage"
+        edited.save()
+        deleted_id = deleted.id
+        deleted.delete()
+
+        delta = self.client.get("/api/vendors/", {"changed_since": version}).json()
+        self.assertEqual([row["id"] for row in delta["changed"]], [edited.id])
+        self.assertEqual(delta["deleted"], [deleted_id])
+
+    def test_invoice_delta_includes_invoices_whose_vendor_changed(self):
+        vendor = Vendor.objects.create(vendor_name="Acme Foods")
+        invoice = Invoice.objects.create(vendor=vendor, invoice_number="A1", invoice_date=datetime.date(2025, 2, 7), amount=Decimal("10.00"))
+        version = self.client.get("/api/invoices/")["X-Resource-Version"]
+        self.assertEqual(len(version.split(".")), 2)
+        vendor.category = "Food"
+        vendor.save()
+
+        delta = self.client.get("/api/invoices/", {"changed_since": version}).json()
+        self.assertEqual([row["id"] for row in delta["changed"]], [invoice.id])
+
+    def test_delta_older_than_the_pruned_tombstones_answers_410(self):
+        vendor = Vendor.objects.create(vendor_name="Acme Foods")
+        version = self.client.get("/api/vendors/")["X-Resource-Version"]
+        vendor.delete()
+        self.assertEqual(prune_deleted_records(timezone.now() + datetime.timedelta(seconds=1)), 1)
+
+        self.assertEqual(self.client.get("/api/vendors/", {"changed_since": version}).status_code, 410)
+
+    def test_viewset_list_honours_validators_and_deltas(self):
+        Vendor.objects.create(vendor_name="Acme Foods")
+        factory = APIRequestFactory()
+        view = VendorViewSet.as_view({"get": "list"})
+
+        def get(**extra):
+            request = factory.get("/api/vendors/", **extra)
+            force_authenticate(request, self.user)
+            return view(request)
+
+        first = get()
+        self.assertEqual(get(HTTP_IF_NONE_MATCH=first["ETag"]).status_code, 304)
+        added = Vendor.objects.create(vendor_name="Bolt Beverage")
+        delta = get(data={"changed_since": first["X-Resource-Version"]})
+        self.assertEqual([row["id"] for row in delta.data["changed"]], [added.id])
+        self.assertEqual(delta.data["deleted"], [])
+
+class RangeRequestTests(TestCase):
+    def test_parse_range(self):
+        cases = {
+            "bytes=0-99": (0, 99),
+            "bytes=900-": (900, 999),
+            "bytes=900-5000": (900, 999),
+            "bytes=-100": (900, 999),
+            "bytes=-5000": (0, 999),
+            "bytes=1000-": "unsatisfiable",
+            "bytes=5-3": "unsatisfiable",
+            "bytes=-0": "unsatisfiable",
+            # Multi-range, malformed and empty ranges are ignored: the whole file is sent.
+            "bytes=0-9,20-29": None,
+            "items=0-9": None,
+            "bytes=-": None,
+        }
+        for header, expected in cases.items():
+            with self.subTest(header=header):
+                self.assertEqual(parse_range(header, 1000), expected)
+
+    def test_file_endpoint_serves_ranges(self):
+        user = CustomUser.objects.create_user("reader", email="reader@x.com")
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(user)}")
+        vendor = Vendor.objects.create(vendor_name="Acme Foods")
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+            invoice = Invoice.objects.create(
+                vendor=vendor, invoice_number="A1", invoice_date=datetime.date(2025, 2, 7), amount=Decimal("10.00"),
+                invoice_file=SimpleUploadedFile("invoice.pdf", b"%PDF-1.4 0123456789"),
+            )
+            url = f"/api/invoices/{invoice.id}/file/"
+
+            partial = client.get(url, HTTP_RANGE="bytes=-10")
+            self.assertEqual(partial.status_code, 206)
+            self.assertEqual(b"".join(partial.streaming_content), b"0123456789")
+            self.assertEqual(partial["Content-Range"], "bytes 9-18/19")
+
+            unsatisfiable = client.get(url, HTTP_RANGE="bytes=19-")
+            self.assertEqual(unsatisfiable.status_code, 416)
+            self.assertEqual(unsatisfiable["Content-Range"], "bytes */19")
+
+            whole = client.get(url, HTTP_RANGE="bytes=0-1,5-6")
+            self.assertEqual(whole.status_code, 200)
+            self.assertEqual(whole["Content-Length"], "19")
+            whole.close()
+
+class ArchiveTests(TestCase):
+    def test_archived_invoice_file_reads_back(self):
+        user = CustomUser.objects.create_user("reader", email="reader@x.com")
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(user)}")
+        vendor = Vendor.objects.create(vendor_name="Acme Foods")
+        content = b"%PDF-1.4 " + bytes(range(256)) * 64
+        with tempfile.TemporaryDirectory() as media_root, tempfile.TemporaryDirectory() as archive_root, \
+                override_settings(MEDIA_ROOT=media_root, ARCHIVE_ROOT=archive_root):
+            invoice = Invoice.objects.create(
+                vendor=vendor, invoice_number="A1", invoice_date=datetime.date(2024, 2, 7), amount=Decimal("10.00"),
+                status="Paid", invoice_file=SimpleUploadedFile("invoice.pdf", content),
+            )
+            stored = invoice.invoice_file.path
+
+            self.assertEqual(archive_batch([invoice]), (1, []))
+            self.assertFalse(Invoice.objects.filter(pk=invoice.id).exists())
+            self.assertFalse(os.path.exists(stored))
+            archived = ArchivedInvoice.objects.get(pk=invoice.id)
+            self.assertEqual(archived.archived_file.sha256, hashlib.sha256(content).hexdigest())
+            self.assertTrue(os.path.exists(os.path.join(archive_root, "2024-02.bundle")))
+
+            url = f"/api/archived-invoices/{invoice.id}/file/"
+            response = client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(b"".join(response.streaming_content), content)
+            self.assertEqual(response["ETag"], f'"{hashlib.sha256(content).hexdigest()}"')
+            self.assertEqual(client.get(url, HTTP_IF_NONE_MATCH=response["ETag"]).status_code, 304)
+
+    def test_reopened_invoice_stays_live(self):
+        vendor = Vendor.objects.create(vendor_name="Acme Foods")
+        invoice = Invoice.objects.create(
+            vendor=vendor, invoice_number="A1", invoice_date=datetime.date(2024, 2, 7), amount=Decimal("10.00"), status="Paid",
+        )
+        Invoice.objects.filter(pk=invoice.id).update(status="Approved")
+
+        self.assertEqual(archive_batch([invoice]), (0, [(invoice.id, "changed while being archived")]))
+        self.assertTrue(Invoice.objects.filter(pk=invoice.id).exists())
+        self.assertFalse(ArchivedInvoice.objects.exists())
+
+class SiteScopingTests(TestCase):
+    def setUp(self):
+        here = Site.objects.get_current()
+        self.there = Site.objects.create(domain="there.example.com", name="There")
+        self.vendor = Vendor.objects.create(site=here, vendor_name="Acme Foods")
+        self.invoice = Invoice.objects.create(
+            vendor=self.vendor, invoice_number="A1", invoice_date=datetime.date(2025, 2, 7), amount=Decimal("10.00"),
+        )
+        self.other_vendor = Vendor.objects.create(site=self.there, vendor_name="Bolt Beverage")
+
+    def client_for(self, site):
+        user = CustomUser.objects.create_user(f"reader-{site.id}", email=f"reader-{site.id}@x.com", site=site)
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(user)}")
+        return client
+
+    def test_another_sites_rows_answer_404(self):
+        client = self.client_for(self.there)
+        self.assertEqual(client.get(f"/api/invoices/{self.invoice.id}/").status_code, 404)
+        self.assertEqual(client.get(f"/api/vendors/{self.vendor.id}/").status_code, 404)
+        self.assertEqual(client.get(f"/api/vendors/{self.other_vendor.id}/").status_code, 200)
+
+    def test_invoice_cannot_move_to_another_sites_vendor(self):
+        client = self.client_for(self.vendor.site)
+        url = f"/api/invoices/{self.invoice.id}/"
+        response = client.patch(url, {"vendor_id": self.other_vendor.id}, format="multipart")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("vendor_id", response.data)
+        self.invoice.refresh_from_db()
+        self.assertEqual(self.invoice.vendor, self.vendor)
+
+        moved_to = Vendor.objects.create(site=self.vendor.site, vendor_name="Corner Dairy")
+        self.assertEqual(client.patch(url, {"vendor_id": moved_to.id}, format="multipart").status_code, 200)
+
+class ChunkedUploadTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user("uploader", email="uploader@x.com")
+        upload_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(upload_dir.cleanup)
+        upload_settings = override_settings(CHUNKED_UPLOAD_DIR=upload_dir.name)
+        upload_settings.enable()
+        self.addCleanup(upload_settings.disable)
+        self.data = b"%PDF-1.4 0123456789"
+
+    def append(self, session, offset, data, length=None):
+        return append_chunk(session.pk, self.user.pk, offset, io.BytesIO(data), len(data) if length is None else length)
+
+    def test_out_of_order_and_repeated_chunks_are_refused_with_the_expected_offset(self):
+        session = start_session(self.user.pk, "invoice.pdf", len(self.data))
+        with self.assertRaises(OffsetMismatch) as refused:
+            self.append(session, 10, self.data[10:])
+        self.assertEqual(refused.exception.expected, 0)
+
+        self.append(session, 0, self.data[:10])
+        with self.assertRaises(OffsetMismatch) as refused:
+            self.append(session, 0, self.data[:10])
+        self.assertEqual(refused.exception.expected, 10)
+        self.assertEqual(os.path.getsize(part_path(session)), 10)
+
+    def test_short_chunk_is_cut_back_and_the_upload_resumes(self):
+        session = start_session(self.user.pk, "invoice.pdf", len(self.data), hashlib.sha256(self.data).hexdigest())
+        self.append(session, 0, self.data[:10])
+        with self.assertRaises(ValueError):
+            self.append(session, 10, self.data[10:14], length=len(self.data) - 10)
+        self.assertEqual(os.path.getsize(part_path(session)), 10)
+
+        # As if the next chunk landed in another process: the hash is rebuilt from disk.
+        _hashers.clear()
+        self.append(session, 10, self.data[10:])
+        session, upload = finalize_session(session.pk, self.user.pk)
+        with upload:
+            self.assertEqual(upload.sha256, hashlib.sha256(self.data).hexdigest())
+            self.assertEqual(upload.read(), self.data)
+
+    def test_digest_mismatch_on_completion_discards_the_session(self):
+        session = start_session(self.user.pk, "invoice.pdf", len(self.data), hashlib.sha256(b"other").hexdigest())
+        self.append(session, 0, self.data)
+        with self.assertRaises(ValueError):
+            finalize_session(session.pk, self.user.pk)
+        self.assertFalse(UploadSession.objects.filter(pk=session.pk).exists())
+        self.assertFalse(os.path.exists(part_path(session)))
+
+@override_settings(
+    OCR_MAX_INFLIGHT_PAGES=10, OCR_MAX_USER_INFLIGHT_PAGES=6, OCR_ADMISSION_WAIT=0.3, OCR_SECONDS_PER_PAGE=3,
+    OCR_DAEMON_SOCKET=None, EXTRACTION_WORKERS=2,
+)
+class AdmissionTests(SimpleTestCase):
+    def tearDown(self):
+        # The accounting is process-wide; leave none of it to the next test.
+        _in_flight.clear()
+        ADMISSION_STATS.update(in_flight_pages=0, in_flight_jobs=0)
+
+    def test_user_and_global_limits(self):
+        self.assertIsNone(try_admit(1, 6))
+        self.assertEqual(try_admit(1, 1), "user")
+        self.assertIsNone(try_admit(2, 4))
+        self.assertEqual(try_admit(3, 1), "global")
+        release(2, 4)
+        self.assertIsNone(try_admit(3, 1))
+        release(1, 6)
+        release(3, 1)
+        self.assertEqual((ADMISSION_STATS["in_flight_pages"], ADMISSION_STATS["in_flight_jobs"]), (0, 0))
+
+    def test_oversized_job_is_admitted_when_nothing_is_in_flight(self):
+        self.assertIsNone(try_admit(1, 50))
+        self.assertEqual(try_admit(2, 1), "global")
+
+    def test_waiting_upload_is_rejected_with_retry_after_or_admitted_on_release(self):
+        try_admit(1, 6)
+        try_admit(2, 4)
+        rejected = ADMISSION_STATS["rejected_global"]
+        # 10 pages in flight at 3 s a page on 2 workers.
+        self.assertEqual(asyncio.run(admit(3, 2)), 15)
+        self.assertEqual(ADMISSION_STATS["rejected_global"], rejected + 1)
+
+        threading.Timer(0.05, release, args=(2, 4)).start()
+        self.assertIsNone(asyncio.run(admit(3, 2)))
+        self.assertEqual(ADMISSION_STATS["in_flight_pages"], 8)
+
+@override_settings(SCHEDULER_BULK_PENALTY=50, SCHEDULER_AGING_RATE=0.5)
+class ExtractionSchedulerTests(SimpleTestCase):
+    def run_in_order(self, submit_jobs):
+        """Run submit_jobs(scheduler, order) while the single worker is busy; return the order the jobs ran in."""
+        scheduler = ExtractionScheduler(1)
+        started, gate = threading.Event(), threading.Event()
+        scheduler.submit(lambda: (started.set(), gate.wait()))
+        self.assertTrue(started.wait(5))
+        order = []
+        futures = submit_jobs(scheduler, order)
+        gate.set()
+        for future in futures:
+            future.result(timeout=5)
+        return order
+
+    def test_shortest_job_runs_first_and_bulk_yields_to_interactive(self):
+        def submit_jobs(scheduler, order):
+            return [
+                scheduler.submit(order.append, name, cost=cost, job_class=job_class)
+                for name, cost, job_class in (
+                    ("statement", 30, INTERACTIVE), ("backfill", 5, BULK), ("invoice", 1, INTERACTIVE), ("receipt", 10, INTERACTIVE),
+                )
+            ]
+        self.assertEqual(self.run_in_order(submit_jobs), ["invoice", "receipt", "statement", "backfill"])
+
+    def test_waiting_promotes_a_large_job_past_later_small_ones(self):
+        clock = [1000.0]
+
+        def submit_jobs(scheduler, order):
+            jobs = [scheduler.submit(order.append, "statement", cost=100)]
+            # 300 s of waiting take 150 cost units off the statement.
+            clock[0] += 300
+            jobs.append(scheduler.submit(order.append, "invoice", cost=10))
+            return jobs
+
+        with mock.patch("api.scheduler.time.monotonic", lambda: clock[0]):
+            self.assertEqual(self.run_in_order(submit_jobs), ["statement", "invoice"])
@@ -80,7 +80,10 @@ def extract_invoice_data_textract(file_bytes):
     Use AWS Textract (with fallback to image conversion) to extract invoice fields.
     Returns a dictionary of extracted fields.
     """
-    response = analyze_document(file_bytes)
+    return textract_fields(analyze_document(file_bytes))
+
+def textract_fields(response):
+    """Map a Textract AnalyzeDocument response to invoice fields."""
     kvs = parse_textract_response(response)
     
     # Map Textract keys to desired fields.
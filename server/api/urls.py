@@ -2,27 +2,48 @@
 from django.urls import path, include
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 from .views import (
+    ArchivedInvoiceViewSet,
     CustomUserViewSet, 
     InvoiceViewSet, 
     VendorViewSet, 
-    InvoiceUploadView, 
+    login_view,
+    zone_stats,
+    admission_stats,
+    scheduler_stats,
+    cache_stats
+)
+from .async_views import (
+    chunked_upload,
+    finalize_chunked_upload,
+    invoice_list,
     pending_invoices,
-    login_view
+    start_chunked_upload,
+    upload_invoice,
+    vendor_list,
 )
 from rest_framework.routers import DefaultRouter
-from django.conf import settings
-from django.conf.urls.static import static
 
 router = DefaultRouter()
 router.register(r'users', CustomUserViewSet, basename='users')
 router.register(r'invoices', InvoiceViewSet, basename='invoice')
 router.register(r'vendors', VendorViewSet, basename='vendor')
+router.register(r'archived-invoices', ArchivedInvoiceViewSet, basename='archived-invoice')
 
 urlpatterns = [
+    # Async list routes; they come first so they shadow the router's list URLs.
+    path("invoices/", invoice_list, name="invoice-list"),
+    path("vendors/", vendor_list, name="vendor-list"),
     path("", include(router.urls)),
     path("token/", TokenObtainPairView.as_view(), name="token_obtain_pair"),
     path("token/refresh/", TokenRefreshView.as_view(), name="token_refresh"),
-    path("upload_invoice/", InvoiceUploadView.as_view(), name="upload_invoice"),
+    path("upload_invoice/", upload_invoice, name="upload_invoice"),
+    path("uploads/", start_chunked_upload, name="chunked_upload_start"),
+    path("uploads/<uuid:upload_id>/", chunked_upload, name="chunked_upload"),
+    path("uploads/<uuid:upload_id>/finalize/", finalize_chunked_upload, name="chunked_upload_finalize"),
     path("pending_invoices/", pending_invoices, name="pending_invoices"),
     path("login/", login_view, name="login"),
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+    path("extraction/zone_stats/", zone_stats, name="zone_stats"),
+    path("extraction/admission/", admission_stats, name="admission_stats"),
+    path("extraction/scheduler/", scheduler_stats, name="scheduler_stats"),
+    path("cache/stats/", cache_stats, name="cache_stats"),
+]
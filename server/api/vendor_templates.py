@@ -0,0 +1,244 @@
+"""
+Per-vendor layout templates learned from past extractions.
+
+When the zoned OCR pass resolves an invoice, the page boxes and anchor labels
+where its fields were found are kept as a candidate template for the vendor.
+The candidate is confirmed once a reviewer moves that invoice out of
+"Pending for review" without correcting the extracted values. Later uploads
+are matched to a confirmed template of their own site's vendors by a
+perceptual hash of the page header, and only the template's boxes are OCR'd.
+Templates that keep failing lose confidence and are evicted.
+
+The hash is split into FINGERPRINT_MAX_DISTANCE + 1 bands, stored as indexed
+TemplateBand rows when a template is confirmed. Two hashes that differ in at
+most FINGERPRINT_MAX_DISTANCE bits cannot differ in every band, so matching
+fetches only the templates sharing a band with the upload and compares their
+full hashes, however many templates the site has.
+
+The OCR helpers are imported inside the functions that use them: those only
+run within extraction, while web processes that merely record and confirm
+templates never load the OCR stack.
+"""
+import difflib
+import logging
+import re
+
+from django.db import transaction
+
+from .extraction_fields import REQUIRED_FIELDS
+from .models import TemplateBand, VendorTemplate
+
+logger = logging.getLogger(__name__)
+
+FINGERPRINT_SIZE = 8  # 8x8 difference hash -> 64 bits
+FINGERPRINT_MAX_DISTANCE = 8  # Max differing bits for two headers to match
+FINGERPRINT_BITS = FINGERPRINT_SIZE * FINGERPRINT_SIZE
+FINGERPRINT_BANDS = FINGERPRINT_MAX_DISTANCE + 1  # Pigeonhole: a match agrees on a whole band
+VENDOR_MATCH_RATIO = 0.8  # Min similarity of the vendor line to its anchor
+BOX_PADDING = (0.02, 0.01, 0.15, 0.01)  # left, top, right, bottom, as page fractions
+CONFIDENCE_DECAY = 0.25  # Weight of the latest outcome in the confidence average
+TEMPLATE_MIN_CONFIDENCE = 0.5  # Templates below this are evicted
+
+VALUE_PATTERNS = {
+    "invoice_number": r"\b([A-Z0-9\-]*\d[A-Z0-9\-]*)\b",
+    "invoice_date": r"(\d{1,2}[/-]\d{1,2}[/-]\d{2,4})",
+    "amount": r"\$?\s*([\d,]+\.\d{2})",
+}
+
+def header_fingerprint(image):
+    """Difference hash of the page header band, as 16 hex digits."""
+    from .hybrid_invoice_extractor import crop_zone
+    header = crop_zone(image, "header").convert("L").resize((FINGERPRINT_SIZE + 1, FINGERPRINT_SIZE))
+    pixels = list(header.getdata())
+    bits = 0
+    for row in range(FINGERPRINT_SIZE):
+        for col in range(FINGERPRINT_SIZE):
+            offset = row * (FINGERPRINT_SIZE + 1) + col
+            bits = (bits << 1) | (pixels[offset] > pixels[offset + 1])
+    return f"{bits:016x}"
+
+def fingerprint_distance(a, b):
+    return bin(int(a, 16) ^ int(b, 16)).count("1")
+
+def fingerprint_buckets(fingerprint):
+    """The TemplateBand buckets of a fingerprint: each band's bits, tagged with the band number."""
+    bits = int(fingerprint, 16)
+    bounds = [band * FINGERPRINT_BITS // FINGERPRINT_BANDS for band in range(FINGERPRINT_BANDS + 1)]
+    return [
+        (band << 16) | ((bits >> (FINGERPRINT_BITS - end)) & ((1 << (end - start)) - 1))
+        for band, (start, end) in enumerate(zip(bounds, bounds[1:]))
+    ]
+
+def match_template(fingerprint, site_id):
+    """Return the site's confirmed template whose header is closest to fingerprint, if close enough."""
+    best, best_distance = None, FINGERPRINT_MAX_DISTANCE + 1
+    candidates = TemplateBand.objects.filter(site_id=site_id, bucket__in=fingerprint_buckets(fingerprint)).values('template_id')
+    for template in VendorTemplate.objects.filter(pk__in=candidates, confirmed=True).select_related('vendor'):
+        distance = fingerprint_distance(fingerprint, template.fingerprint)
+        if distance < best_distance:
+            best, best_distance = template, distance
+    return best
+
+def ocr_box(image, box):
+    import pytesseract
+    from .hybrid_invoice_extractor import enhanced_ocr
+    width, height = image.size
+    left, top, right, bottom = box
+    region = image.crop((int(left * width), int(top * height), int(right * width), int(bottom * height)))
+    text = pytesseract.image_to_string(region)
+    if not text.strip():
+        text = enhanced_ocr(region)
+    return text
+
+def read_value(field, anchor, text):
+    """Parse a field's value out of the text of its template box."""
+    value_pattern = VALUE_PATTERNS[field]
+    patterns = [value_pattern]
+    if anchor:
+        patterns.insert(0, re.escape(anchor) + r"[:\s#\-]*" + value_pattern)
+    for pattern in patterns:
+        match = re.search(pattern, text, re.IGNORECASE)
+        if match:
+            raw = match.group(1).strip()
+            if field == "invoice_date":
+                from .hybrid_invoice_extractor import parse_date
+                return parse_date(raw)
+            if field == "amount":
+                try:
+                    return f"{float(raw.replace(',', '')):.2f}"
+                except ValueError:
+                    return None
+            return raw
+    return None
+
+def record_template_outcome(template, success):
+    """Fold one extraction outcome into the template's confidence; evict it if too low."""
+    template.uses += 1
+    if not success:
+        template.failures += 1
+    template.confidence = (1 - CONFIDENCE_DECAY) * template.confidence + CONFIDENCE_DECAY * (1.0 if success else 0.0)
+    if template.confidence < TEMPLATE_MIN_CONFIDENCE:
+        logger.info(f"Evicting stale layout template for {template.vendor.vendor_name}")
+        template.delete()
+        return
+    template.save(update_fields=['uses', 'failures', 'confidence', 'updated_at'])
+
+def extract_invoice_data_templated(pages, site_id):
+    """
+    Extract fields by OCR'ing only the boxes of the matching template of the
+    uploading site's vendors. Returns None when no template matches (or no
+    site is given) or the template could not read every required field.
+    """
+    if site_id is None:
+        return None
+    template = match_template(header_fingerprint(pages[0]), site_id)
+    if template is None:
+        return None
+
+    vendor_spec = template.field_boxes["vendor_name"]
+    vendor_text = " ".join(ocr_box(pages[vendor_spec["page"]], vendor_spec["box"]).split())
+    ratio = difflib.SequenceMatcher(None, vendor_text.lower(), vendor_spec["anchor"].lower()).ratio()
+    if ratio < VENDOR_MATCH_RATIO:
+        # A look-alike header from another vendor; not the template's fault.
+        return None
+
+    texts = [vendor_text]
+    values = {"vendor_name": template.vendor.vendor_name}
+    for field, spec in template.field_boxes.items():
+        if field == "vendor_name":
+            continue
+        text = ocr_box(pages[spec["page"]], spec["box"])
+        texts.append(text)
+        value = read_value(field, spec.get("anchor"), text)
+        if value:
+            values[field] = value
+
+    success = all(field in values for field in REQUIRED_FIELDS)
+    record_template_outcome(template, success)
+    if not success:
+        return None
+    from .hybrid_invoice_extractor import extract_invoice_fields_universal
+    fields = extract_invoice_fields_universal("\n".join(texts))
+    fields.update(values)
+    fields["layout"] = {"template_id": template.id}
+    fields["ocr"] = {"text": "\n".join(texts), "complete": False}
+    return fields
+
+def layout_template(layout):
+    """The template an extraction's layout says read the values, if it still exists."""
+    template_id = (layout or {}).get("template_id")
+    if template_id is None:
+        return None
+    return VendorTemplate.objects.filter(pk=template_id).first()
+
+def invoice_values(invoice):
+    return {
+        "invoice_number": invoice.invoice_number,
+        "invoice_date": str(invoice.invoice_date)[:10],
+        "amount": f"{float(invoice.amount):.2f}",
+    }
+
+def _padded(box):
+    left, top, right, bottom = box
+    pad_left, pad_top, pad_right, pad_bottom = BOX_PADDING
+    return [max(0.0, left - pad_left), max(0.0, top - pad_top), min(1.0, right + pad_right), min(1.0, bottom + pad_bottom)]
+
+def remember_layout(vendor, invoice, layout):
+    """Store the layout found for a newly uploaded invoice as the vendor's candidate template."""
+    if not layout or "fingerprint" not in layout:
+        return
+    field_boxes = layout.get("fields", {})
+    if any(field not in field_boxes for field in REQUIRED_FIELDS):
+        return
+    if VendorTemplate.objects.filter(vendor=vendor, confirmed=True).exists():
+        return
+    field_boxes = {
+        field: {**spec, "box": _padded(spec["box"])}
+        for field, spec in field_boxes.items()
+    }
+    VendorTemplate.objects.update_or_create(
+        vendor=vendor,
+        defaults={
+            "site_id": vendor.site_id,
+            "fingerprint": layout["fingerprint"],
+            "field_boxes": field_boxes,
+            "sample_values": invoice_values(invoice),
+            "source_invoice": invoice,
+            "confirmed": False,
+            "confidence": 1.0,
+            "uses": 0,
+            "failures": 0,
+        },
+    )
+
+def penalize_corrected_template(invoice, extracted_values):
+    """
+    Count a reviewer's correction of template-read values as a failure of the
+    template. Each invoice is judged once: the link to the template is cleared.
+    """
+    template = invoice.extracted_by_template
+    if template is None or invoice_values(invoice) == extracted_values:
+        return
+    type(invoice).objects.filter(pk=invoice.pk).update(extracted_by_template=None)
+    invoice.extracted_by_template = None
+    logger.info(f"Reviewer corrected values read by the layout template for {template.vendor.vendor_name}")
+    record_template_outcome(template, False)
+
+def confirm_template(invoice):
+    """
+    Confirm the candidate template learned from a reviewed invoice. If the
+    reviewer had to correct the extracted values, the layout is discarded.
+    """
+    template = VendorTemplate.objects.filter(source_invoice=invoice, confirmed=False).first()
+    if template is None:
+        return
+    if template.sample_values != invoice_values(invoice):
+        template.delete()
+        return
+    with transaction.atomic():
+        template.confirmed = True
+        template.save(update_fields=['confirmed', 'updated_at'])
+        TemplateBand.objects.bulk_create(
+            TemplateBand(bucket=bucket, template=template, site_id=template.site_id)
+            for bucket in fingerprint_buckets(template.fingerprint)
+        )
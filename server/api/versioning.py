@@ -0,0 +1,184 @@
+"""
+Conditional GET and delta listings driven by the per-resource change counters.
+
+A listing's weak ETag is built from the versions of the resources it reads
+plus its query string, so answering If-None-Match only reads the tiny
+ResourceVersion table. Clients can also pass ?changed_since=<versions>
+(taken from the X-Resource-Version header of an earlier response) to receive
+only the rows written, and the ids deleted, after those versions. The token
+holds one version per resource the listing reads, dot-separated ("12.7" for
+invoices and their vendors), so an invoice whose vendor was edited counts as
+changed. A missing trailing version counts as 0.
+
+Tombstones are pruned after DELETED_RECORD_RETENTION_DAYS (see
+prune_deleted_records()). A delta older than the pruned versions cannot list
+its deletions and answers 410 Gone: the client reloads the full listing.
+
+Counters are kept per site (api/tenancy.py), so callers pass site-qualified
+resource names such as "invoice@1".
+
+The a-prefixed functions are the async-ORM counterparts used by the async
+listing views.
+"""
+import hashlib
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Max, Q
+from django.http import JsonResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from rest_framework.exceptions import APIException, ValidationError
+from rest_framework.response import Response
+
+from .models import DeletedRecord, ResourceVersion
+from .response_cache import get_page, store_page
+from .tenancy import site_resources, user_site_id
+
+def current_versions(resources):
+    """Return {resource: (version, updated_at)}; unknown resources report version 0."""
+    rows = ResourceVersion.objects.filter(name__in=resources).values_list('name', 'version', 'updated_at')
+    versions = {name: (version, updated_at) for name, version, updated_at in rows}
+    return {name: versions.get(name, (0, None)) for name in resources}
+
+async def acurrent_versions(resources):
+    rows = ResourceVersion.objects.filter(name__in=resources).values_list('name', 'version', 'updated_at')
+    versions = {name: (version, updated_at) async for name, version, updated_at in rows}
+    return {name: versions.get(name, (0, None)) for name in resources}
+
+def listing_validators(request, resources, versions=None):
+    """Weak ETag and Last-Modified timestamp for a listing that reads resources."""
+    if versions is None:
+        versions = current_versions(resources)
+    query = "&".join(sorted(f"{key}={value}" for key, value in request.GET.items()))
+    query_hash = hashlib.sha1(f"{request.get_host()}{request.path}?{query}".encode()).hexdigest()[:12]
+    # No commas: If-None-Match lists are comma-separated.
+    tag = "-".join(f"{name}.{versions[name][0]}" for name in resources)
+    timestamps = [updated_at.timestamp() for _, updated_at in versions.values() if updated_at]
+    last_modified = int(max(timestamps)) if timestamps else None
+    return f'W/"{tag}-{query_hash}"', last_modified, versions
+
+class DeltaExpired(APIException):
+    status_code = 410
+    default_detail = "changed_since predates the retained deletions; reload the full listing."
+    default_code = "delta_expired"
+
+def parse_changed_since(request, resources):
+    """The ?changed_since= token as one version per resource, or None without one."""
+    value = request.GET.get("changed_since")
+    if value is None:
+        return None
+    try:
+        versions = [int(part) for part in value.split(".")]
+    except ValueError:
+        raise ValidationError({"changed_since": "Must be dot-separated integer versions."})
+    if len(versions) > len(resources):
+        raise ValidationError({"changed_since": f"Expected no more than {len(resources)} dot-separated versions."})
+    return versions + [0] * (len(resources) - len(versions))
+
+def changed_rows(queryset, changed_since, relations=()):
+    """
+    Rows of queryset written after changed_since[0], or whose related row
+    (relations[i], a lookup path) was written after changed_since[i + 1].
+    """
+    condition = Q(row_version__gt=changed_since[0])
+    for relation, version in zip(relations, changed_since[1:]):
+        condition |= Q(**{f"{relation}__row_version__gt": version})
+    return queryset.filter(condition)
+
+def deleted_since(resource, version):
+    pruned_through = ResourceVersion.objects.filter(name=resource).values_list('pruned_through', flat=True).first()
+    if version < (pruned_through or 0):
+        raise DeltaExpired()
+    return list(
+        DeletedRecord.objects.filter(resource=resource, version__gt=version).values_list('object_id', flat=True)
+    )
+
+async def adeleted_since(resource, version):
+    pruned_through = await ResourceVersion.objects.filter(name=resource).values_list('pruned_through', flat=True).afirst()
+    if version < (pruned_through or 0):
+        raise DeltaExpired()
+    rows = DeletedRecord.objects.filter(resource=resource, version__gt=version).values_list('object_id', flat=True)
+    return [object_id async for object_id in rows]
+
+def prune_deleted_records(cutoff):
+    """
+    Delete tombstones recorded before cutoff, raising each resource's
+    pruned_through floor to the newest version deleted. Returns how many.
+    """
+    removed = 0
+    floors = DeletedRecord.objects.filter(deleted_at__lt=cutoff).values('resource').annotate(floor=Max('version'))
+    for row in floors:
+        with transaction.atomic():
+            # Together, so a delta never finds tombstones missing below an old floor.
+            ResourceVersion.objects.filter(name=row['resource'], pruned_through__lt=row['floor']).update(
+                pruned_through=row['floor']
+            )
+            removed += DeletedRecord.objects.filter(resource=row['resource'], version__lte=row['floor']).delete()[0]
+    return removed
+
+def stamp_listing(response, etag, last_modified, versions):
+    response["ETag"] = etag
+    if last_modified:
+        response["Last-Modified"] = http_date(last_modified)
+    response["X-Resource-Version"] = ".".join(str(version) for version in versions)
+    response["Cache-Control"] = "private, no-cache"
+    return response
+
+def versioned_response(request, resources, build_response):
+    """
+    Return 304 when the client's validators still match; otherwise serve the
+    page cached under the ETag, or call build_response() and cache its data.
+    The result is stamped with ETag, Last-Modified and the versions of the
+    resources, primary first.
+    """
+    etag, last_modified, versions = listing_validators(request, resources)
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        data = get_page(etag)
+        if data is not None:
+            response = Response(data)
+        else:
+            response = build_response()
+            if response.status_code == 200:
+                store_page(etag, response.data)
+    return stamp_listing(response, etag, last_modified, [versions[name][0] for name in resources])
+
+async def aversioned_response(request, resources, build_data):
+    """versioned_response() for async views: build_data is a coroutine function returning the payload."""
+    versions = await acurrent_versions(resources)
+    etag, last_modified, versions = listing_validators(request, resources, versions)
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        data = get_page(etag)
+        if data is None:
+            data = await build_data()
+            store_page(etag, data)
+        response = JsonResponse(data, safe=False, encoder=DjangoJSONEncoder)
+    return stamp_listing(response, etag, last_modified, [versions[name][0] for name in resources])
+
+class VersionedListMixin:
+    """
+    ViewSet mixin adding conditional GET and ?changed_since= deltas to list().
+    version_resources names the primary resource first, then any resource the
+    serialized rows embed; their counters are read for the user's site.
+    version_relations holds the lookup path from a row to each embedded
+    resource, so a delta also returns rows whose embedded row changed.
+    """
+    version_resources = ()
+    version_relations = ()
+
+    def list(self, request, *args, **kwargs):
+        resources = site_resources(self.version_resources, user_site_id(request.user))
+
+        def build():
+            changed_since = parse_changed_since(request, resources)
+            if changed_since is None:
+                return super(VersionedListMixin, self).list(request, *args, **kwargs)
+            deleted = deleted_since(resources[0], changed_since[0])
+            queryset = changed_rows(self.filter_queryset(self.get_queryset()), changed_since, self.version_relations)
+            return Response({
+                "changed": self.get_serializer(queryset, many=True).data,
+                "deleted": deleted,
+            })
+        return versioned_response(request, resources, build)
@@ -2,18 +2,35 @@
 from django.contrib.auth import get_user_model
 from django.contrib.auth.hashers import make_password
 from rest_framework import viewsets, status, serializers
-from rest_framework.decorators import api_view, permission_classes, authentication_classes
+from rest_framework.decorators import action, api_view, permission_classes, authentication_classes
+from rest_framework.generics import get_object_or_404
 from rest_framework.response import Response
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework_simplejwt.tokens import RefreshToken
-from .models import CustomUser, Invoice, Vendor
-from .serializers import CustomUserSerializer, UserSerializer, InvoiceSerializer, VendorSerializer
+from .models import ArchivedInvoice, CustomUser, Invoice, Vendor, normalize_login_email
+from .serializers import ArchivedInvoiceSerializer, CustomUserSerializer, UserSerializer, InvoiceSerializer, VendorSerializer
 from rest_framework.parsers import MultiPartParser, FormParser
-from rest_framework.views import APIView
 import json
 import logging
+import os
 from datetime import datetime
-from .hybrid_invoice_extractor import extract_invoice_data_hybrid
+from django.conf import settings
+from django.db import transaction
+from django.db.models import ProtectedError
+from django.http import Http404
+from .archive import serve_archived_file, wants_archived
+from .response_cache import get_cache_stats
+from .admission import get_admission_stats
+from .scheduler import extraction_scheduler
+from .vendor_templates import confirm_template, invoice_values, penalize_corrected_template
+from .file_delivery import PassthroughRenderer, file_version, serve_file, serve_stored_file
+from .previews import PREVIEW_WIDTH, get_preview
+from .tenancy import SiteScopedMixin, scope_to_user, user_site_id
+from .versioning import VersionedListMixin
+from .filters import InvoiceFilterBackend
+from .search import parse_search_params, search_invoice_ids, snippet
+from .duplicates import UNAPPROVED_STATUSES, open_duplicate_flags
+from .ocr_daemon import OCRDaemonUnavailable, daemon_stats
 
 logger = logging.getLogger(__name__)
 
@@ -23,10 +40,12 @@ logger = logging.getLogger(__name__)
 @api_view(["POST"])
 @permission_classes([AllowAny])
 def login_view(request):
-    email = request.data.get("email")
+    email = normalize_login_email(request.data.get("email"))
     password = request.data.get("password")
+    if not email:
+        return Response({"error": "Invalid credentials"}, status=status.HTTP_401_UNAUTHORIZED)
     try:
-        user = get_user_model().objects.get(email=email)
+        user = get_user_model().objects.get(email_normalized=email)
     except get_user_model().DoesNotExist:
         return Response({"error": "Invalid credentials"}, status=status.HTTP_401_UNAUTHORIZED)
     if not user.check_password(password):
@@ -39,10 +58,11 @@ def login_view(request):
             "id": user.id,
             "email": user.email,
             "role": user.role,
+            "site": user.site_id,
         }
     })
 
-class CustomUserViewSet(viewsets.ModelViewSet):
+class CustomUserViewSet(SiteScopedMixin, viewsets.ModelViewSet):
     queryset = get_user_model().objects.all()
     serializer_class = CustomUserSerializer
     permission_classes = [IsAuthenticated]
@@ -50,24 +70,48 @@ class CustomUserViewSet(viewsets.ModelViewSet):
 # -------------------------------
 # Vendor Endpoints
 # -------------------------------
-class VendorViewSet(viewsets.ModelViewSet):
+class VendorViewSet(SiteScopedMixin, VersionedListMixin, viewsets.ModelViewSet):
     queryset = Vendor.objects.all().order_by('-id')
+    version_resources = ("vendor",)
     serializer_class = VendorSerializer
     permission_classes = [IsAuthenticated]
     parser_classes = [MultiPartParser, FormParser]
 
+    def destroy(self, request, *args, **kwargs):
+        try:
+            return super().destroy(request, *args, **kwargs)
+        except ProtectedError:
+            return Response(
+                {"error": "Vendor has archived invoices and cannot be deleted."}, status=status.HTTP_409_CONFLICT,
+            )
+
 # -------------------------------
 # Invoice Endpoints
 # -------------------------------
-class InvoiceViewSet(viewsets.ModelViewSet):
+class InvoiceViewSet(SiteScopedMixin, VersionedListMixin, viewsets.ModelViewSet):
     queryset = Invoice.objects.all().order_by('-created_at')
+    version_resources = ("invoice", "vendor")
+    version_relations = ("vendor",)
     serializer_class = InvoiceSerializer
     permission_classes = [IsAuthenticated]
+    filter_backends = [InvoiceFilterBackend]
     parser_classes = [MultiPartParser, FormParser]
 
+    def retrieve(self, request, *args, **kwargs):
+        """An invoice; with ?include_archived=true, its archived copy once it has moved to the archive."""
+        try:
+            return super().retrieve(request, *args, **kwargs)
+        except Http404:
+            if not wants_archived(request.query_params):
+                raise
+        archived = get_object_or_404(scope_to_user(ArchivedInvoice.objects.select_related("vendor"), request.user), pk=kwargs["pk"])
+        return Response(ArchivedInvoiceSerializer(archived, context=self.get_serializer_context()).data)
+
     def update(self, request, *args, **kwargs):
         partial = kwargs.pop("partial", False)
         instance = self.get_object()
+        was_pending_review = instance.status == "Pending for review"
+        extracted_values = invoice_values(instance) if instance.extracted_by_template_id else None
 
         # Check if vendor_name is provided in the request data.
         vendor_name = request.data.get("vendor_name")
@@ -81,9 +125,31 @@ class InvoiceViewSet(viewsets.ModelViewSet):
         if "vendor_name" in mutable_data:
             mutable_data.pop("vendor_name")
 
+        # Possible re-scans of an existing invoice need an explicit "not_duplicate" before approval.
+        not_duplicate = str(mutable_data.pop("not_duplicate", [""])[0]).lower() in ("1", "true", "yes")
+        approving = instance.status in UNAPPROVED_STATUSES and mutable_data.get("status", instance.status) not in UNAPPROVED_STATUSES
+        if approving and not not_duplicate:
+            possible_duplicates = open_duplicate_flags(instance)
+            if possible_duplicates:
+                return Response({
+                    "error": "Invoice may duplicate an existing invoice; resend with not_duplicate=true to approve.",
+                    "possible_duplicates": possible_duplicates,
+                }, status=status.HTTP_409_CONFLICT)
+
         serializer = self.get_serializer(instance, data=mutable_data, partial=partial)
         serializer.is_valid(raise_exception=True)
-        self.perform_update(serializer)
+        with transaction.atomic():
+            self.perform_update(serializer)
+            # Only an approval that is actually saved dismisses the flags.
+            if approving and not_duplicate:
+                instance.duplicate_flags.filter(dismissed=False).update(dismissed=True)
+
+        # Corrected values count against the template that read them.
+        if extracted_values:
+            penalize_corrected_template(instance, extracted_values)
+        # A reviewed invoice confirms the layout template learned from it.
+        if was_pending_review and instance.status != "Pending for review":
+            confirm_template(instance)
 
         # Optionally, update vendor totals.
         if instance.vendor:
@@ -91,12 +157,96 @@ class InvoiceViewSet(viewsets.ModelViewSet):
 
         return Response(serializer.data)
 
+    @action(detail=False, methods=["get"], url_path="search", url_name="search")
+    def search(self, request):
+        """Ranked full-text search over the invoices' OCR text, narrowed by vendor, status and date."""
+        query = request.query_params.get("q", "")
+        filters, limit = parse_search_params(request.query_params)
+        filters["site_id"] = user_site_id(request.user)
+        hits = search_invoice_ids(query, filters, limit)
+        invoices = self.get_queryset().select_related("vendor", "ocr_text").in_bulk([pk for pk, _ in hits])
+        results = []
+        for pk, score in hits:
+            invoice = invoices.get(pk)
+            if invoice is None:
+                continue
+            results.append({
+                "score": round(score, 4),
+                "snippet": snippet(invoice.ocr_text.text, query),
+                "invoice": self.get_serializer(invoice).data,
+            })
+        return Response({"query": query, "results": results})
+
+    @action(detail=True, methods=["get"], url_path="duplicates", url_name="duplicates")
+    def duplicates(self, request, pk=None):
+        """Stored invoices this one may be a re-scan of, until a reviewer dismisses them."""
+        return Response({"possible_duplicates": open_duplicate_flags(self.get_object())})
+
+    @action(detail=True, methods=["get"], url_path="file", url_name="file", renderer_classes=[PassthroughRenderer])
+    def file(self, request, pk=None):
+        """Serve the invoice's file with ETag, conditional GET and Range support."""
+        return serve_stored_file(request, self.get_object().invoice_file)
+
+    @action(detail=True, methods=["get"], url_path="preview", url_name="preview", renderer_classes=[PassthroughRenderer])
+    def preview(self, request, pk=None):
+        """Serve a small WebP thumbnail of the invoice's first page."""
+        invoice_file = self.get_object().invoice_file
+        path, key = get_preview(invoice_file)
+        version = request.GET.get("v")
+        return serve_file(
+            request,
+            path,
+            os.stat(path),
+            etag=f'"{key}-{PREVIEW_WIDTH}"',
+            content_type="image/webp",
+            filename=os.path.basename(path),
+            immutable=bool(version) and version == file_version(invoice_file.name),
+        )
+
+class ArchivedInvoiceViewSet(SiteScopedMixin, viewsets.ReadOnlyModelViewSet):
+    """Invoices moved to the archive by `manage.py archive_invoices`; filtered like live ones."""
+    queryset = ArchivedInvoice.objects.select_related('vendor', 'archived_file').order_by('-created_at')
+    serializer_class = ArchivedInvoiceSerializer
+    permission_classes = [IsAuthenticated]
+    filter_backends = [InvoiceFilterBackend]
+
+    @action(detail=True, methods=["get"], url_path="file", url_name="file", renderer_classes=[PassthroughRenderer])
+    def file(self, request, pk=None):
+        """Serve the archived file, decompressed, with ETag and conditional GET."""
+        return serve_archived_file(request, self.get_object())
+
+# -------------------------------
+# Extraction and Cache Statistics
+# -------------------------------
+@api_view(["GET"])
+@permission_classes([IsAuthenticated])
+def zone_stats(request):
+    """Zone hit/miss counters of the zoned OCR pass, for tuning OCR_ZONES."""
+    if settings.OCR_DAEMON_SOCKET:
+        try:
+            return Response(daemon_stats()["zone_stats"])
+        except OCRDaemonUnavailable as e:
+            return Response({"error": str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+    from .hybrid_invoice_extractor import get_zone_stats
+    return Response(get_zone_stats())
+
+@api_view(["GET"])
+@permission_classes([IsAuthenticated])
+def admission_stats(request):
+    """In-flight OCR pages, queue depth and rejection counters of upload admission in this process."""
+    return Response(get_admission_stats())
+
 @api_view(["GET"])
 @permission_classes([IsAuthenticated])
-def pending_invoices(request):
-    invoices = Invoice.objects.filter(status="Pending for review")
-    serializer = InvoiceSerializer(invoices, many=True)
-    return Response(serializer.data)
+def scheduler_stats(request):
+    """Queue length and per-class wait-time histograms of the extraction scheduler in this process."""
+    return Response(extraction_scheduler().get_stats())
+
+@api_view(["GET"])
+@permission_classes([IsAuthenticated])
+def cache_stats(request):
+    """Hit/miss counters of the vendor payload and listing page caches in this process."""
+    return Response(get_cache_stats())
 
 # -------------------------------
 # Invoice File Upload Endpoint
@@ -128,107 +278,3 @@ def process_invoice_file(invoice_file):
         'amount': 100.00,
         'status': 'Pending for review',
     }
-
-from django.db import IntegrityError
-
-class InvoiceUploadView(APIView):
-    parser_classes = [MultiPartParser, FormParser]
-    permission_classes = [IsAuthenticated]
-
-    def post(self, request, *args, **kwargs):
-        invoice_file = request.FILES.get('invoice_file')
-        if not invoice_file:
-            return Response({"error": "No file uploaded."}, status=400)
-        
-        try:
-            # Extract data from invoice
-            extracted = extract_invoice_data_hybrid(invoice_file)
-            
-            # Create or update vendor
-            vendor, created = Vendor.objects.get_or_create(
-                vendor_name=extracted['vendor_name'],
-                defaults={
-                    "account_number": extracted.get('account_number'),
-                    "contact_email": extracted.get('contact_email'),
-                    "contact_phone": extracted.get('contact_phone'),
-                    "address_line_1": extracted.get('address_line_1'),
-                    "address_line_2": extracted.get('address_line_2'),
-                    "city": extracted.get('city'),
-                    "state": extracted.get('state'),
-                    "zip_code": extracted.get('zip_code'),
-                    "bank_account_number": extracted.get('bank_account_number'),
-                    "routing_number": extracted.get('routing_number'),
-                    "bank_name": extracted.get('bank_name'),
-                    "account_payee": extracted.get('account_payee'),
-                    "category": self.determine_vendor_category(extracted['vendor_name'])
-                }
-            )
-            
-            # Check if an invoice with this vendor and invoice_number already exists (case-insensitive)
-            existing_invoice = Invoice.objects.filter(
-                vendor=vendor,
-                invoice_number__iexact=extracted['invoice_number']
-            ).first()
-            
-            if existing_invoice:
-                return Response({
-                "message": "Invoice already exists",
-                "invoice_id": existing_invoice.id,
-                "is_new": False
-                }, status=200)
-            
-            # Try to create the invoice
-            try:
-                invoice = Invoice.objects.create(
-                    vendor=vendor,
-                    invoice_number=extracted['invoice_number'],
-                    invoice_date=extracted['invoice_date'],
-                    amount=extracted['amount'],
-                    status="Pending for review",
-                    invoice_file=invoice_file
-                )
-            except IntegrityError:
-                # If a duplicate is raised, fetch the existing invoice and return it
-                existing_invoice = Invoice.objects.filter(
-                    vendor=vendor,
-                    invoice_number__iexact=extracted['invoice_number']
-                ).first()
-                if existing_invoice:
-                    return Response({
-                    "message": "Invoice already exists",
-                    "invoice_id": existing_invoice.id,
-                    "is_new": False
-                    }, status=200)
-                else:
-                    raise
-            
-            vendor.update_totals()
-            
-            return Response({
-            "message": "Invoice processed successfully",
-            "invoice_id": invoice.id,
-            "is_new": True,
-            "extracted_data": extracted
-            }, status=201)
-            
-        except Exception as e:
-            logger.error(f"Invoice processing error: {str(e)}", exc_info=True)
-            return Response({
-                "error": "Failed to process invoice",
-                "details": str(e)
-            }, status=400)
-    
-    def determine_vendor_category(self, vendor_name):
-        """Simple heuristic to categorize vendors"""
-        vendor_name = vendor_name.lower()
-        categories = {
-            'food': ['meat', 'produce', 'dairy', 'seafood', 'bakery'],
-            'beverage': ['wine', 'beer', 'liquor', 'beverage'],
-            'supplies': ['paper', 'cleaning', 'chemical', 'uniform'],
-            'equipment': ['kitchen', 'appliance', 'repair']
-        }
-        for category, keywords in categories.items():
-            if any(keyword in vendor_name for keyword in keywords):
-                return category.capitalize()
-        return "Other"
-
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 import django
 from datetime import timedelta
@@ -26,7 +27,9 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 SECRET_KEY = "django-insecure-^pz_0mt*e)c6w!@0c)0illh9dwc(l+7b-!qxm1$j5=$2it-(7q"
 
 # SECURITY WARNING: dont run with debug turned on in production!
-DEBUG = True
+# With DEBUG on Django also keeps every SQL query of a request in memory; set
+# DJANGO_DEBUG=0 when measuring or serving real traffic.
+DEBUG = os.environ.get("DJANGO_DEBUG", "1").lower() in ("1", "true", "yes")
 
 ALLOWED_HOSTS = []
 
@@ -47,13 +50,17 @@ INSTALLED_APPS = [
     "api",
     "rest_framework",
     "rest_framework.authtoken",
-    "debug_toolbar",
     "dj_rest_auth",
 ]
 
+# Each restaurant is a django.contrib.sites Site; users, vendors and invoices
+# belong to one (api/tenancy.py). SITE_ID is the site that existing rows,
+# new users and command-line imports default to.
+SITE_ID = 1
+
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": (
-        "rest_framework_simplejwt.authentication.JWTAuthentication",
+        "api.auth_backends.CachedJWTAuthentication",
         "rest_framework.authentication.SessionAuthentication",
     ),
     "DEFAULT_PERMISSION_CLASSES": (
@@ -68,13 +75,18 @@ SIMPLE_JWT = {
     "ACCESS_TOKEN_LIFETIME": datetime.timedelta(minutes=60),
     "REFRESH_TOKEN_LIFETIME": datetime.timedelta(days=7),
     "ROTATE_REFRESH_TOKENS": True,
-    "BLACKLIST_AFTER_ROTATION": True,
+    # The token_blacklist app is not installed, and with it every refresh
+    # would write to the DB; rotation stays stateless instead.
+    "BLACKLIST_AFTER_ROTATION": False,
+    "TOKEN_REFRESH_SERIALIZER": "api.auth_backends.CachedTokenRefreshSerializer",
     "ALGORITHM": "HS256",
     "SIGNING_KEY": SECRET_KEY,
     "AUTH_HEADER_TYPES": ("Bearer",),
 }
 
 MIDDLEWARE = [
+    # Outermost, so sampled profiles cover the whole middleware stack.
+    "api.profiling.ProfilingMiddleware",
     "corsheaders.middleware.CorsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
@@ -83,13 +95,34 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
-    "debug_toolbar.middleware.DebugToolbarMiddleware",
 ]
 
+# Sampled request profiling (api/profiling.py). A fraction
+# PROFILING_SAMPLE_RATE of requests, plus any sent with an X-Profile token from
+# `manage.py profile_report --issue-token`, is recorded under PROFILING_DIR,
+# which keeps the newest PROFILING_MAX_RECORDS. ASGI requests are profiled by
+# sampling stacks every PROFILING_STACK_INTERVAL seconds.
+PROFILING_SAMPLE_RATE = float(os.environ.get("PROFILING_SAMPLE_RATE", 0))
+PROFILING_DIR = BASE_DIR / "profiles"
+PROFILING_MAX_RECORDS = 500
+PROFILING_TOKEN_MAX_AGE = 3600
+PROFILING_STACK_INTERVAL = 0.005
+
+# The debug toolbar is opt-in (DEBUG_TOOLBAR=1, with DEBUG on): installed, it
+# instruments every request.
+DEBUG_TOOLBAR = DEBUG and os.environ.get("DEBUG_TOOLBAR") == "1"
+if DEBUG_TOOLBAR:
+    INSTALLED_APPS.append("debug_toolbar")
+    MIDDLEWARE.append("debug_toolbar.middleware.DebugToolbarMiddleware")
+
 INTERNAL_IPS = [
     "127.0.0.1",  # ✅ This is required for Debug Toolbar to work
 ]
 
+# The test runner turns DEBUG off, so the toolbar never renders there; let
+# `manage.py test` run with it installed.
+DEBUG_TOOLBAR_CONFIG = {"IS_RUNNING_TESTS": False}
+
 ROOT_URLCONF = "server.urls"
 
 TEMPLATES = [
@@ -129,6 +162,63 @@ DATABASES = {
 }
 
 
+# Threads running OCR for the async upload endpoint (api/async_views.py).
+# Tesseract and poppler run as subprocesses, so these threads mostly wait.
+EXTRACTION_WORKERS = int(os.environ.get("EXTRACTION_WORKERS", os.cpu_count() or 2))
+
+# Extraction scheduling (api/scheduler.py). Jobs run cheapest first, costed in
+# pages plus SCHEDULER_COST_PER_MB per megabyte; bulk jobs count
+# SCHEDULER_BULK_PENALTY pages more, and every second of waiting takes
+# SCHEDULER_AGING_RATE pages off.
+SCHEDULER_COST_PER_MB = 0.5
+SCHEDULER_BULK_PENALTY = 50
+SCHEDULER_AGING_RATE = 0.5
+
+# Extraction daemon (manage.py run_ocr_daemon, Unix only). When
+# OCR_DAEMON_SOCKET is set, web processes send the paths of uploaded files to
+# the daemon instead of loading pdf2image, tesseract and the NER model
+# themselves. Daemon workers are replaced after OCR_WORKER_MAX_JOBS jobs or
+# once their RSS exceeds OCR_WORKER_MAX_RSS_MB; a job running longer than
+# OCR_JOB_TIMEOUT seconds has its worker killed. Clients give up after
+# OCR_DAEMON_TIMEOUT seconds, which includes waiting for a free worker. Run
+# the daemon as a user in the web server's group: the files it is sent are made
+# group-readable, and FILE_UPLOAD_TEMP_DIR must be group-searchable.
+OCR_DAEMON_SOCKET = os.environ.get("OCR_DAEMON_SOCKET") or None
+OCR_DAEMON_WORKERS = int(os.environ.get("OCR_DAEMON_WORKERS", os.cpu_count() or 2))
+OCR_WORKER_MAX_JOBS = 200
+OCR_WORKER_MAX_RSS_MB = 1500
+OCR_JOB_TIMEOUT = 120
+OCR_DAEMON_TIMEOUT = 300
+
+# Admission control for uploads (api/admission.py), in estimated pages of OCR
+# work in flight per web process. Over a limit an upload waits up to
+# OCR_ADMISSION_WAIT seconds, then gets 429 with a Retry-After derived from
+# OCR_SECONDS_PER_PAGE.
+OCR_MAX_INFLIGHT_PAGES = 8 * EXTRACTION_WORKERS
+OCR_MAX_USER_INFLIGHT_PAGES = 4 * EXTRACTION_WORKERS
+OCR_ADMISSION_WAIT = 2
+OCR_SECONDS_PER_PAGE = 3
+
+
+# Caches
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    # Serialized vendor payloads and listing pages (api/response_cache.py).
+    # Any backend works; FileBasedCache or a shared cache lets worker
+    # processes share entries.
+    "api": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "api-responses",
+        "TIMEOUT": 300,
+        "OPTIONS": {"MAX_ENTRIES": 5000},
+    },
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -174,6 +264,8 @@ CORS_ALLOW_HEADERS = [
     "user-agent",
     "x-csrftoken",
     "x-requested-with",
+    "upload-offset",
+    "upload-checksum",
 ]
 
 # Internationalization
@@ -183,6 +275,7 @@ AUTH_USER_MODEL = "api.CustomUser"
 
 AUTHENTICATION_BACKENDS = [
     "django.contrib.auth.backends.ModelBackend",
+    "api.auth_backends.EmailAuthBackend",
 ]
 
 LANGUAGE_CODE = "en-us"
@@ -196,6 +289,47 @@ USE_TZ = True
 # MEDIA_URL = '/media/'
 # MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Uploads are streamed to disk and hashed on arrival (see api/storage.py), so
+# storing them is a rename into the content-addressed invoices/ tree.
+FILE_UPLOAD_HANDLERS = [
+    "api.storage.HashingFileUploadHandler",
+]
+FILE_UPLOAD_TEMP_DIR = BASE_DIR / "invoices" / "incoming"
+
+# Resumable chunked uploads (/api/uploads/, see api/chunked_uploads.py). Parts
+# are assembled under CHUNKED_UPLOAD_DIR, which must be on the same filesystem
+# as the invoices/ tree; sessions idle longer than CHUNKED_UPLOAD_EXPIRY are
+# discarded.
+CHUNKED_UPLOAD_DIR = FILE_UPLOAD_TEMP_DIR / "chunked"
+CHUNKED_UPLOAD_MAX_BYTES = 500 * 1024 * 1024
+CHUNKED_UPLOAD_MAX_CHUNK_BYTES = 16 * 1024 * 1024
+CHUNKED_UPLOAD_MAX_SESSIONS = 20  # Open sessions per user
+CHUNKED_UPLOAD_EXPIRY = timedelta(hours=24)
+
+# Invoice files are served by /api/invoices/<id>/file/. Set to "x-sendfile"
+# (Apache/lighttpd) or "x-accel-redirect" (nginx, with an internal location at
+# INVOICE_FILE_ACCEL_PREFIX aliased to the media root) to let the web server
+# send the bytes.
+INVOICE_FILE_OFFLOAD = None
+INVOICE_FILE_ACCEL_PREFIX = "/protected-invoices/"
+
+# Tombstones of deleted rows answer ?changed_since= deltas (api/versioning.py).
+# `manage.py prune_deleted_records` drops those older than
+# DELETED_RECORD_RETENTION_DAYS; a client whose delta is older reloads in full.
+DELETED_RECORD_RETENTION_DAYS = 30
+
+# Invoice archive (api/archive.py, `manage.py archive_invoices`). Closed and
+# Paid invoices closed more than ARCHIVE_AFTER_DAYS ago move to the
+# ArchivedInvoice table, and their files into compressed monthly bundles under
+# ARCHIVE_ROOT (zstd when the zstandard package is installed, zlib otherwise).
+ARCHIVE_AFTER_DAYS = 365
+ARCHIVE_ROOT = BASE_DIR / "archive"
+
+# First-page thumbnails served by /api/invoices/<id>/preview/, kept as an LRU
+# cache bounded in bytes.
+PREVIEW_ROOT = BASE_DIR / "previews"
+PREVIEW_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
 
 # Static files (CSS, JavaScript, Images)
 # https://docs.djangoproject.com/en/5.1/howto/static-files/